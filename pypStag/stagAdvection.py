@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:30:00 2026
+
+@author: Alexandre Janin
+@Aim: Advection of particles in the velocity fields of StagData objects
+"""
+
+
+"""
+This script contains the particle tracer of pypStag: large batches of particles
+are advected (Runge-Kutta 2 or 4) in one velocity StagData object (streamlines)
+or in the successive snapshots of a StagCloudData (pathlines, the velocity
+being linearly interpolated in time between two snapshots). The velocity is
+interpolated on the particles with the sparse trilinear operator of stagLocator
+(analytic location on the Yin-Yang grid), so that each Runge-Kutta stage is a
+few vectorized operations on all the particles, without loop on the particles.
+The trajectories can be exported as VTK polylines (.vtk) or in a .h5 file.
+"""
+
+
+import numpy as np
+from time import time
+from .stagLocator import get_locator, trilinear_operator
+from .stagError import fieldTypeError, StagComputationalError
+
+
+
+class ParticleTracer:
+    """
+    Tracer of a batch of particles in the velocity fields of StagData objects.
+    The positions of the particles are recorded every 'save_every' time steps
+    in self.traj (list of np.ndarray of shape (npart,3), simple precision) at
+    the times self.t.
+    """
+    def __init__(self,x,y,z,method='rk4',time_scale=1,verbose=True):
+        """
+        <i> : x,y,z = np.ndarray, initial cartesian coordinates of the particles
+              method = str, time integration scheme in ('rk2','rk4')
+              time_scale = int/float, factor such as time_scale*velocity*dt is in the unit
+                           of the coordinates, dt being in the unit of stagData.simuAge
+                           (1 for non-dimensional outputs)
+              verbose = bool, controls inhibition of the internal message
+        """
+        if method not in ('rk2','rk4'):
+            raise StagComputationalError("Unknown integration scheme: '"+str(method)+"', must be in ('rk2','rk4')")
+        self.pName      = 'ParticleTracer'
+        self.verbose    = verbose
+        self.method     = method
+        self.time_scale = time_scale
+        self.pos = np.stack([np.asarray(c,dtype=np.float64).flatten() for c in (x,y,z)],axis=1)
+        self.npart  = self.pos.shape[0]
+        self.active = np.ones(self.npart,dtype=bool) # False for the particles that left the grid
+        self.t    = []   # times of the recorded positions
+        self.traj = []   # recorded positions
+        self.locator = None
+        self.rlim = None # radial (or vertical) extent of the grid nodes
+        self.geometry = None
+
+
+    def im(self,textMessage):
+        """Print verbose internal message. This function depends on the
+        argument of self.verbose. If self.verbose == True then the message
+        will be displayed on the terminal.
+        <i> : textMessage = str, message to display
+        """
+        if self.verbose == True:
+            print('>> '+self.pName+'| '+textMessage)
+
+
+    def __set_grid(self,stagData):
+        """
+        Builds (once per grid) the locator of the grid of stagData.
+        """
+        if stagData.fieldType != 'Velocity':
+            raise fieldTypeError('Velocity')
+        if self.locator is None or self.locator.nnodes != np.size(stagData.x):
+            self.locator = get_locator(stagData)
+            self.locator.verbose = False
+            zc = self.locator.z_coords
+            rcmb = 0 if stagData.geometry == 'cart3D' else stagData.rcmb
+            self.rlim = (rcmb+zc[0],rcmb+zc[-1])
+            self.geometry = stagData.geometry
+
+
+    def __record(self,t):
+        """
+        Records the current positions at the time t.
+        """
+        self.t.append(t)
+        self.traj.append(self.pos.astype(np.float32))
+
+
+    def __velocity(self,pos,fields,a=0):
+        """
+        Interpolates the velocity on the positions pos (N,3): trilinear in space
+        and linear in time between fields[0] and fields[1] (weight a on fields[1]).
+        fields = list of 1 or 2 np.ndarray of shape (3,nnodes).
+        """
+        W,valid = trilinear_operator(self.locator,pos[:,0],pos[:,1],pos[:,2])
+        v = np.stack([W.dot(fields[0][c]) for c in range(3)],axis=1)
+        if len(fields) > 1 and a > 0:
+            v = (1-a)*v+a*np.stack([W.dot(fields[1][c]) for c in range(3)],axis=1)
+        v[~valid] = 0
+        return v*self.time_scale,valid
+
+
+    def __clamp(self,pos):
+        """
+        Keeps the particles in the radial (vertical) extent of the grid.
+        """
+        rmin,rmax = self.rlim
+        if self.geometry == 'cart3D':
+            pos[:,2] = np.clip(pos[:,2],rmin,rmax)
+        else:
+            r = np.sqrt(np.sum(pos**2,axis=1))
+            pos *= (np.clip(r,rmin,rmax)/np.where(r > 0,r,1))[:,None]
+        return pos
+
+
+    def __step(self,fields,h,a0=0,da=0):
+        """
+        Advances the active particles of one time step h. The velocity is
+        taken at the time weights a0 (beginning of the step) to a0+da (end).
+        """
+        act = self.active
+        p = self.pos[act]
+        if self.method == 'rk2':
+            k1,v1 = self.__velocity(p,fields,a0)
+            k2,v2 = self.__velocity(self.__clamp(p+0.5*h*k1),fields,a0+0.5*da)
+            p = p+h*k2
+            valid = np.logical_and(v1,v2)
+        else:
+            k1,v1 = self.__velocity(p,fields,a0)
+            k2,v2 = self.__velocity(self.__clamp(p+0.5*h*k1),fields,a0+0.5*da)
+            k3,v3 = self.__velocity(self.__clamp(p+0.5*h*k2),fields,a0+0.5*da)
+            k4,v4 = self.__velocity(self.__clamp(p+h*k3),fields,a0+da)
+            p = p+h/6*(k1+2*k2+2*k3+k4)
+            valid = v1*v2*v3*v4
+        p = self.__clamp(p)
+        p[~valid] = self.pos[act][~valid] # particles leaving the grid are frozen at their last valid position
+        self.pos[act] = p
+        ind = np.where(act)[0]
+        self.active[ind[~valid]] = False
+
+
+    def streamlines(self,stagData,dt,nsteps,save_every=1):
+        """
+        Advects the particles in the (steady) velocity field of a stagData object.
+        <i> : stagData = pypStag.stagData.StagData *VELOCITY* object ('yy', 'spherical' or 'cart3D')
+              dt = int/float, time step (in the unit of stagData.simuAge)
+              nsteps = int, number of time steps
+              save_every = int, the positions are recorded every save_every time steps
+        """
+        time0 = time()
+        self.__set_grid(stagData)
+        self.im('Streamlines of '+str(self.npart)+' particles: '+str(nsteps)+' steps ('+self.method+')')
+        fields = [np.array([np.asarray(getattr(stagData,c),dtype=np.float64).flatten() for c in ('vx','vy','vz')])]
+        t = 0 if len(self.t) == 0 else self.t[-1]
+        if len(self.t) == 0:
+            self.__record(t)
+        for n in range(nsteps):
+            self.__step(fields,dt)
+            t += dt
+            if (n+1)%save_every == 0 or n == nsteps-1:
+                self.__record(t)
+        self.im('  -> '+str(np.count_nonzero(~self.active))+' particle(s) left the grid')
+        self.im('Streamlines done in '+str(time()-time0)[0:5]+' s')
+        return self
+
+
+    def pathlines(self,cloud,dt=None,save_every=1):
+        """
+        Advects the particles in the velocity fields of the successive snapshots
+        of a StagCloudData, linearly interpolated in time between two snapshots
+        (only two snapshots in memory). The particles start at the time of the
+        first snapshot.
+        <i> : cloud = pypStag.stagData.StagCloudData *VELOCITY* object
+              dt = None or int/float, maximum time step (in the unit of stagData.simuAge).
+                   If None, one time step between two snapshots.
+              save_every = int, the positions are recorded every save_every time steps
+                           (and at each snapshot)
+        """
+        time0 = time()
+        self.im('Pathlines of '+str(self.npart)+' particles on '+str(cloud.nt)+' snapshots ('+self.method+')')
+        cloud.reset()
+        fields = None
+        t0 = None
+        n = 0
+        for it in range(cloud.nt):
+            cloud.iterate()
+            drop = cloud.drop
+            self.__set_grid(drop)
+            new = np.array([np.asarray(getattr(drop,c),dtype=np.float64).flatten() for c in ('vx','vy','vz')])
+            if fields is None:
+                fields,t0 = new,drop.simuAge
+                if len(self.t) == 0:
+                    self.__record(t0)
+                continue
+            t1 = drop.simuAge
+            nsub = 1 if dt is None else max(int(np.ceil((t1-t0)/dt)),1)
+            h = (t1-t0)/nsub
+            for k in range(nsub):
+                self.__step([fields,new],h,a0=k/nsub,da=1/nsub)
+                n += 1
+                if n%save_every == 0 or k == nsub-1:
+                    self.__record(t0+(k+1)*h)
+            self.im('  - snapshot '+str(it+1)+'/'+str(cloud.nt)+': '+str(nsub)+' step(s)')
+            fields,t0 = new,t1
+        self.im('  -> '+str(np.count_nonzero(~self.active))+' particle(s) left the grid')
+        self.im('Pathlines done in '+str(time()-time0)[0:5]+' s')
+        return self
+
+
+    def trajectories(self):
+        """
+        Returns the recorded trajectories.
+        <o> : (t,traj), t = np.ndarray, shape (nsave), times of the records and
+              traj = np.ndarray, shape (nsave,npart,3), positions of the particles
+        """
+        return np.array(self.t),np.array(self.traj)
+
+
+    def export_vtk(self,fname,path='./'):
+        """
+        Exports the trajectories as polylines (one line per particle) in a
+        binary legacy VTK file fname+'.vtk', with the time (point data) and the
+        particle ID (cell data).
+        <i> : fname = str, name of the file without extension
+              path = str, path of the file
+        """
+        if path[-1] != '/':
+            path += '/'
+        t,traj = self.trajectories()
+        nsave,npart = traj.shape[0],traj.shape[1]
+        self.im('Export of '+str(npart)+' trajectories: '+path+fname+'.vtk')
+        points = np.ascontiguousarray(traj.transpose(1,0,2),dtype='>f4')
+        lines  = np.empty((npart,nsave+1),dtype='>i4')
+        lines[:,0] = nsave
+        lines[:,1:] = np.arange(npart*nsave).reshape(npart,nsave)
+        with open(path+fname+'.vtk','wb') as fid:
+            fid.write(b'# vtk DataFile Version 3.0\npypStag particle trajectories\nBINARY\nDATASET POLYDATA\n')
+            fid.write(('POINTS %d float\n' % (npart*nsave)).encode())
+            fid.write(points.tobytes())
+            fid.write(('\nLINES %d %d\n' % (npart,npart*(nsave+1))).encode())
+            fid.write(lines.tobytes())
+            fid.write(('\nCELL_DATA %d\nSCALARS particleID int 1\nLOOKUP_TABLE default\n' % npart).encode())
+            fid.write(np.arange(npart,dtype='>i4').tobytes())
+            fid.write(('\nPOINT_DATA %d\nSCALARS time float 1\nLOOKUP_TABLE default\n' % (npart*nsave)).encode())
+            fid.write(np.tile(t.astype('>f4'),npart).tobytes())
+            fid.write(b'\n')
+
+
+    def export_h5(self,fname,path='./',compression='gzip'):
+        """
+        Exports the trajectories in a .h5 file fname+'.h5' with the datasets
+        'time' (nsave), 'x', 'y', 'z' (nsave,npart) and 'active' (npart).
+        <i> : fname = str, name of the file without extension
+              path = str, path of the file
+              compression = None or str, compression filter of h5py
+        """
+        import h5py
+        if path[-1] != '/':
+            path += '/'
+        t,traj = self.trajectories()
+        self.im('Export of '+str(traj.shape[1])+' trajectories: '+path+fname+'.h5')
+        with h5py.File(path+fname+'.h5','w') as fid:
+            fid.create_dataset('time',data=t)
+            for c,name in enumerate(('x','y','z')):
+                fid.create_dataset(name,data=traj[:,:,c],compression=compression)
+            fid.create_dataset('active',data=self.active)
+            fid.attrs['method'] = self.method
@@ -8,7 +8,7 @@ Created on Sun Jul 04 15:22:00 2021
 import matplotlib.pyplot as plt
 import numpy as np
 from .stagData import StagData
-from .stagError import StagTypeError,InputGridGeometryError,fieldTypeError
+from .stagError import StagTypeError,InputGridGeometryError,fieldTypeError,StagComputationalError
 
 
 def im(textMessage,pName,verbose):
@@ -35,20 +35,18 @@ def get_xzy_scoords(stagData,lon,lat,verbose=True):
     if stagData.geometry != 'yy':
         raise StagTypeError(str(type(stagData)),'pypStag.stagData.StagYinYangGeometry')
     else:
-        from .stagData  import SliceData
+        from .stagLocator import YinYangLocator, lonlat2xyz
         pName = 'get_xzy_scoords'
         im('Search the nearest point to:',pName,verbose=verbose)
         im('lon = '+str(lon)+', lat = '+str(lat),pName,verbose=verbose)
-        sld = SliceData(geometry=stagData.geometry)
-        sld.verbose = False
-        sld.slicing(stagData,axis='layer',normal=None,layer=-1)
-        long = sld.phi*180/np.pi
-        latg = -(sld.theta*180/np.pi-90)
-        dist = np.sqrt((long-lon)**2+(latg-lat)**2)
-        gind = np.where(dist == np.amin(dist))[0][0]
-        x,y,z = sld.x[gind],sld.y[gind],sld.z[gind]
+        locator = YinYangLocator(stagData)
+        xp,yp,zp = lonlat2xyz(lon,lat,stagData.rcmb+locator.z_coords[-1])
+        gind = locator.nearest(xp,yp,zp)[0]
+        x,y,z = stagData.x[gind],stagData.y[gind],stagData.z[gind]
+        long = stagData.phi[gind]*180/np.pi
+        latg = -(stagData.theta[gind]*180/np.pi-90)
         im('   -> Point index: '+str(gind),pName,verbose=verbose)
-        im('   -> found lon/lat: '+str(int(long[gind]*100)/100)+', '+str(int(latg[gind]*100)/100),pName,verbose=verbose)
+        im('   -> found lon/lat: '+str(int(long*100)/100)+', '+str(int(latg*100)/100),pName,verbose=verbose)
         return x,y,z
 
 
@@ -121,36 +119,25 @@ def automatic_hotspot_detection(slice350kmt,slice350kmv,remove_smaller=10,plot=F
     # define a metric: dist between 3 points
     threshold = 3 * np.sqrt((slice350kmt.x[0]-slice350kmt.x[1])**2+(slice350kmt.y[0]-slice350kmt.y[1])**2+(slice350kmt.z[0]-slice350kmt.z[1])**2)
 
-    donefull    = []  # list of examined points
-    clusterized = []  # list of hotspots segmentation (clustering)
-    undonefull  = list(range(len(xhot))) # list of un-examined points
-    # clustering
+    # clustering: connected components of the graph linking the points closer than threshold
+    from scipy.spatial import cKDTree, ConvexHull
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components, breadth_first_order
     im('Hotspots clustering on '+str(len(xhot))+' points',pName,verbose)
-    while len(undonefull) != 0:
-        cluster = [undonefull[0]]
-        done    = []
-        n = 0
-        while len(done) < len(cluster):
-            # search undone point in the current cluster
-            undone = [c for c in cluster if c not in done]
-            i = undone[0] # take the first undone point
-            xref = xhot[i]
-            yref = yhot[i]
-            zref = zhot[i]
-            dist = np.sqrt((xref-xhot)**2+(yref-yhot)**2+(zref-zhot)**2)
-            cind = np.where(dist <= threshold)[0]
-            if len(cind) != 0:
-                for gid in cind:
-                    if gid not in cluster:
-                        cluster.append(gid)
-            done.append(i)
-            n += 1
-        clusterized.append(cluster)
-        donefull += done
-        for i in range(len(done)):
-            undonefull.remove(done[i])
-
-    nc = len(clusterized)  # number of clusters
+    nhot  = len(xhot)
+    pairs = cKDTree(np.stack((xhot,yhot,zhot),axis=1)).query_pairs(threshold*(1+1e-6),output_type='ndarray')
+    i,j   = pairs[:,0],pairs[:,1]
+    dist  = np.sqrt((xhot[i]-xhot[j])**2+(yhot[i]-yhot[j])**2+(zhot[i]-zhot[j])**2)
+    keep  = dist <= threshold
+    i,j   = i[keep],j[keep]
+    graph = csr_matrix((np.ones(2*len(i)),(np.concatenate((i,j)),np.concatenate((j,i)))),shape=(nhot,nhot))
+    graph.sort_indices()
+    nc,labels = connected_components(graph,directed=False)
+    # clusters ordered by their first point (as the successive scans of the points)
+    first = np.full(nc,nhot)
+    np.minimum.at(first,labels,np.arange(nhot))
+    order = np.argsort(first)
+    size  = np.bincount(labels,minlength=nc)
     im('Number of detected hotspots: '+str(nc),pName,verbose)
 
     im('Retrieve indicies and compute centroids',pName,verbose)
@@ -160,20 +147,28 @@ def automatic_hotspot_detection(slice350kmt,slice350kmv,remove_smaller=10,plot=F
     # get the indices of cluster in the interpolatedslideData
     # and compute the index of centroid for all the clusters
     # (also in the indices of the input interpolatedslideData)
-    for i in range(nc):
-        seg = np.array(clusterized[i])
-        if len(seg) > remove_smaller:
+    for c in order:
+        if size[c] > remove_smaller:
+            # points in the order of their discovery from the first one (breadth first,
+            # the graph being symmetric)
+            seg = breadth_first_order(graph,first[c],directed=True,return_predecessors=False)
             clusterizedid.append(gind[seg])
             xseg = xhot[seg]
             yseg = yhot[seg]
             zseg = zhot[seg]
-            # search the centroid
-            nod = len(xseg)
-            maxdist = np.zeros(nod)
-            for j in range(nod):
-                refx,refy,refz = xseg[j],yseg[j],zseg[j]
-                dist = np.sqrt((xseg-refx)**2+(yseg-refy)**2+(zseg-refz)**2)
-                maxdist[j] = np.amax(dist)
+            # search the centroid: point minimizing its maximum distance to the others.
+            # The farthest point being a vertex of the convex hull, distances to the
+            # hull vertices are enough
+            try:
+                hv = ConvexHull(np.stack((xseg,yseg,zseg),axis=1)).vertices
+            except Exception:
+                hv = np.arange(len(seg))
+            maxdist = np.zeros(len(seg))
+            step = max(1,int(4e6/len(hv)))
+            for k in range(0,len(seg),step):
+                dist = np.sqrt((xseg[k:k+step,None]-xseg[None,hv])**2+(yseg[k:k+step,None]-yseg[None,hv])**2+\
+                               (zseg[k:k+step,None]-zseg[None,hv])**2)
+                maxdist[k:k+step] = np.amax(dist,axis=1)
             # get centroid
             cid = np.where(maxdist == np.amin(maxdist))[0][0]
             centroidid.append(int(gind[seg[cid]]))
@@ -257,43 +252,45 @@ def mantleDrag(stagDataVelo,plot=True):
 
 
 
-def lithosphere_thickness(stagData,plot=True):
+def lithosphere_thickness(stagData,plot=True,chunksize=None):
     """
     This function computes the lithosphere thickness from a
     pypStag.stagData  *TEMPERATURE*  in  *YY*  geometry.
+    For each column, the base of the lithosphere is the shallowest layer below
+    which the temperature gradient (with depth) is negative (inflexion) or lower
+    than 0.0005 K/km (slope). All the columns are treated at once.
+    <i> : stagData = pypStag.stagData.StagYinYangGeometry, temperature field
+          plot = bool, if True, plot a map of the lithosphere thickness
+          chunksize = None or int, if not None, the layers are treated by chunks
+                      of chunksize layers to limit the memory used on large grids
+    <o> : lithothickness = np.ndarray, shape (NxNy), lithosphere thickness (in km)
+                           for each column of the grid
     """
     if stagData.geometry != 'yy':
         raise InputGridGeometryError(stagData.geometry)
     if stagData.fieldType != 'Temperature':
         raise fieldTypeError('Temperature')
-    from tqdm import tqdm
     Nz = stagData.nz
     x = stagData.depths
     dx = x[0:Nz-1]-x[1:Nz]
     NxNy = int(stagData.v.shape[0]/Nz)
-    lithothickness = np.zeros(NxNy)
     Y = stagData.v.reshape(NxNy,Nz)
-    for pID in tqdm(range(NxNy)):
-        y = Y[pID,:]
-        dy = y[0:Nz-1]-y[1:Nz]
-        lithoID1 = np.where(dy/dx <= 0)[0]
-        if len(lithoID1) > 0:
-            lithoID1 = lithoID1[-1]+1
-        else:
-            lithoID1 = 0
-        lithoID2 = np.where(dy/dx <= 0.0005)[0]
-        if len(lithoID2) > 0:
-            lithoID2 = lithoID2[-1]+1
-        else:
-            lithoID2 = 0
-        if lithoID1 >= lithoID2:
-            lithoID = lithoID1
-            #determination = 'inflexion'
-        else:
-            lithoID = lithoID2
-            #determination = 'slope'
-        lithoID  = max(lithoID1,lithoID2)
-        lithothickness[pID] = x[lithoID]
+    if chunksize is None:
+        chunksize = Nz-1
+    chunksize = max(int(chunksize),1)
+    # index of the last layer (+1) verifying the condition, 0 if none, updated
+    # chunk by chunk of layers (gradients between the layers k0..k1)
+    lithoID = np.zeros(NxNy,dtype=np.int64)
+    for k0 in range(0,Nz-1,chunksize):
+        k1 = min(k0+chunksize,Nz-1)
+        dy = Y[:,k0:k1]-Y[:,k0+1:k1+1]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            grad = dy/dx[k0:k1]
+        # argmax on the reversed mask gives the first True from the top of the chunk
+        mask = grad <= 0.0005  # inflexion (grad <= 0) or slope
+        found = np.any(mask,axis=1)
+        lithoID[found] = k1-np.argmax(mask[found,::-1],axis=1)
+    lithothickness = x[lithoID]
     if plot:
         import cartopy.crs as ccrs
         lon = stagData.phi.reshape(NxNy,Nz)[:,-1]*180/np.pi
@@ -318,44 +315,31 @@ def lithosphere_thickness(stagData,plot=True):
 
 def divNvor(stagData,verbose=True,new=True):
     """
+    Computes the horizontal divergence and the radial (horizontal) vorticity of
+    a velocity field. On Yin-Yang grids, uses the compiled operators of
+    pypStag.stagOperators (spherical metrics, Yin-Yang overlap).
+    <i> : stagData = pypStag.stagData.StagYinYangGeometry or StagCartesianGeometry
+                     velocity object
+          verbose = bool, controls inhibition of the internal message
+          new = bool, if True, the horizontal divergence is stored in the field of
+                the input stagData object (stagData.v, and stagData.v1, stagData.v2
+                for Yin-Yang grids) and the object is returned. Else, on Yin-Yang
+                grids, returns (hdiv,hvor) as flattened fields.
     """
     pName = 'divNvor'
     if stagData.geometry == 'yy':
-        # creat the Yin Yang grid
-        x1, x2 = stagData.x1_overlap.reshape(stagData.nx,stagData.ny,stagData.nz), stagData.x2_overlap.reshape(stagData.nx,stagData.ny,stagData.nz)
-        y1, y2 = stagData.y1_overlap.reshape(stagData.nx,stagData.ny,stagData.nz), stagData.y2_overlap.reshape(stagData.nx,stagData.ny,stagData.nz)
-        z1, z2 = stagData.z1_overlap.reshape(stagData.nx,stagData.ny,stagData.nz), stagData.z2_overlap.reshape(stagData.nx,stagData.ny,stagData.nz)
-        # Yin Yang fields
-        vx1, vx2 = stagData.vx1_overlap.reshape(stagData.nx,stagData.ny,stagData.nz), stagData.vx2_overlap.reshape(stagData.nx,stagData.ny,stagData.nz)
-        vy1, vy2 = stagData.vy1_overlap.reshape(stagData.nx,stagData.ny,stagData.nz), stagData.vy2_overlap.reshape(stagData.nx,stagData.ny,stagData.nz)
-        vz1, vz2 = stagData.vz1_overlap.reshape(stagData.nx,stagData.ny,stagData.nz), stagData.vz2_overlap.reshape(stagData.nx,stagData.ny,stagData.nz)
-        # Compute the gradients
-        gxx1,gxy1,gxz1 = np.gradient(vx1)
-        gyx1,gyy1,gyz1 = np.gradient(vy1)
-        gzx1,gzy1,gzz1 = np.gradient(vz1)
-        gxx2,gxy2,gxz2 = np.gradient(vx2)
-        gyx2,gyy2,gyz2 = np.gradient(vy2)
-        gzx2,gzy2,gzz2 = np.gradient(vz2)
-
-        # Horizontal
-        hdiv1 = gxx1 + gyy1
-        hvor1 = gyx1 - gxy1
-        hdiv2 = gxx2 + gyy2
-        hvor2 = gyx2 - gxy2
-        # Apply redflags
-        """
-        goodIndex = np.ones(len(x1.flatten()),dtype=bool)
-        goodIndex[np.array(stagData.redFlags)] = False
-        hdiv1 = hdiv1.flatten()[goodIndex]
-        hdiv2 = hdiv2.flatten()[goodIndex]
-        hvor1 = hvor1.flatten()[goodIndex]
-        hvor2 = hvor2.flatten()[goodIndex]
-        """
+        from .stagOperators import get_operators
+        im('Horizontal divergence and radial vorticity on the Yin-Yang grid',pName,verbose)
+        ops  = get_operators(stagData,verbose=verbose)
+        hdiv = ops.hdivergence(stagData.vx,stagData.vy,stagData.vz)
+        hvor = ops.radial_vorticity(stagData.vx,stagData.vy,stagData.vz)
         if new:
-            stagData.v1 = hdiv1
-            stagData.v2 = hdiv2
-            #stagData.v  = np.stack((hdiv1,hdiv2)).reshape(2*len(stagData.x1))
+            n = len(stagData.x1)
+            stagData.v1 = hdiv[0:n]
+            stagData.v2 = hdiv[n:]
+            stagData.v  = hdiv
             return stagData
+        return hdiv,hvor
     elif stagData.geometry == 'cart3D':
         gxx,gxy,gxz = np.gradient(stagData.vx)
         gyx,gyy,gyz = np.gradient(stagData.vy)
@@ -371,121 +355,1051 @@ def divNvor(stagData,verbose=True,new=True):
             return stagData
     
 
-def divergence_vorticity(u,dx,dy,dz):
+def _cell_edges(c):
     """
+    Returns the edges of the cells along a 1D axis, the nodes 'c' being at
+    the cell centers (the first and last edges are extrapolated).
     """
-    nvtot,nxtot,nytot,nztot,nbtot = np.shape(u)
-    u = u.reshape(nxtot,nytot,nztot,nbtot,nvtot)
+    c = np.asarray(c,dtype=np.float64)
+    if len(c) == 1:
+        return np.array([c[0]-0.5,c[0]+0.5])
+    return np.concatenate(([1.5*c[0]-0.5*c[1]],(c[1:]+c[:-1])/2,[1.5*c[-1]-0.5*c[-2]]))
 
-    sq=0
-    mn=1
-    mx=2
-    h=0
-    v=1
 
-    vx = 0
-    vy = 1
-    vz = 2
-  
-    g = 2
-    myzc = 1 # ??????
 
-    iz00 = nztot*g%myzc
-    d1x = 1./dx
-    d1y = 1./dy
-  
+def divergence_vorticity(u,e1,e2,rgeom,rcmb=0,spherical=True,verbose=True):
+    """
+    Computes the layer statistics (rms, min and max) of the horizontal divergence,
+    of the radial vorticity and of the norm of the horizontal vorticity from a raw
+    velocity field of StagYY (staggered grid), for all the layers and all the blocks.
+    The velocity components are taken on the faces of the cells (vx at the face
+    ix-1/2, vy at the face iy-1/2 and vz at the bottom face iz-1/2, like in StagYY):
+    the divergence is computed at the cell centers, the radial vorticity at the
+    vertical edges and the horizontal vorticity at the horizontal edges of the cells,
+    with the metric terms of the spherical geometry (e1 = colatitude - pi/4 and
+    e2 = longitude + 3pi/4 in the Yin parametrization) and the radial positions of
+    rgeom. The statistics are weighted by the area of the cells and, for Yin-Yang
+    grids (2 blocks), restricted to the points kept in stagData (no redFlags).
+    e.g. with a velocity stagData (stagData.stagImport done):
+    >> div,vor = divergence_vorticity(sd.flds,sd.header['e1_coord'],sd.header['e2_coord'],\
+                                      sd.header['rgeom'],rcmb=sd.rcmb)
+    <i> : u     = np.ndarray, shape (nval,nx(+1),ny(+1),nz,nb), raw field of a velocity-pressure
+                  file (e.g. stagData.flds) with the extra ghost point in x and y if any
+          e1,e2 = np.ndarray, shape (nx) and (ny), coordinates of the cell centers in the
+                  e1 and e2 directions (e.g. stagData.header['e1_coord'])
+          rgeom = np.ndarray, shape (nz+1,2), radial positions of the cell edges (rgeom[:,0])
+                  and of the cell centers (rgeom[0:nz,1]) (e.g. stagData.header['rgeom']).
+                  A vector of shape (nz) of the cell centers (e.g. e3_coord) is also accepted,
+                  the edges being then taken at the mid-points.
+          rcmb  = int/float, radius of the CMB (added to rgeom)
+          spherical = bool, if False, cartesian metric (e1, e2, rgeom = x, y, z)
+          verbose   = bool, controls inhibition of the internal message
+    <o> : (div,vor)
+          div = np.ndarray, shape (3,nz), div[0] = rms, div[1] = min, div[2] = max of the
+                horizontal divergence for each layer
+          vor = np.ndarray, shape (3,nz,2), vor[:,:,0] = rms/min/max of the norm of the
+                horizontal vorticity and vor[:,:,1] = rms/min/max of the radial vorticity
+                for each layer (NaN where not defined, i.e. horizontal vorticity of the
+                first layer)
+    """
+    pName = 'divergence_vorticity'
+    nval,nxu,nyu,nz,nb = np.shape(u)
+    e1 = np.asarray(e1,dtype=np.float64).flatten()
+    e2 = np.asarray(e2,dtype=np.float64).flatten()
+    nx,ny = len(e1),len(e2)
+    im('Compute the divergence and the vorticity on '+str(nx)+'x'+str(ny)+'x'+str(nz)+'x'+str(nb)+' cells',pName,verbose)
+    # --- grid: centers (c) and edges (e)
+    edges_of = _cell_edges
+    rgeom = np.asarray(rgeom,dtype=np.float64)
+    if rgeom.ndim == 2:
+        rc = rgeom[0:nz,1]+rcmb
+        re = rgeom[0:nz+1,0]+rcmb
+    else:
+        rc = rgeom[0:nz]+rcmb
+        re = edges_of(rgeom[0:nz])+rcmb
+    x_e = edges_of(e1)
+    dx_c = np.diff(x_e)             # size of the cells in e1
+    dy_c = np.diff(edges_of(e2))    # size of the cells in e2
+    dx_e = np.diff(e1)              # distance between the centers in e1
+    dy_e = np.diff(e2)
+    dr_e = np.diff(rc)
+    if spherical:
+        st_c = np.sin(np.pi/4+e1)   # sin(colatitude) at the centers
+        st_e = np.sin(np.pi/4+x_e)  # sin(colatitude) at the faces
+        r_c  = rc
+        r_e  = re[0:nz]
+    else:
+        st_c = np.ones(nx)
+        st_e = np.ones(nx+1)
+        r_c  = np.ones(nz)
+        r_e  = np.ones(nz)
+        rc   = np.ones(nz)
+    # reshape helpers: axes (x,y,z)
+    X = lambda a: a.reshape((-1,1,1))
+    Y = lambda a: a.reshape((1,-1,1))
+    Z = lambda a: a.reshape((1,1,-1))
+    # --- Yin-Yang redFlags (same logical points removed in both blocks)
+    if nb == 2:
+        from .stagLocator import yy_redflags
+        lat = np.pi/4-e1.reshape((-1,1))
+        lon = e2.reshape((1,-1))-3*np.pi/4
+        keep = ~yy_redflags(np.cos(lat)*np.sin(lon),lon*np.ones(lat.shape),np.ones(lat.shape)*np.ones(lon.shape))
+    else:
+        keep = np.ones((nx,ny),dtype=bool)
+    # --- statistics accumulators
     big = 1e10
-
-    vor = np.zeros((3,nztot,2))
-    div = np.zeros((3,nztot)) 
-
-    div[sq,:]   = 0.
-    div[mn,:]   = big
-    div[mx,:]   = -big
-    vor[sq,:,:] = 0.
-    vor[mn,:,:] = big
-    vor[mx,:,:] = -big
-  
-  #               ---- work on local patch of problem
-  #                    ws evaluated at centers of cell edges
-  #                    d  evaluated at cell center
-
-    nz = nztot
-    nx = nxtot
-    ny = nytot
-    nb = nbtot
-
-    izmax = nz-1
-    izmax = nz
-
-    from tqdm import tqdm
-    for iz in tqdm(range(62,izmax)):
-        izg = iz + iz00
-        d1z = 1#1./(dzg(0,iz)+dzg(1,iz-1))
-        drms = 0.0  ;  dmin = big ;  dmax = -big
-        wzrms = 0.0 ; wzmin = big ; wzmax = -big
-        whrms = 0.0 ; whmin = big ; whmax = -big
-        for ib in range(0,nb):
-            for iy in range(0,ny-1):
-                for ix in range(0,nx-1):
-                    wx = d1y*(u[ix,iy,iz,ib,vz]-u[ix,iy-1,iz,ib,vz])\
-                        - d1z*(u[ix,iy,iz,ib,vy]-u[ix,iy,iz-1,ib,vy])
-                    wy = d1x*(u[ix,iy,iz,ib,vz]-u[ix-1,iy,iz,ib,vz])\
-                        - d1z*(u[ix,iy,iz,ib,vx]-u[ix,iy,iz-1,ib,vx])
-                    wh = np.sqrt(wx**2+wy**2)
-                    wz = d1x*(u[ix,iy,iz,ib,vy]-u[ix-1,iy,iz,ib,vy])\
-                        - d1y*(u[ix,iy,iz,ib,vx]-u[ix,iy-1,iz,ib,vx])
-                    d  = d1x*(u[ix+1,iy,iz,ib,vx]-u[ix,iy,iz,ib,vx])\
-                        + d1y*(u[ix,iy+1,iz,ib,vy]-u[ix,iy,iz,ib,vy])
-                    wzrms = wzrms + wz**2 #* dareag(ix,iy)
-                    wzmin = np.min([wzmin, wz])
-                    wzmax = np.max([wzmax, wz])
-                    whrms = whrms + wh**2 #* dareag(ix,iy)
-                    whmin = np.min([whmin, wh])
-                    whmax = np.max([whmax, wh])
-                    drms = drms + d**2 #*dareag(ix,iy)
-                    dmin = np.min([dmin, d])
-                    dmax = np.max([dmax, d])
-
-        vor[sq,izg,h] = whrms
-        vor[mn,izg,h] = whmin
-        vor[mx,izg,h] = whmax
-        vor[sq,izg,v] = wzrms
-        vor[mn,izg,v] = wzmin
-        vor[mx,izg,v] = wzmax
-        div[sq,izg] = drms
-        div[mn,izg] = dmin
-        div[mx,izg] = dmax
+    stats = {name:[np.zeros(nz),np.zeros(nz),np.full(nz,big),np.full(nz,-big)] for name in ('div','wh','wr')}
+    def accumulate(name,q,w,k,iz0=0):
+        """add the values q (nx',ny',nz') weighted by w (nx',ny') and masked by k"""
+        q = np.where(k[:,:,None],q,np.nan)
+        wk = np.where(k,w,0)[:,:,None]
+        st = stats[name]
+        st[0][iz0:] += np.nansum(wk*q**2,axis=(0,1))
+        st[1][iz0:] += np.sum(wk*np.isfinite(q),axis=(0,1))
+        with np.errstate(invalid='ignore'):
+            st[2][iz0:] = np.fmin(st[2][iz0:],np.nanmin(np.where(np.isfinite(q),q,big),axis=(0,1)))
+            st[3][iz0:] = np.fmax(st[3][iz0:],np.nanmax(np.where(np.isfinite(q),q,-big),axis=(0,1)))
+    for ib in range(nb):
+        vx = np.asarray(u[0,:,:,:,ib],dtype=np.float64)
+        vy = np.asarray(u[1,:,:,:,ib],dtype=np.float64)
+        vz = np.asarray(u[2,:,:,:,ib],dtype=np.float64)
+        # -- horizontal divergence at the cell centers
+        mx = min(nxu-1,nx)  # cells with their two faces in e1
+        my = min(nyu-1,ny)
+        div = (X(st_e[1:mx+1])*vx[1:mx+1,0:my]-X(st_e[0:mx])*vx[0:mx,0:my])/X(dx_c[0:mx])
+        div = div+(vy[0:mx,1:my+1]-vy[0:mx,0:my])/Y(dy_c[0:my])
+        div = div/(X(st_c[0:mx])*Z(r_c))
+        w = X(st_c[0:mx]*dx_c[0:mx])[:,:,0]*Y(dy_c[0:my])[:,:,0]
+        accumulate('div',div,w,keep[0:mx,0:my])
+        # -- radial vorticity at the vertical edges (ix-1/2,iy-1/2), ix,iy >= 1
+        wr = (X(st_c[1:nx])*vy[1:nx,1:ny]-X(st_c[0:nx-1])*vy[0:nx-1,1:ny])/X(dx_e)
+        wr = wr-(vx[1:nx,1:ny]-vx[1:nx,0:ny-1])/Y(dy_e)
+        wr = wr/(X(st_e[1:nx])*Z(r_c))
+        w = X(st_e[1:nx]*dx_e)[:,:,0]*Y(dy_e)[:,:,0]
+        k = np.logical_and(keep[1:nx,1:ny],keep[0:nx-1,0:ny-1])
+        accumulate('wr',wr,w,k)
+        # -- horizontal vorticity at the horizontal edges, iz >= 1
+        if nz > 1:
+            # e1 component at (ix,iy-1/2,iz-1/2)
+            wt = (vz[1:nx,1:ny,1:]-vz[1:nx,0:ny-1,1:])/(X(st_c[1:nx])*Y(dy_e)*Z(r_e[1:]))
+            wt = wt-(Z(rc[1:])*vy[1:nx,1:ny,1:]-Z(rc[:-1])*vy[1:nx,1:ny,:-1])/(Z(r_e[1:])*Z(dr_e))
+            # e2 component at (ix-1/2,iy,iz-1/2)
+            wp = (Z(rc[1:])*vx[1:nx,1:ny,1:]-Z(rc[:-1])*vx[1:nx,1:ny,:-1])/(Z(r_e[1:])*Z(dr_e))
+            wp = wp-(vz[1:nx,1:ny,1:]-vz[0:nx-1,1:ny,1:])/(X(dx_e)*Z(r_e[1:]))
+            wh = np.sqrt(wt**2+wp**2)
+            accumulate('wh',wh,w,k,iz0=1)
+        im('    - block '+str(ib+1)+'/'+str(nb)+' done',pName,verbose)
+    # --- output
+    def output(name):
+        st = stats[name]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            rms = np.sqrt(st[0]/st[1])
+        mn = np.where(st[1] > 0,st[2],np.nan)
+        mx = np.where(st[1] > 0,st[3],np.nan)
+        return np.array([rms,mn,mx])
+    div = output('div')
+    vor = np.stack((output('wh'),output('wr')),axis=2)
+    im('Divergence and vorticity done!',pName,verbose)
     return div,vor
 
 
 
 
-def compute_seafloor_age(stagDataT,isoth=1.2):
+def _radial_edges(stagData):
     """
-    return a pypStag.stagData.StagYinYangGeometry object
+    Returns the radial (vertical) edges of the cells of the loaded layers of
+    stagData, measured from the CMB (bottom): stagData.header['rgeom'] if the
+    loaded layers are contiguous, else the mid-points of stagData.z_coords.
     """
+    lay = np.asarray(stagData.slayers).astype(int)-1
+    rgeom = stagData.header.get('rgeom') if isinstance(stagData.header,dict) else None
+    if rgeom is not None and np.shape(rgeom)[0] == stagData.nz0+1 and np.all(np.diff(lay) == 1):
+        return np.asarray(rgeom,dtype=np.float64)[lay[0]:lay[-1]+2,0]
+    return _cell_edges(np.asarray(stagData.z_coords,dtype=np.float64))
 
 
 
+def cell_volumes(stagData):
+    """
+    Computes the volume of the cells of all the nodes of a 3D stagData object,
+    from the cell edges in e1 and e2 (mid-points of the loaded coordinates) and
+    in the radial direction (stagData.header['rgeom'] if the loaded layers are
+    contiguous, else mid-points of stagData.z_coords). For Yin-Yang grids, the
+    volume of each node is the one of its cell in its own block (the overlapping
+    nodes being removed, the sum is close to the volume of the spherical shell).
+    Since all the nodes of a layer have the same radial extent, these volumes
+    are also the weights of the areas of the cells on each layer.
+    <i> : stagData = pypStag.stagData.StagYinYangGeometry, StagSphericalGeometry or
+                     StagCartesianGeometry (3D) object
+    <o> : vol = np.ndarray, shape (N/nz,nz), volume of the cells ordered as the
+                flattened fields of stagData (stagData.v.reshape(-1,stagData.nz))
+    """
+    if stagData.geometry not in ('yy','spherical','cart3D'):
+        raise InputGridGeometryError(stagData.geometry)
+    nz = stagData.nz
+    e1 = np.asarray(stagData.x_coords,dtype=np.float64)
+    e2 = np.asarray(stagData.y_coords,dtype=np.float64)
+    re = _radial_edges(stagData)
+    dx = np.diff(_cell_edges(e1))
+    dy = np.diff(_cell_edges(e2))
+    if stagData.geometry == 'cart3D':
+        area = dx[:,None]*dy[None,:]
+        dvol = np.diff(re)
+    else:
+        area = (np.sin(np.pi/4+e1)*dx)[:,None]*dy[None,:]
+        re   = re+stagData.rcmb
+        dvol = (re[1:]**3-re[:-1]**3)/3
+    if stagData.geometry == 'yy':
+        from .stagLocator import yy_redflags
+        lat = np.pi/4-e1[:,None]*np.ones(len(e2))[None,:]
+        lon = e2[None,:]*np.ones(len(e1))[:,None]-3*np.pi/4
+        area = area[~yy_redflags(np.cos(lat)*np.sin(lon),lon,np.ones(lat.shape))]
+        area = np.concatenate((area,area))
+    vol = area.reshape(-1,1)*dvol[None,:]
+    if vol.size != np.size(stagData.x):
+        raise StagComputationalError('Incoherent grid: the stagData object has been modified after its processing')
+    return vol
 
 
 
+def _layer_reduce(V,W,M,percentiles):
+    """
+    Weighted statistics along the first axis of V (N,nz), for the points where
+    the mask M (N,nz) is True, with the weights W (N,nz).
+    Returns an np.ndarray of shape (4+len(percentiles),nz): mean, rms, min, max
+    and the percentiles (NaN for empty layers).
+    """
+    w = np.where(M,W,0)
+    S = w.sum(axis=0)
+    n = M.sum(axis=0)
+    empty = n == 0
+    S[empty] = 1
+    Vm = np.where(M,V,0)
+    out = np.empty((4+len(percentiles),V.shape[1]))
+    out[0] = np.sum(w*Vm,axis=0)/S
+    out[1] = np.sqrt(np.sum(w*Vm**2,axis=0)/S)
+    out[2] = np.where(M,V,np.inf).min(axis=0)
+    out[3] = np.where(M,V,-np.inf).max(axis=0)
+    if len(percentiles) > 0:
+        # weighted percentiles: linear interpolation between the mid-points of
+        # the cumulated weights of the sorted values of each layer
+        order = np.argsort(np.where(M,V,np.inf),axis=0,kind='stable')
+        vs = np.take_along_axis(V,order,axis=0)
+        ws = np.take_along_axis(w,order,axis=0)
+        c  = (np.cumsum(ws,axis=0)-ws/2)/S
+        c[np.take_along_axis(~M,order,axis=0)] = np.inf
+        last = np.maximum(n-1,0)
+        for ip,q in enumerate(percentiles):
+            q  = q/100
+            ind = np.sum(c <= q,axis=0)
+            lo = np.clip(ind-1,0,last)[None,:]
+            hi = np.clip(ind,0,last)[None,:]
+            clo,chi = np.take_along_axis(c,lo,axis=0)[0],np.take_along_axis(c,hi,axis=0)[0]
+            vlo,vhi = np.take_along_axis(vs,lo,axis=0)[0],np.take_along_axis(vs,hi,axis=0)[0]
+            with np.errstate(invalid='ignore',divide='ignore'):
+                t = np.where(chi > clo,np.clip((q-clo)/(chi-clo),0,1),0)
+            out[4+ip] = vlo+t*(vhi-vlo)
+    out[:,empty] = np.nan
+    return out
+
+
+
+def layer_statistics(data,field='v',mask=None,percentiles=[],weighted=True,verbose=True):
+    """
+    Computes the radial profiles of the weighted mean, rms, min, max and
+    percentiles of any field of a stagData object (or of all the snapshots of
+    a StagCloudData in one pass), optionally restricted to a mask (e.g. inside
+    the plumes). The weights are the volumes of the cells (see cell_volumes),
+    derived once per grid, i.e. the horizontal averages are area-weighted.
+    All the layers are reduced at once.
+    e.g. temperature profiles of the hot regions for all the snapshots of a cloud:
+    >> stats = layer_statistics(cloud,field='v',mask=lambda sd: sd.v > 0.8,percentiles=[10,50,90])
+    <i> : data  = pypStag.stagData.StagData object (3D: 'yy', 'spherical' or 'cart3D')
+                  or pypStag.stagData.StagCloudData object
+          field = str or function, name of the field of the stagData object (e.g. 'v',
+                  'vr', 'vphi', 'P') or function taking the stagData object in argument
+                  and returning the field to reduce (flattened fields order)
+          mask  = None, np.ndarray(bool) or function, if not None, only the points where
+                  the mask is True are used. Can be a function taking the stagData object
+                  in argument and returning the mask (e.g. a threshold on the field).
+          percentiles = list of int/float, percentiles (in [0,100]) to compute
+          weighted = bool, if False, all the points have the same weight
+          verbose  = bool, controls inhibition of the internal message
+    <o> : stats = np.ndarray, shape (4+len(percentiles),nt,nz) for a StagCloudData and
+                  (4+len(percentiles),nz) for a StagData, with stats[0] = mean, stats[1] = rms,
+                  stats[2] = min, stats[3] = max and stats[4+i] = percentiles[i]. The layers
+                  are in the order of stagData.slayers. NaN where a layer has no point.
+    """
+    from .stagInterpolator import grid_hash
+    from .stagData import MainCouldStagData
+    pName = 'layer_statistics'
+    cloud = isinstance(data,MainCouldStagData)
+    nt = data.nt if cloud else 1
+    im('Layer statistics of '+str(nt)+' snapshot(s)',pName,verbose)
+    if cloud:
+        data.reset()
+    stats = None
+    key = None
+    for t in range(nt):
+        if cloud:
+            data.iterate()
+            sd = data.drop
+        else:
+            sd = data
+        # --- weights: computed once per grid
+        gkey = (sd.geometry,grid_hash(sd.x_coords,sd.y_coords,sd.z_coords),np.size(sd.x))
+        if gkey != key:
+            key = gkey
+            W = cell_volumes(sd) if weighted else np.ones((np.size(sd.x)//sd.nz,sd.nz))
+        V = np.asarray(field(sd) if callable(field) else getattr(sd,field),dtype=np.float64).reshape(W.shape)
+        if mask is None:
+            M = np.isfinite(V)
+        else:
+            M = np.asarray(mask(sd) if callable(mask) else mask,dtype=bool).reshape(W.shape)
+            M = np.logical_and(M,np.isfinite(V))
+        out = _layer_reduce(V,W,M,percentiles)
+        if stats is None:
+            stats = np.empty((out.shape[0],nt,out.shape[1]))
+        stats[:,t,:] = out
+        if cloud:
+            im('    - snapshot '+str(t+1)+'/'+str(nt)+' done',pName,verbose)
+    im('Layer statistics done!',pName,verbose)
+    return stats if cloud else stats[:,0,:]
 
 
 
+def heat_flux(stagData,velocity=None,Tsurf=0,Tcmb=1,conductivity=1,nusselt=False,verbose=True):
+    """
+    Computes the conductive heat flux maps at the surface and at the CMB from
+    a temperature field, using the temperature of the last (first) layer of
+    cells and the boundary temperature Tsurf (Tcmb), at the radial positions of
+    stagData.header['rgeom'] (cell centers and edges):
+        q_top = -k (Tsurf - T[top])  / (r_edge[top+1] - r_center[top])
+        q_bot = -k (T[0] - Tcmb)     / (r_center[0] - r_edge[0])
+    (positive for an outward heat flow). All the columns (both blocks for
+    Yin-Yang grids) are computed at once. If a velocity field is given, the
+    advective heat transport of each layer, i.e. the area-weighted horizontal
+    average of vr*T, is also computed. Works on a StagData or, for all the
+    snapshots, on a StagCloudData (then, velocity must be a StagCloudData with
+    the same indices).
+    <i> : stagData = pypStag.stagData.StagData *TEMPERATURE* object (3D: 'yy', 'spherical'
+                     or 'cart3D', loaded with the first and/or the last layer) or
+                     pypStag.stagData.StagCloudData of temperature
+          velocity = None or pypStag.stagData.StagData (StagCloudData) *VELOCITY* object
+                     on the same grid (same snapshot(s))
+          Tsurf, Tcmb = int/float, temperatures of the surface and of the CMB
+          conductivity = int/float, thermal conductivity k
+          nusselt = bool, if True, the flux maps are divided by the conductive flux of
+                    the shell at the same radius, i.e. the maps are local Nusselt numbers
+                    (k (Tcmb-Tsurf) ri ro / ((ro-ri) r^2) in spherical geometries and
+                    k (Tcmb-Tsurf)/(ro-ri) in cartesian geometry)
+          verbose = bool, controls inhibition of the internal message
+    <o> : (qtop,qbot,adv)
+          qtop, qbot = np.ndarray, shape (ncol) for a StagData and (nt,ncol) for a StagCloudData,
+                       heat flux (or Nusselt number) of each column at the surface and at the CMB
+                       (columns ordered as stagData.x.reshape(-1,stagData.nz)). NaN if
+                       the corresponding boundary layer is not loaded.
+          adv = None or np.ndarray, shape (nz) or (nt,nz), advective heat transport of each
+                loaded layer (if velocity is not None)
+    """
+    from .stagData import MainCouldStagData
+    pName = 'heat_flux'
+    cloud = isinstance(stagData,MainCouldStagData)
+    if cloud and velocity is not None and list(velocity.indices) != list(stagData.indices):
+        raise StagComputationalError('The temperature and velocity clouds must have the same indices')
+    nt = stagData.nt if cloud else 1
+    im('Heat flux maps of '+str(nt)+' snapshot(s)',pName,verbose)
+    if cloud:
+        stagData.reset()
+        if velocity is not None:
+            velocity.reset()
+    qtop,qbot,adv = [],[],[]
+    for t in range(nt):
+        if cloud:
+            stagData.iterate()
+            sd = stagData.drop
+            if velocity is not None:
+                velocity.iterate()
+            vd = velocity.drop if velocity is not None else None
+        else:
+            sd,vd = stagData,velocity
+        if sd.fieldType != 'Temperature':
+            raise fieldTypeError('Temperature')
+        if sd.geometry not in ('yy','spherical','cart3D'):
+            raise InputGridGeometryError(sd.geometry)
+        nz = sd.nz
+        T = np.asarray(sd.v,dtype=np.float64).reshape(-1,nz)
+        # --- radial positions of the centers and edges
+        rgeom = sd.header.get('rgeom') if isinstance(sd.header,dict) else None
+        lay = np.asarray(sd.slayers).astype(int)-1
+        if rgeom is not None and np.shape(rgeom)[0] == sd.nz0+1:
+            rgeom = np.asarray(rgeom,dtype=np.float64)
+            rc,re = rgeom[0:sd.nz0,1],rgeom[:,0]
+        else:
+            rc = np.asarray(sd.header.get('e3_coord'),dtype=np.float64)
+            re = np.concatenate(([0],(rc[1:]+rc[:-1])/2,[1]))
+        rcmb = 0 if sd.geometry == 'cart3D' else sd.rcmb
+        ri,ro = re[0]+rcmb,re[-1]+rcmb
+        def reference(r):
+            """conductive heat flux of the shell at the radius r"""
+            if not nusselt:
+                return 1
+            if sd.geometry == 'cart3D':
+                return conductivity*(Tcmb-Tsurf)/(ro-ri)
+            return conductivity*(Tcmb-Tsurf)*ri*ro/((ro-ri)*r**2)
+        ncol = T.shape[0]
+        if lay[-1] == sd.nz0-1:
+            q = -conductivity*(Tsurf-T[:,-1])/(re[lay[-1]+1]-rc[lay[-1]])
+            qtop.append(q/reference(ro))
+        else:
+            qtop.append(np.full(ncol,np.nan))
+        if lay[0] == 0:
+            q = -conductivity*(T[:,0]-Tcmb)/(rc[0]-re[0])
+            qbot.append(q/reference(ri))
+        else:
+            qbot.append(np.full(ncol,np.nan))
+        # --- advective transport
+        if vd is not None:
+            if vd.fieldType != 'Velocity':
+                raise fieldTypeError('Velocity')
+            if sd.geometry == 'cart3D':
+                vr = np.asarray(vd.vz,dtype=np.float64)
+            else:
+                vr = np.asarray(vd.vr,dtype=np.float64)
+            vr = vr.reshape(-1,nz)
+            if vr.shape != T.shape:
+                raise StagComputationalError('The temperature and velocity fields are not on the same grid')
+            W = cell_volumes(sd)
+            adv.append(np.sum(W*vr*T,axis=0)/np.sum(W,axis=0))
+        if cloud:
+            im('    - snapshot '+str(t+1)+'/'+str(nt)+' done',pName,verbose)
+    qtop,qbot = np.array(qtop),np.array(qbot)
+    adv = np.array(adv) if velocity is not None else None
+    if not cloud:
+        qtop,qbot = qtop[0],qbot[0]
+        adv = adv[0] if adv is not None else None
+    im('Heat flux done!',pName,verbose)
+    return qtop,qbot,adv
+
+
+
+def compute_seafloor_age(cloudV,cloudT=None,isoth=1.2,divmin=None,statefile=None,time_scale=1,verbose=True):
+    """
+    Computes the seafloor age on the surface of a Yin-Yang model by walking
+    a time series of velocity fields. The age of each surface point (shallowest
+    loaded layer) is updated incrementally between two snapshots separated by dt:
+        - the age is advected with a semi-Lagrangian scheme: the age at the
+          departure point of the great circle path followed during dt with the
+          current surface velocity (trilinear interpolation on the YY grid), +dt
+        - the age is reset to 0 where new lithosphere forms: where the temperature
+          of the shallowest layer loaded in cloudT is higher than isoth or, if
+          divmin is given instead of cloudT, where the horizontal divergence of
+          the surface velocity is higher than divmin (spreading ridges).
+    All the surface points are treated at once. The state of the computation
+    (age, last file index, time) can be saved in statefile after each snapshot:
+    a new call with the same statefile only processes the snapshots of
+    cloudV with a file index higher than the last one processed (e.g. the
+    new outputs of a running simulation).
+    Note: the first argument is the *VELOCITY* cloud, which drives the advection
+    of the age; the temperature, formerly the first argument (stagDataT), is
+    now given with cloudT.
+    <i> : cloudV = pypStag.stagData.StagCloudData, *VELOCITY* in *YY* geometry
+                   (built with at least the surface layers, e.g. with beginIndex)
+          cloudT = None or pypStag.stagData.StagCloudData, *TEMPERATURE* in *YY*
+                   geometry, with the same indices and grid as cloudV
+          isoth = int/float, temperature threshold for the formation of new
+                  lithosphere, used with cloudT
+          divmin = None or int/float, absolute horizontal divergence threshold (in the
+                   unit of velocity/length of the outputs) for the formation of new
+                   lithosphere, used instead of cloudT. Exactly one of cloudT and
+                   divmin must be given.
+          statefile = None or str, path to the file (.npz) where the state
+                      is loaded (if it exists) and saved
+          time_scale = int/float, factor such as time_scale*velocity*dt is in the unit
+                       of the coordinates (stagData.x), dt being in the unit of
+                       stagData.simuAge (1 for non-dimensional outputs)
+          verbose = bool, controls inhibition of the internal message
+    <o> : stagData = pypStag.stagData.StagYinYangGeometry, the last snapshot of the
+                     velocity cloud turned into a scalar field ('Seafloor age'), with
+                     the seafloor age (in the unit of stagData.simuAge) of each
+                     column in stagData.v (and v1, v2). On the first
+                     snapshot of a computation, the age is set to 0 everywhere.
+                     Returns None if there is no new snapshot to process.
+    """
+    import os
+    from .stagLocator import get_locator, trilinear_operator
+    from .stagOperators import get_operators
+    from .stagInterpolator import grid_hash
+    pName = 'compute_seafloor_age'
+    if cloudV.geometry != 'yy':
+        raise InputGridGeometryError(cloudV.geometry)
+    if (cloudT is None) == (divmin is None):
+        raise StagComputationalError('Give either a temperature cloud (cloudT) or a divergence threshold (divmin)')
+    if cloudT is not None and list(cloudT.indices) != list(cloudV.indices):
+        raise StagComputationalError('cloudT and cloudV must have the same file indices')
+    # --- state
+    state = None
+    if statefile is not None and os.path.isfile(statefile):
+        im('Load the state: '+statefile,pName,verbose)
+        with np.load(statefile) as f:
+            state = {key:f[key] for key in f.files}
+        im('  -> Last index processed: '+str(int(state['index'])),pName,verbose)
+    todo = [p for p,ind in enumerate(cloudV.indices) if state is None or ind > state['index']]
+    if len(todo) == 0:
+        im('No new snapshot to process',pName,verbose)
+        return None
+    im('Seafloor age on '+str(len(todo))+' snapshot(s)',pName,verbose)
+    for p in todo:
+        # --- load the snapshot(s)
+        cloudV.ci = p-1
+        cloudV.iterate()
+        drop = cloudV.drop
+        if drop.fieldType != 'Velocity':
+            raise fieldTypeError('Velocity')
+        loc  = get_locator(drop)
+        nz   = loc.nz
+        ids  = np.arange(loc.nb*loc.ncol)*nz+nz-1
+        x,y,z = [np.asarray(c,dtype=np.float64).flatten()[ids] for c in (drop.x,drop.y,drop.z)]
+        key = grid_hash(x,y,z)
+        # --- reset where new lithosphere forms
+        if cloudT is not None:
+            cloudT.ci = p-1
+            cloudT.iterate()
+            if cloudT.drop.fieldType != 'Temperature':
+                raise fieldTypeError('Temperature')
+            T = np.asarray(cloudT.drop.v,dtype=np.float64).reshape(-1,cloudT.drop.nz)[:,-1]
+            if T.size != ids.size:
+                raise StagComputationalError('cloudT and cloudV must have the same grid')
+            reset = T >= isoth
+        else:
+            ops  = get_operators(drop,verbose=False)
+            hdiv = ops.hdivergence(drop.vx,drop.vy,drop.vz)[ids]
+            reset = hdiv > divmin
+        if state is None:
+            im('  -> Initialization on the file index '+str(cloudV.indices[p]),pName,verbose)
+            age = np.zeros(ids.size)
+        else:
+            if str(state['key']) != key:
+                raise StagComputationalError('The grid of the snapshot '+str(cloudV.indices[p])+' is not the one of the state')
+            dt  = drop.simuAge-float(state['simuAge'])
+            # --- departure points: great circle path of length |vh|*dt backward
+            vx,vy,vz = [np.asarray(c,dtype=np.float64).flatten()[ids] for c in (drop.vx,drop.vy,drop.vz)]
+            r  = np.sqrt(x**2+y**2+z**2)
+            vr = (vx*x+vy*y+vz*z)/r
+            vx,vy,vz = vx-vr*x/r, vy-vr*y/r, vz-vr*z/r
+            vh = np.sqrt(vx**2+vy**2+vz**2)
+            alpha = vh*dt*time_scale/r
+            with np.errstate(invalid='ignore',divide='ignore'):
+                f = np.where(vh > 0,r*np.sin(alpha)/vh,0)
+            ca = np.cos(alpha)
+            W = trilinear_operator(loc,ca*x-f*vx,ca*y-f*vy,ca*z-f*vz)[0][:,ids]
+            age = W.dot(state['age'])+dt
+            im('  -> File index '+str(cloudV.indices[p])+': dt = '+str(dt),pName,verbose)
+        age[reset] = 0
+        im('     '+str(np.count_nonzero(reset))+' points reset (new lithosphere)',pName,verbose)
+        state = {'age':age,'index':cloudV.indices[p],'simuAge':drop.simuAge,\
+                 'ti_step':drop.ti_step,'key':key}
+        if statefile is not None:
+            tmp = statefile+'.tmp'
+            with open(tmp,'wb') as fid:
+                np.savez(fid,**state)
+            os.replace(tmp,statefile)
+    # --- output: age of the columns on the last snapshot (scalar field)
+    n = len(drop.x1)
+    drop.fieldType   = 'Seafloor age'
+    drop.fieldNature = 'Scalar'
+    for name in ('vx','vy','vz','P','vr','vtheta','vphi'):
+        setattr(drop,name,[])
+        setattr(drop,name+'1',[])
+        setattr(drop,name+'2',[])
+    drop.v  = np.repeat(state['age'],nz)
+    drop.v1 = drop.v[0:n]
+    drop.v2 = drop.v[n:]
+    im('Seafloor age done!',pName,verbose)
+    return drop
+
+
+
+
+class StreamingStatistics:
+    """
+    Streaming per-point statistics of a field over a time series: the drops
+    are consumed one by one and the state is kept at the size of the grid,
+    so that the memory does not depend on the number of snapshots.
+        - mean and variance: Welford's algorithm
+        - running min and max
+        - optional histograms (counts per point on fixed bins)
+        - optional reservoir sampling (uniform sample of size 'reservoir' per
+          point) for approximate quantiles
+    Two accumulators (e.g. computed by parallel workers on parts of the time
+    series) are combined with self.merge(). The results are returned as stagData
+    objects (see self.result()) that can be exported with stagVTK.stag2VTU.
+    NaN values are ignored (per point count).
+    """
+    def __init__(self,field='v',bins=None,reservoir=0,seed=None,verbose=True):
+        """
+        <i> : field = str or function, name of the field of the stagData objects
+                      (e.g. 'v', 'vr', 'P') or function taking the stagData object
+                      in argument and returning the field
+              bins = None or np.ndarray, edges of the bins of the histograms
+              reservoir = int, size of the reservoir sample of each point (0 = no sample)
+              seed = None or int, seed of the random generator of the reservoir sampling
+              verbose = bool, controls inhibition of the internal message
+        """
+        self.pName = 'StreamingStatistics'
+        self.verbose = verbose
+        self.field = field
+        self.bins = None if bins is None else np.asarray(bins,dtype=np.float64)
+        self.reservoir = int(reservoir)
+        self.rng = np.random.default_rng(seed)
+        self.template = None  # stagData object defining the grid of the results
+        self.nsnap = 0        # number of snapshots consumed
+        self.n    = None      # number of (finite) values of each point
+        self.mean = None
+        self.M2   = None      # sum of the squared deviations to the mean
+        self.min  = None
+        self.max  = None
+        self.hist = None      # histograms, shape (npoints,nbins)
+        self.sample = None    # reservoir samples, shape (npoints,reservoir)
+
+
+    def im(self,textMessage):
+        """Print verbose internal message. This function depends on the
+        argument of self.verbose. If self.verbose == True then the message
+        will be displayed on the terminal.
+        <i> : textMessage = str, message to display
+        """
+        if self.verbose == True:
+            print('>> '+self.pName+'| '+textMessage)
 
 
+    def __init_state(self,npts):
+        """
+        Allocates the state for npts points.
+        """
+        self.n    = np.zeros(npts,dtype=np.int64)
+        self.mean = np.zeros(npts)
+        self.M2   = np.zeros(npts)
+        self.min  = np.full(npts,np.inf)
+        self.max  = np.full(npts,-np.inf)
+        if self.bins is not None:
+            self.hist = np.zeros((npts,len(self.bins)-1),dtype=np.int64)
+        if self.reservoir > 0:
+            self.sample = np.full((npts,self.reservoir),np.nan)
+
+
+    def update(self,stagData):
+        """
+        Consumes a drop: updates the statistics of all the points at once.
+        <i> : stagData = pypStag.stagData.StagData object, on the same grid as the
+                         previous ones
+        """
+        field = self.field
+        x = np.asarray(field(stagData) if callable(field) else getattr(stagData,field),dtype=np.float64).flatten()
+        if self.template is None:
+            self.template = stagData
+            self.__init_state(x.size)
+        elif x.size != self.n.size:
+            raise StagComputationalError('The stagData object has not the grid of the previous ones')
+        valid = np.isfinite(x)
+        xv = np.where(valid,x,0)
+        self.n += valid
+        n = np.maximum(self.n,1)
+        delta = np.where(valid,xv-self.mean,0)
+        self.mean += delta/n
+        self.M2   += delta*np.where(valid,xv-self.mean,0)
+        self.min = np.where(valid,np.minimum(self.min,xv),self.min)
+        self.max = np.where(valid,np.maximum(self.max,xv),self.max)
+        if self.hist is not None:
+            nbins = self.hist.shape[1]
+            ind = np.searchsorted(self.bins,xv,side='right')-1
+            ind[xv == self.bins[-1]] = nbins-1   # last bin closed on the right
+            ok = np.logical_and(valid,np.logical_and(ind >= 0,ind < nbins))
+            self.hist[np.where(ok)[0],ind[ok]] += 1
+        if self.sample is not None:
+            # reservoir sampling (algorithm R): the nth value replaces a random
+            # slot with a probability reservoir/n
+            k = self.reservoir
+            slot = np.where(self.n <= k,self.n-1,np.floor(self.rng.random(x.size)*self.n)).astype(np.int64)
+            ok = np.logical_and(valid,slot < k)
+            self.sample[np.where(ok)[0],slot[ok]] = x[ok]
+        self.nsnap += 1
+
+
+    def consume(self,cloud):
+        """
+        Consumes all the snapshots of a StagCloudData object, one drop at a time.
+        <i> : cloud = pypStag.stagData.StagCloudData object
+        """
+        self.im('Consume the '+str(cloud.nt)+' snapshots of the cloud')
+        cloud.reset()
+        for t in range(cloud.nt):
+            cloud.iterate()
+            self.update(cloud.drop)
+            self.im('  - snapshot '+str(t+1)+'/'+str(cloud.nt)+' done')
+        return self
 
 
+    def merge(self,other):
+        """
+        Merges the statistics of another StreamingStatistics object (e.g. computed
+        on another part of the time series) in the current one (Chan et al. formula
+        for the variance).
+        <i> : other = StreamingStatistics object with the same field, bins and reservoir size
+        """
+        if other.n is None:
+            return self
+        if self.n is None:
+            self.template = other.template
+            self.__init_state(other.n.size)
+        if other.n.size != self.n.size:
+            raise StagComputationalError('Merge of statistics computed on different grids')
+        na,nb = self.n,other.n
+        n  = na+nb
+        nn = np.maximum(n,1)
+        delta = other.mean-self.mean
+        if self.sample is not None:
+            # uniform sample of the union: the number of values taken in the sample
+            # of self follows a hypergeometric law, the values being taken randomly
+            # in the filled slots (always the first ones) of each sample
+            k = self.reservoir
+            m = np.minimum(n,k)
+            take = self.rng.hypergeometric(np.maximum(na,1),np.maximum(nb,1),np.maximum(m,1))
+            take = np.where(na == 0,0,np.where(nb == 0,m,take))
+            slots = np.arange(k)[None,:]
+            def shuffled(sample,nfilled):
+                keys = np.where(slots < np.minimum(nfilled,k)[:,None],self.rng.random(sample.shape),np.inf)
+                return np.take_along_axis(sample,np.argsort(keys,axis=1),axis=1)
+            sa = shuffled(self.sample,na)
+            sb = shuffled(other.sample,nb)
+            sb = np.take_along_axis(sb,np.clip(slots-take[:,None],0,k-1),axis=1)
+            self.sample = np.where(slots < take[:,None],sa,np.where(slots < m[:,None],sb,np.nan))
+        self.M2   = self.M2+other.M2+delta**2*na*nb/nn
+        self.mean = self.mean+delta*nb/nn
+        self.n    = n
+        self.min  = np.minimum(self.min,other.min)
+        self.max  = np.maximum(self.max,other.max)
+        if self.hist is not None:
+            self.hist = self.hist+other.hist
+        self.nsnap += other.nsnap
+        return self
+
+
+    def values(self,stat='mean',q=50):
+        """
+        Returns the requested statistics of all the points (flattened fields order).
+        <i> : stat = str, in ('mean','var','std','min','max','count','quantile')
+              q = int/float, percentile (in [0,100]) for stat == 'quantile' (computed
+                  on the reservoir samples)
+        """
+        if self.n is None:
+            raise StagComputationalError('No snapshot consumed')
+        empty = self.n == 0
+        if stat == 'mean':
+            out = self.mean.copy()
+        elif stat == 'var':
+            out = self.M2/np.maximum(self.n-1,1)
+        elif stat == 'std':
+            out = np.sqrt(self.M2/np.maximum(self.n-1,1))
+        elif stat == 'min':
+            out = self.min.copy()
+        elif stat == 'max':
+            out = self.max.copy()
+        elif stat == 'count':
+            return self.n.astype(np.float64)
+        elif stat == 'quantile':
+            if self.sample is None:
+                raise StagComputationalError('Quantiles need a reservoir sample (reservoir > 0)')
+            with np.errstate(invalid='ignore'):
+                out = np.nanpercentile(np.where(empty[:,None],0,self.sample),q,axis=1)
+        else:
+            raise StagComputationalError('Unknown statistics: '+str(stat))
+        out[empty] = np.nan
+        return out
 
 
+    def result(self,stat='mean',q=50):
+        """
+        Returns a stagData object on the grid of the consumed drops with
+        the requested statistics as scalar field (stagData.v), ready to
+        be exported with stagVTK.stag2VTU.
+        <i> : stat, q = see self.values()
+        """
+        import copy
+        sd = copy.copy(self.template)
+        ref = self.field(sd) if callable(self.field) else getattr(sd,self.field)
+        name = stat if stat != 'quantile' else 'p'+str(q)
+        return self.__as_stagData(self.values(stat,q).reshape(np.shape(ref)),name)
 
 
+    def anomaly(self,stagData):
+        """
+        Returns a stagData object with the anomaly of the field of the input
+        drop relatively to the temporal mean (stagData.v).
+        """
+        import copy
+        ref = self.field(stagData) if callable(self.field) else getattr(stagData,self.field)
+        ref = np.asarray(ref,dtype=np.float64)
+        return self.__as_stagData(ref-self.values('mean').reshape(ref.shape),'anomaly',copy.copy(stagData))
 
 
+    def __as_stagData(self,v,name,sd=None):
+        """
+        Fills a (shallow) copy of the template with the scalar field v.
+        """
+        import copy
+        if sd is None:
+            sd = copy.copy(self.template)
+        fname = self.field if isinstance(self.field,str) else 'field'
+        sd.fieldType   = str(sd.fieldType)+' '+fname+' '+name
+        sd.fieldNature = 'Scalar'
+        sd.v = v
+        if sd.geometry == 'yy':
+            n = len(sd.x1)
+            sd.v1 = v[0:n]
+            sd.v2 = v[n:]
+        return sd
+
 
 
 
+def _statistics_worker(task):
+    """
+    --- Internal function ---
+    Computes the StreamingStatistics of a part of a StagCloudData in a worker
+    process of cloud_statistics.
+    """
+    from .stagData import StagCloudData
+    (geometry,gpath,gfname,indices,resampling,beginIndex,endIndex,coarsening,kwargs,seed) = task
+    cloud = StagCloudData(geometry=geometry)
+    cloud.build(gpath,gfname,resampling=resampling,beginIndex=beginIndex,endIndex=endIndex,\
+                verbose=False,indices=indices,coarsening=coarsening)
+    stats = StreamingStatistics(seed=seed,verbose=False,**kwargs)
+    return stats.consume(cloud)
 
 
+
+def cloud_statistics(cloud,field='v',bins=None,reservoir=0,seed=None,workers=1,verbose=True):
+    """
+    Streaming per-point statistics of a StagCloudData time series (see
+    StreamingStatistics). With workers > 1, the snapshots are split in 'workers'
+    contiguous parts treated by a pool of processes and the partial statistics
+    are merged, each worker keeping a single snapshot in memory.
+    <i> : cloud = pypStag.stagData.StagCloudData object
+          field, bins, reservoir, seed = see StreamingStatistics (field must be a str
+                                         or a module level function if workers > 1)
+          workers = int, number of worker processes
+          verbose = bool, controls inhibition of the internal message
+    <o> : stats = StreamingStatistics object, e.g. stats.result('std') is a stagData
+                  object with the standard deviation of the field at each point
+    """
+    pName = 'cloud_statistics'
+    kwargs = {'field':field,'bins':bins,'reservoir':reservoir}
+    if workers <= 1:
+        return StreamingStatistics(seed=seed,verbose=verbose,**kwargs).consume(cloud)
+    from concurrent.futures import ProcessPoolExecutor
+    im('Statistics of '+str(cloud.nt)+' snapshots on '+str(workers)+' workers',pName,verbose)
+    parts = [list(p) for p in np.array_split(np.asarray(cloud.indices),workers) if len(p) > 0]
+    seeds = np.random.SeedSequence(seed).spawn(len(parts))
+    tasks = [(cloud.geometry,cloud.gpath,cloud.gfname,p,cloud.resampling,cloud.beginIndex,\
+              cloud.endIndex,cloud.coarsening,kwargs,s) for p,s in zip(parts,seeds)]
+    stats = StreamingStatistics(seed=seed,verbose=verbose,**kwargs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(_statistics_worker,tasks):
+            stats.merge(part)
+    im('Statistics done!',pName,verbose)
+    return stats
+
+
+
+
+def detect_features(stagData,velocity=None,kind='plume',dT=None,vr=None,connectivity=1,min_points=1,verbose=True):
+    """
+    3D detection of the plumes (or slabs) of a full temperature volume, as the
+    connected components of the nodes verifying thresholds on the temperature
+    anomaly (relatively to the area-weighted mean of the layer) and/or on the
+    radial velocity. The components are labelled on the logical grid of each
+    block with scipy.ndimage.label. On Yin-Yang grids, the components are then
+    merged across the seams of the blocks: the stored nodes at the border of the
+    stored part of a block are connected to the nearest stored node of the
+    other block at the position of their missing neighbour, and the connected
+    labels are merged (union-find with scipy.sparse.csgraph).
+    <i> : stagData = pypStag.stagData.StagData *TEMPERATURE* object (3D: 'yy', 'spherical'
+                     or 'cart3D')
+          velocity = None or pypStag.stagData.StagData *VELOCITY* object on the same grid,
+                     needed for a threshold on vr and for the buoyancy flux
+          kind = str, 'plume' (dT' >= dT and vr >= vr) or 'slab' (dT' <= -dT and vr <= -vr)
+          dT = None or int/float (>0), threshold on the temperature anomaly
+          vr = None or int/float (>0), threshold on the radial velocity
+          connectivity = int, in (1,2,3), connectivity of the nodes on the logical grids
+                         (1: faces, 2: faces+edges, 3: faces+edges+corners)
+          min_points = int, the features with less than min_points nodes are removed
+          verbose = bool, controls inhibition of the internal message
+    <o> : (labels,features)
+          labels = np.ndarray(int), label of each node (flattened fields order), 0 outside
+                   of the features and 1..nfeatures inside (sorted by decreasing volume)
+          features = dict of np.ndarray with one entry per feature:
+                   'npoints', 'volume', 'centroid' (nfeatures,3) (volume-weighted, cartesian),
+                   'rmin','rmax' (radial extent, z for cartesian grids), 'lateral_extent'
+                   (maximum angular distance in radians to the direction of the centroid, or
+                   horizontal distance for cartesian grids), 'lon','lat' (in degrees, of the
+                   centroid, spherical geometries only) and 'buoyancy_flux' (mean over the
+                   radial extent of the flux of dT'*vr through the horizontal sections,
+                   NaN without velocity)
+    """
+    from scipy import ndimage
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+    from .stagLocator import get_locator
+    from time import time
+    pName = 'detect_features'
+    time0 = time()
+    if stagData.fieldType != 'Temperature':
+        raise fieldTypeError('Temperature')
+    if velocity is not None and velocity.fieldType != 'Velocity':
+        raise fieldTypeError('Velocity')
+    if kind not in ('plume','slab'):
+        raise StagComputationalError("Unknown kind of feature: '"+str(kind)+"', must be in ('plume','slab')")
+    if dT is None and vr is None:
+        raise StagComputationalError('At least one threshold (dT or vr) is needed')
+    if vr is not None and velocity is None:
+        raise StagComputationalError('A velocity stagData object is needed for a threshold on vr')
+    im('3D detection of the '+kind+'s',pName,verbose)
+    nz  = stagData.nz
+    V   = cell_volumes(stagData)
+    T   = np.asarray(stagData.v,dtype=np.float64).reshape(V.shape)
+    dTa = T-np.sum(V*T,axis=0)/np.sum(V,axis=0)
+    sign = 1 if kind == 'plume' else -1
+    mask = np.ones(V.shape,dtype=bool)
+    if dT is not None:
+        mask = np.logical_and(mask,sign*dTa >= dT)
+    if velocity is not None:
+        if velocity.geometry == 'cart3D':
+            vrad = np.asarray(velocity.vz,dtype=np.float64)
+        else:
+            vrad = np.asarray(velocity.vr,dtype=np.float64)
+        vrad = vrad.reshape(V.shape)
+        if vr is not None:
+            mask = np.logical_and(mask,sign*vrad >= vr)
+    im('  -> '+str(np.count_nonzero(mask))+' nodes above the thresholds',pName,verbose)
+    # --- labels on the logical grid of each block
+    loc = get_locator(stagData)
+    loc.verbose = False
+    keep = loc.colpos >= 0
+    structure = ndimage.generate_binary_structure(3,connectivity)
+    labels = np.zeros(V.size,dtype=np.int64)
+    nlab = 0
+    nblock = loc.ncol*nz
+    for b in range(loc.nb):
+        G = np.zeros((loc.nx,loc.ny,nz),dtype=bool)
+        G[keep] = mask.reshape(loc.nb,loc.ncol,nz)[b]
+        lab,n = ndimage.label(G,structure=structure)
+        lab[lab > 0] += nlab
+        labels[b*nblock:(b+1)*nblock] = lab[keep].flatten()
+        nlab += n
+    # --- merge across the Yin-Yang seams
+    pairs = [np.zeros((0,2),dtype=np.int64)]
+    if loc.nb > 1:
+        ci,cj = np.meshgrid(np.arange(loc.nx),np.arange(loc.ny),indexing='ij')
+        ci,cj = ci[keep],cj[keep]
+        for b in range(loc.nb):
+            for di,dj in ((-1,0),(1,0),(0,-1),(0,1)):
+                ii,jj = ci+di,cj+dj
+                inrange = (ii >= 0)*(ii < loc.nx)*(jj >= 0)*(jj < loc.ny)
+                border = ~inrange
+                border[inrange] = ~keep[ii[inrange],jj[inrange]]
+                if not np.any(border):
+                    continue
+                # nodes (all layers) of the border columns, in the features
+                cols = np.where(border)[0]
+                src = ((b*loc.ncol+cols)[:,None]*nz+np.arange(nz)[None,:]).flatten()
+                kk  = np.tile(np.arange(nz),len(cols))
+                sel = labels[src] > 0
+                if not np.any(sel):
+                    continue
+                src,kk = src[sel],kk[sel]
+                ii,jj = np.repeat(ii[cols],nz)[sel],np.repeat(jj[cols],nz)[sel]
+                # position of the missing neighbour (extrapolated coordinates)
+                e1 = np.interp(ii,np.arange(loc.nx),loc.x_coords,left=np.nan,right=np.nan)
+                e1 = np.where(ii < 0,loc.x_coords[0]-(loc.x_coords[1]-loc.x_coords[0]),e1)
+                e1 = np.where(ii >= loc.nx,loc.x_coords[-1]+(loc.x_coords[-1]-loc.x_coords[-2]),e1)
+                e2 = np.interp(jj,np.arange(loc.ny),loc.y_coords,left=np.nan,right=np.nan)
+                e2 = np.where(jj < 0,loc.y_coords[0]-(loc.y_coords[1]-loc.y_coords[0]),e2)
+                e2 = np.where(jj >= loc.ny,loc.y_coords[-1]+(loc.y_coords[-1]-loc.y_coords[-2]),e2)
+                R   = loc.rcmb+loc.z_coords[kk]
+                lat,lon = np.pi/4-e1,e2-3*np.pi/4
+                x1,y1,z1 = R*np.cos(lat)*np.cos(lon),R*np.cos(lat)*np.sin(lon),R*np.sin(lat)
+                x,y,z = (x1,y1,z1) if b == 0 else (-x1,z1,y1)
+                # nearest stored node of the other block
+                ob = 1-b
+                blk,i0,j0,k0,fi,fj,fk = loc.locate(x,y,z,block=ob)
+                best = np.full(len(x),-1,dtype=np.int64)
+                dmin = np.full(len(x),np.inf)
+                for di2 in (0,1):
+                    for dj2 in (0,1):
+                        i2,j2 = np.minimum(i0+di2,loc.nx-1),np.minimum(j0+dj2,loc.ny-1)
+                        g = loc.index(ob,i2,j2,kk)
+                        xn,yn,zn = loc.node_xyz(ob,i2,j2,kk)
+                        d = (xn-x)**2+(yn-y)**2+(zn-z)**2
+                        better = np.logical_and(g >= 0,d < dmin)
+                        best[better],dmin[better] = g[better],d[better]
+                ok = best >= 0
+                ok[ok] = labels[best[ok]] > 0
+                pairs.append(np.stack((labels[src[ok]],labels[best[ok]]),axis=1))
+    pairs = np.concatenate(pairs)
+    graph = csr_matrix((np.ones(len(pairs)),(pairs[:,0],pairs[:,1])),shape=(nlab+1,nlab+1))
+    ncomp,comp = connected_components(graph,directed=False)
+    labels = np.where(labels > 0,comp[labels]+1,0)  # 0 stays the background component
+    if len(pairs) > 0:
+        im('  -> '+str(nlab)+' block components merged across the seams',pName,verbose)
+    # --- properties of the features
+    counts = np.bincount(labels)
+    vol = np.bincount(labels,weights=V.flatten())
+    # sort by decreasing volume, remove the small ones (label 0 = background)
+    order = np.argsort(-vol[1:],kind='stable')+1
+    order = order[counts[order] >= max(min_points,1)]
+    newlab = np.zeros(len(counts),dtype=np.int64)
+    newlab[order] = np.arange(1,len(order)+1)
+    labels = newlab[labels]
+    nf = len(order)
+    im('  -> '+str(nf)+' feature(s) detected',pName,verbose)
+    Vf = V.flatten()
+    x,y,z = [np.asarray(c,dtype=np.float64).flatten() for c in (stagData.x,stagData.y,stagData.z)]
+    features = {}
+    features['npoints'] = np.bincount(labels,minlength=nf+1)[1:]
+    features['volume']  = np.bincount(labels,weights=Vf,minlength=nf+1)[1:]
+    cen = np.stack([np.bincount(labels,weights=Vf*c,minlength=nf+1)[1:] for c in (x,y,z)],axis=1)
+    cen = cen/np.maximum(features['volume'],1e-300)[:,None]
+    features['centroid'] = cen
+    sel = np.where(labels > 0)[0]
+    sel = sel[np.argsort(labels[sel],kind='stable')]
+    starts = np.searchsorted(labels[sel],np.arange(1,nf+1))
+    k = np.tile(np.arange(nz),V.shape[0])
+    if nf > 0:
+        kmin = np.minimum.reduceat(k[sel],starts)
+        kmax = np.maximum.reduceat(k[sel],starts)
+    else:
+        kmin = kmax = np.zeros(0,dtype=np.int64)
+    re = _radial_edges(stagData)
+    if stagData.geometry == 'cart3D':
+        rpos = z
+        cl = cen[labels[sel]-1]
+        dist = np.sqrt((x[sel]-cl[:,0])**2+(y[sel]-cl[:,1])**2)
+    else:
+        re = re+stagData.rcmb
+        rpos = np.sqrt(x**2+y**2+z**2)
+        cn = cen/np.maximum(np.sqrt(np.sum(cen**2,axis=1)),1e-300)[:,None]
+        cl = cn[labels[sel]-1]
+        dist = np.arccos(np.clip((x[sel]*cl[:,0]+y[sel]*cl[:,1]+z[sel]*cl[:,2])/rpos[sel],-1,1))
+        features['lon'] = np.arctan2(cen[:,1],cen[:,0])*180/np.pi
+        features['lat'] = np.arcsin(np.clip(cn[:,2],-1,1))*180/np.pi
+    features['rmin'] = np.minimum.reduceat(rpos[sel],starts) if nf > 0 else np.zeros(0)
+    features['rmax'] = np.maximum.reduceat(rpos[sel],starts) if nf > 0 else np.zeros(0)
+    features['lateral_extent'] = np.maximum.reduceat(dist,starts) if nf > 0 else np.zeros(0)
+    if velocity is not None:
+        flux = np.bincount(labels,weights=(dTa*vrad*V).flatten(),minlength=nf+1)[1:]
+        features['buoyancy_flux'] = flux/(re[kmax+1]-re[kmin])
+    else:
+        features['buoyancy_flux'] = np.full(nf,np.nan)
+    im('Detection done in '+str(time()-time0)[0:5]+' s',pName,verbose)
+    return labels,features
@@ -33,10 +33,17 @@ def Rgt(lat,lon):
     Vxyz = np.dot(Rgt_inv,Venu)
 
     ** Lat, Lon coordinates in RADIANS **
+    If lat and lon are arrays of N points, returns the stacked matrices
+    with a shape (N,3,3) (apply with np.einsum('nij,nj->ni',Rgt,Vxyz)).
     """
-    return np.array([[-np.sin(lon),np.cos(lon),0],\
-                     [-np.sin(lat)*np.cos(lon),-np.sin(lat)*np.sin(lon),np.cos(lat)],\
-                     [np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)]])
+    slat,clat = np.sin(lat),np.cos(lat)
+    slon,clon = np.sin(lon),np.cos(lon)
+    R = np.array([[-slon,clon,np.zeros(np.shape(lon))],\
+                  [-slat*clon,-slat*slon,clat],\
+                  [clat*clon,clat*slon,slat]])
+    if R.ndim == 2:
+        return R
+    return np.moveaxis(R.reshape((3,3,-1)),2,0)
 
 
 def rotation_matrix_3D(axis,theta):
@@ -69,51 +76,149 @@ def rotation_matrix_3D(axis,theta):
     return R
 
 
-def ecef2enu(lat,lon,vx,vy,vz):
+def _out_buffers(out,shape,n):
     """
-    Transform velocities from ECEF to ENU.
-    ** Lat, Lon coordinates in RADIANS **
+    Returns the n output arrays: the ones given in 'out' (reused in place)
+    or new ones with the input shape.
     """
-    nod  = len(vx)
-    vlon = np.zeros(nod)
-    vlat = np.zeros(nod)
-    vr   = np.zeros(nod)
-    for i in range(nod):
-        v_i = np.array([vx[i],vy[i],vz[i]])
-        Rmatrix = Rgt(lat[i],lon[i])
-        vlon[i],vlat[i],vr[i] = np.dot(Rmatrix,v_i)
-    return vlon,-vlat,vr
+    if out is None:
+        return tuple(np.empty(shape) for i in range(n))
+    return out
 
 
-def ecef2enu_stagYY(x,y,z,vx,vy,vz):
+def ecef2enu(lat,lon,vx,vy,vz,out=None):
+    """
+    Transform velocities from ECEF to ENU.
+    ** Lat, Lon coordinates in RADIANS **
+    Vectorized on all the points (closed form of np.dot(Rgt(lat,lon),v) for
+    each point).
+    <i> : lat,lon  = np.ndarray, coordinates of the points in RADIANS
+          vx,vy,vz = np.ndarray, ECEF components of the vectors
+          out = None or tuple of 3 np.ndarray with the shape of vx, if given,
+                the results are written in these arrays (e.g. to reuse the
+                same buffers on all the snapshots of a time series)
+    <o> : (vlon,-vlat,vr)
+    """
+    slat,clat = np.sin(lat),np.cos(lat)
+    slon,clon = np.sin(lon),np.cos(lon)
+    vlon,vlat,vr = _out_buffers(out,np.shape(vx),3)
+    np.multiply(-slon,vx,out=vlon)
+    vlon += clon*vy
+    # -vlat
+    np.multiply(slat*clon,vx,out=vlat)
+    vlat += slat*slon*vy
+    vlat -= clat*vz
+    np.multiply(clat*clon,vx,out=vr)
+    vr += clat*slon*vy
+    vr += slat*vz
+    return vlon,vlat,vr
+
+
+def ecef2enu_stagYY(x,y,z,vx,vy,vz,out=None):
     """
     Transform the ECEF vectors (vx,vy,vz) into ENU vectors (Vphi,vtheta,vr)
     Here, vtheta is -vlat (as computed in stagData)
+    out = None or tuple of 3 np.ndarray with the shape of vx, if given, the
+          results are written in these arrays
     """
     lat = np.arctan2(np.sqrt(x**2+y**2),z) # in reality, it is the colatitude: so it is why, the following formula
                                            # is not exactly the same as in textbooks!! sin(lat) -> -cos(lat) and cos(lat) -> -sin(lat)
     lon = np.arctan2(y,x)
-    vtheta =  vx*(np.cos(lon)*np.cos(lat)) + vy*(np.sin(lon)*np.cos(lat)) - vz*(np.sin(lat))
-    vphi   = -vx*(np.sin(lon))             + vy*(np.cos(lon))
-    vr     = -vx*(np.cos(lon)*np.sin(lat)) - vy*(np.sin(lon)*np.sin(lat)) - vz*(np.cos(lat))
-    vr = -vr
+    slat,clat = np.sin(lat),np.cos(lat)
+    slon,clon = np.sin(lon),np.cos(lon)
+    vphi,vtheta,vr = _out_buffers(out,np.shape(vx),3)
+    np.multiply(clon*clat,vx,out=vtheta)
+    vtheta += slon*clat*vy
+    vtheta -= slat*vz
+    np.multiply(-slon,vx,out=vphi)
+    vphi += clon*vy
+    np.multiply(clon*slat,vx,out=vr)
+    vr += slon*slat*vy
+    vr += clat*vz
     return vphi,vtheta,vr
 
 
-def velocity_pole_projecton(x,y,z,vx,vy,vz,wx,wy,wz):
+def velocity_pole_projecton(x,y,z,vx,vy,vz,wx,wy,wz,out=None):
     """
     Substract the rotation defined by (wx,wy,wz) to the velocity field
-    in input.
+    in input. Vectorized on all the points.
+    out = None or tuple of 6 np.ndarray with the shape of vx, if given, the
+          results (vxo,vyo,vzo,vphio,vthetao,vro) are written in these arrays
     """
+    vxo,vyo,vzo,vphio,vthetao,vro = _out_buffers(out,np.shape(vx),6)
     vxf,vyf,vzf = cartfipole(x,y,z,wx,wy,wz)
-    vxo = vx-vxf
-    vyo = vy-vyf
-    vzo = vz-vzf
-    vphio,vthetao,vro = ecef2enu_stagYY(x,y,z,vxo,vyo,vzo)
+    np.subtract(vx,vxf,out=vxo)
+    np.subtract(vy,vyf,out=vyo)
+    np.subtract(vz,vzf,out=vzo)
+    ecef2enu_stagYY(x,y,z,vxo,vyo,vzo,out=(vphio,vthetao,vro))
     return vxo, vyo, vzo, vphio, vthetao, vro
 
 
-
-
-
-
+def euler_pole_inversion(x,y,z,vx,vy,vz,weights=None,masks=None):
+    """
+    Least-squares inversion of the rotation vector (wx,wy,wz) that best fits
+    the velocity field (vx,vy,vz) with the kinematics of cartfipole
+    (v = w x r), i.e. minimizes sum(weights*|v - w x r|^2).
+    Solves the 3x3 normal equations
+        sum(weights*(|r|^2*I - r.r^T)) . w = sum(weights*(r x v))
+    assembled with a few matrix products on all the points, so that many
+    masks and snapshots are inverted at once.
+    <i> : x,y,z    = np.ndarray, shape (N), cartesian coordinates of the points
+          vx,vy,vz = np.ndarray, shape (N) or (nt,N) for a batch of nt
+                     snapshots sharing the same grid
+          weights  = None or np.ndarray, shape (N), weights of the points
+                     (e.g. the area of the cells). If None, uniform weights.
+          masks    = None, np.ndarray of bool, shape (nmask,N) (one line per
+                     plate/region), or np.ndarray of int, shape (N), with the
+                     plate index of each point (negative = not used).
+                     If None, a single fit on all the points.
+    <o> : w = np.ndarray with the shape (...,3): (3) for a single fit,
+              (nt,3) for a batch of snapshots, (nmask,3) for a batch of
+              masks and (nt,nmask,3) for both. Masks with less than two
+              non-aligned points return NaN.
+              Each w[...,:] can directly be given to set_pole_projection.
+    """
+    x,y,z = [np.asarray(c,dtype=np.float64).ravel() for c in (x,y,z)]
+    npts  = x.size
+    if weights is None:
+        weights = np.ones(npts)
+    else:
+        weights = np.asarray(weights,dtype=np.float64).ravel()
+    # --- weight matrix W, shape (nmask,N)
+    if masks is None:
+        W = weights[np.newaxis,:]
+    else:
+        masks = np.asarray(masks)
+        if masks.ndim == 1:
+            labels = masks.astype(np.int64)
+            nmask  = max(labels.max()+1,0)
+            masks  = labels[np.newaxis,:] == np.arange(nmask)[:,np.newaxis]
+        W = masks*weights[np.newaxis,:]
+    # --- normal matrices, shape (nmask,3,3)
+    r2 = x**2+y**2+z**2
+    Wx,Wy,Wz = W*x,W*y,W*z
+    A = np.empty((W.shape[0],3,3))
+    A[:,0,0] = W.dot(r2-x**2)
+    A[:,1,1] = W.dot(r2-y**2)
+    A[:,2,2] = W.dot(r2-z**2)
+    A[:,0,1] = A[:,1,0] = -Wx.dot(y)
+    A[:,0,2] = A[:,2,0] = -Wx.dot(z)
+    A[:,1,2] = A[:,2,1] = -Wy.dot(z)
+    # --- right hand sides sum(W*(r x v)), shape (nt,nmask,3)
+    batch = np.ndim(vx) == 2
+    vx,vy,vz = [np.asarray(c,dtype=np.float64).reshape(-1,npts) for c in (vx,vy,vz)]
+    b = np.empty((vx.shape[0],W.shape[0],3))
+    b[:,:,0] = vz.dot(Wy.T) - vy.dot(Wz.T)
+    b[:,:,1] = vx.dot(Wz.T) - vz.dot(Wx.T)
+    b[:,:,2] = vy.dot(Wx.T) - vx.dot(Wy.T)
+    # --- solve (degenerated masks -> NaN)
+    singular = np.abs(np.linalg.det(A)) <= 1e-12*np.maximum(np.abs(A).max(axis=(1,2)),1e-300)**3
+    A[singular] = np.eye(3)
+    w = np.linalg.solve(A[np.newaxis],b[...,np.newaxis])[...,0]
+    w[:,singular,:] = np.nan
+    # --- output shape
+    if masks is None:
+        w = w[:,0,:]
+    if not batch:
+        w = w[0]
+    return w
@@ -14,12 +14,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 from .stagReader import fields, reader_time, reader_rprof, reader_plates_analyse
 from .stagComputeMod import velocity_pole_projecton, ecef2enu_stagYY, rotation_matrix_3D, \
-                            xyz2latlon
+                            xyz2latlon, euler_pole_inversion
 from .stagError import NoFileError, InputGridGeometryError, GridGeometryError, fieldTypeError, \
                        MetaCheckFieldUnknownError, MetaFileInappropriateError, FieldTypeInDevError, \
                        VisuGridGeometryError, StagTypeError, CloudBuildIndexError, SliceAxisError, \
                        IncoherentSliceAxisError, StagUnknownLayerError, StagComputationalError,\
-                       GridGeometryIncompatibleError, StagBaseError, fieldNatureError
+                       GridGeometryIncompatibleError, StagBaseError, fieldNatureError, StagCoarseningError
 
 
 
@@ -42,6 +42,7 @@ class MainStagObject:
         self.path  = ''                 #The path to the stag file
         self.fname = ''                 #File name of the stag file
         self.resampling = []#Resampling Parameters
+        self.coarsening = None #Coarsening mode of the resampling (None = decimation)
         self.header = []    #Raw header of stag file
         self.simuAge = 0    #Dimensionless age of the simulation
         self.ti_step = 0    #Inner step of the stag simualtion state
@@ -77,7 +78,7 @@ class MainStagObject:
             print('>> '+self.pName+'| '+textMessage)
 
 
-    def stagImport(self, directory, fname, beginIndex=-1, endIndex=-1, resampling=[1,1,1]):
+    def stagImport(self, directory, fname, beginIndex=-1, endIndex=-1, resampling=[1,1,1], coarsening=None):
         """ This function reads a stag data file using the modul stagReader.fields
         and fill the appropriated fields of the current StagData object.
         <i> : directory = str, path to reach the data file
@@ -92,6 +93,16 @@ class MainStagObject:
                            resampling parameters (int) on X, Y and Z axis as:
                            resampling = [resampling_on_X,resampling_on_Y,resampling_on_Z]
                            (Default: resampling=[1,1,1], means no resampling)
+              coarsening = None or str, defines how the resampling is done. If None, the
+                           resampling is a decimation (keeps 1 point over resampling[i]
+                           and the last one). If in ('mean','min','max'), the fields are
+                           reduced over blocks of resampling[0] x resampling[1] x resampling[2]
+                           points ('mean' being weighted by the cell sizes) and the new grid
+                           points are the weighted mean positions of the blocks. The last
+                           block of each direction gathers the remaining points. With a
+                           coarsening, beginIndex and endIndex apply on the original layers.
+                           For vectorial fields, the reduction is done on each component.
+                           (Default: coarsening=None)
               """
         self.im('Reading and resampling: '+fname)
         # - Autocompletion of the path
@@ -100,6 +111,9 @@ class MainStagObject:
         self.path  = Path(directory+fname) #creat a Path object
         self.fname = fname
         self.resampling = resampling
+        self.coarsening = coarsening
+        if coarsening not in (None,'mean','min','max'):
+            raise StagCoarseningError(coarsening)
         # - First, test the geometry:
         if self.geometry not in ('cart2D','cart3D','yy','spherical','annulus'):
             raise InputGridGeometryError(self.geometry)
@@ -148,6 +162,15 @@ class MainStagObject:
                 if self.geometry == 'cart3D' or self.geometry == 'spherical':
                     raise GridGeometryError(self.geometry,'yy')
 
+        if coarsening is not None:
+            self.im('  - Coarsening of the grid: '+coarsening+' over blocks of '+\
+                    str(resampling[0])+'x'+str(resampling[1])+'x'+str(resampling[2])+' points')
+            self.im('    - Original grid: '+str(len(self.x_coords))+'x'+str(len(self.y_coords))+'x'+str(len(self.z_coords)))
+            self.__coarsening(beginIndex,endIndex)
+            beginIndex = -1
+            endIndex   = -1
+            resampling = [1,1,1]
+
         self.nx0 = len(self.x_coords)
         self.ny0 = len(self.y_coords)
         self.nz0 = len(self.z_coords)
@@ -310,6 +333,53 @@ class MainStagObject:
         self.im('Reading and resampling operations done!')
     
 
+    def __coarsening(self,beginIndex,endIndex):
+        """
+        --- Internal function ---
+        Reduces the raw fields self.flds and the coordinates over blocks of
+        self.resampling points (see the argument coarsening of stagImport), and
+        updates self.header ('nts' and 'e*_coord') with the coarse grid so that
+        the processing of the data is unchanged.
+        <i> : beginIndex, endIndex = int, range of the original layers kept (as in stagImport)
+        """
+        if beginIndex == -1:
+            beginIndex = 0
+        if endIndex == -1:
+            endIndex = len(self.z_coords)
+        # the ghost points of the vectorial files (header['xyp']) are dropped as in the processing
+        flds = self.flds[:,0:len(self.x_coords),0:len(self.y_coords),beginIndex:endIndex,:]
+        coords = [np.asarray(self.x_coords,dtype=np.float64),np.asarray(self.y_coords,dtype=np.float64),\
+                  np.asarray(self.z_coords,dtype=np.float64)[beginIndex:endIndex]]
+        for axis in range(3):
+            c = coords[axis]
+            n = flds.shape[axis+1]
+            starts = np.arange(0,n,max(int(self.resampling[axis]),1))
+            if n > 1:
+                # cell sizes from the mid-points between the nodes (nodes at the cell centers)
+                edges = np.concatenate(([1.5*c[0]-0.5*c[1]],(c[1:]+c[:-1])/2,[1.5*c[-1]-0.5*c[-2]]))
+                w = np.diff(edges)
+            else:
+                w = np.ones(n)
+            wsum = np.add.reduceat(w,starts)
+            coords[axis] = np.add.reduceat(w*c,starts)/wsum
+            if self.coarsening == 'mean':
+                shape = [1]*flds.ndim
+                shape[axis+1] = n
+                flds = np.add.reduceat(flds*w.reshape(shape),starts,axis=axis+1)
+                shape[axis+1] = len(starts)
+                flds = flds/wsum.reshape(shape)
+            elif self.coarsening == 'min':
+                flds = np.minimum.reduceat(flds,starts,axis=axis+1)
+            else:
+                flds = np.maximum.reduceat(flds,starts,axis=axis+1)
+        self.flds = flds.astype(self.flds.dtype)
+        (self.x_coords,self.y_coords,self.z_coords) = coords
+        self.header['nts'] = np.array(flds.shape[1:4])
+        for i,key in enumerate(('e1_coord','e2_coord','e3_coord')):
+            if isinstance(self.header.get(key),np.ndarray):
+                self.header[key] = coords[i]
+    
+
     def stag2VTU(self,fname=None,path='./',ASCII=False,return_only=False,creat_pointID=False,verbose=True):
             """ Extension of the stagVTK package, directly available on stagData !
             This function creat '.vtu' or 'xdmf/h5' file readable with Paraview to efficiently 
@@ -345,8 +415,54 @@ class MainStagObject:
             else:
                 Points,ElementNumbers,vstack,pointID = stag2VTU(fname,self,path,ASCII=ASCII,creat_pointID=creat_pointID,return_only=return_only,verbose=verbose)
                 return Points,ElementNumbers,vstack,pointID
-    
-    
+
+
+    def probe(self,points,fields='v',coordinates='geographic',fill_value=np.nan):
+        """ Samples fields of the current StagData object at an arbitrary set of
+        points using a trilinear interpolation on the cells of the native logical
+        grid (cartesian, spherical or Yin-Yang blocks). Points are located and
+        weighted in a vectorized way (see pypStag.stagLocator) so that millions of
+        points can be probed at once, for any number of fields.
+        <i> : points = np.ndarray, matrix of shape (N,3) containing the coordinates
+                       of the points according to the 'coordinates' argument.
+              fields = str or list of str, name(s) of the field(s) to probe in
+                       ['v','vx','vy','vz','P','vr','vtheta','vphi']
+                       (Default: fields='v')
+              coordinates = str, 'geographic' if the points are given as
+                       (lon[deg],lat[deg],depth[km]) (only for 'yy' and 'spherical'
+                       geometries) or 'cartesian' if given as (x,y,z).
+                       Note that cart3D data are always probed in cartesian coordinates.
+                       (Default: coordinates='geographic')
+              fill_value = float, value given to the points outside the grid
+                       (Default: fill_value=np.nan)
+        <o> : if fields is a str, returns a np.ndarray of size N
+              else, returns a dict {fieldName: np.ndarray of size N}
+        """
+        from .stagLocator import get_locator, trilinear_operator, lonlat2xyz
+        points = np.asarray(points,dtype=np.float64).reshape(-1,3)
+        self.im('Probing of the fields on '+str(points.shape[0])+' points')
+        if coordinates == 'cartesian' or self.geometry == 'cart3D':
+            x,y,z = points[:,0],points[:,1],points[:,2]
+        elif coordinates == 'geographic':
+            x,y,z = lonlat2xyz(points[:,0],points[:,1],self.rcmb+1-points[:,2]/2890)
+        else:
+            raise StagBaseError("Unknown coordinates '"+str(coordinates)+"': must be 'geographic' or 'cartesian'")
+        W,valid = trilinear_operator(get_locator(self),x,y,z)
+        names = [fields] if isinstance(fields,str) else list(fields)
+        values = {}
+        for name in names:
+            if name not in ('v','vx','vy','vz','P','vr','vtheta','vphi'):
+                raise StagBaseError("Unknown field '"+str(name)+"'")
+            if name != 'v' and self.fieldNature != 'Vectorial':
+                raise fieldNatureError('Vectorial')
+            values[name] = W.dot(np.asarray(getattr(self,name)).flatten())
+            values[name][~valid] = fill_value
+        self.im('  -> Points outside the grid: '+str(np.count_nonzero(~valid)))
+        if isinstance(fields,str):
+            return values[fields]
+        return values
+
+
 
 
 
@@ -892,6 +1008,90 @@ class StagYinYangGeometry(MainStagObject):
             self.vr      = np.stack((self.vr1,self.vr2)).reshape(2*len(self.v1))
     
     
+    def _nearest_columns(self,lon,lat):
+        """
+        Returns the index (in the (NxNy,Nz) reshaped fields) of the grid columns
+        the nearest (great-circle distance) of the input surface points.
+        <i> : lon,lat = np.ndarray, longitudes and latitudes in *DEGREES*
+        """
+        from .stagLocator import YinYangLocator, lonlat2xyz
+        lon = np.atleast_1d(np.asarray(lon,dtype=np.float64)).flatten()
+        lat = np.atleast_1d(np.asarray(lat,dtype=np.float64)).flatten()
+        locator = YinYangLocator(self)
+        x,y,z = lonlat2xyz(lon,lat,np.ones(lon.shape)*(self.rcmb+locator.z_coords[-1]))
+        return locator.nearest(x,y,z)//locator.nz
+
+
+    def get_vprofiles(self,lon,lat,fields='v',interpolation=False):
+        """ Batched extraction of N vertical profiles in the loaded data, below N surface
+        points given in geographical coordinates. The profiles are located with the
+        analytic Yin-Yang locator (pypStag.stagLocator) so that the search is exact on
+        the sphere (poles, dateline) and does not scan the grid for each profile.
+        Args:
+            lon (int/float/np.ndarray): longitudes (in *DEGREES*) of the intersections between
+                                    the profiles and the shallowest layer.
+            lat (int/float/np.ndarray): latitudes (in *DEGREES*) of the intersections between
+                                    the profiles and the shallowest layer.
+            fields (str or list of str, optional): field(s) to extract in ['v','vx','vy','vz',
+                                    'vr','vtheta','vphi','P']. Defaults to 'v'.
+            interpolation (bool, optional): If False, returns the profiles of the nearest
+                                    grid columns (great-circle distance). If True, the
+                                    profiles are interpolated horizontally between the
+                                    neighbouring columns (bilinear weights on the logical
+                                    grid, computed once for all the layers). Defaults to False.
+        Outputs:
+            vprof (np.ndarray or dict): Matrix (N,Nz) containing the extracted profiles. If
+                                    fields is a list, returns a dict {fieldName: (N,Nz) matrix}
+            coordinates (np.ndarray): Matrix (N,Nz,3) containing the (lon[deg],lat[deg],depths[km])
+                                    of the profile points (the coordinates of the nearest grid
+                                    columns if interpolation is False).
+        """
+        from .stagLocator import YinYangLocator, trilinear_operator, lonlat2xyz
+        lon = np.atleast_1d(np.asarray(lon,dtype=np.float64)).flatten()
+        lat = np.atleast_1d(np.asarray(lat,dtype=np.float64)).flatten()
+        if lon.shape != lat.shape:
+            raise StagBaseError('The longitude and latitude vectors must have the same size')
+        self.im('Extraction of '+str(lon.shape[0])+' vertical profiles')
+        Nz   = self.slayers.shape[0]
+        NxNy = int(self.x.shape[0]/Nz)
+        names = [fields] if isinstance(fields,str) else list(fields)
+        for name in names:
+            if name not in ('v','vx','vy','vz','P','vr','vtheta','vphi'):
+                raise StagBaseError("Unknown field '"+str(name)+"'")
+            if name != 'v' and self.fieldNature != 'Vectorial':
+                raise fieldNatureError('Vectorial')
+        depths  = np.asarray(self.depths,dtype=np.float64).flatten()
+        coordinates = np.zeros((lon.shape[0],Nz,3))
+        vprof = {}
+        if not interpolation:
+            self.im('  -> Nearest grid columns')
+            ids = self._nearest_columns(lon,lat)
+            coordinates[:,:,0] = self.phi.reshape((NxNy,Nz))[ids,:]*180/np.pi
+            coordinates[:,:,1] = 90-self.theta.reshape((NxNy,Nz))[ids,:]*180/np.pi
+            coordinates[:,:,2] = depths[None,:]
+            for name in names:
+                vprof[name] = np.asarray(getattr(self,name)).reshape((NxNy,Nz))[ids,:]
+        else:
+            self.im('  -> Horizontal interpolation between the neighbouring columns')
+            # weights computed on the shallowest layer and shifted on the other ones:
+            # the Yin-Yang logical grid is the same on all the layers
+            locator = YinYangLocator(self)
+            x,y,z = lonlat2xyz(lon,lat,np.ones(lon.shape)*(self.rcmb+locator.z_coords[-1]))
+            W,valid = trilinear_operator(locator,x,y,z)
+            cols = W.indices//Nz
+            for name in names:
+                data = np.asarray(getattr(self,name)).reshape((NxNy,Nz))
+                vprof[name] = np.add.reduceat(W.data[:,None]*data[cols,:],W.indptr[:-1],axis=0) \
+                              if W.nnz > 0 else np.zeros((lon.shape[0],Nz))
+                vprof[name][~valid,:] = np.nan
+            coordinates[:,:,0] = lon[:,None]
+            coordinates[:,:,1] = lat[:,None]
+            coordinates[:,:,2] = depths[None,:]
+        if isinstance(fields,str):
+            return vprof[fields],coordinates
+        return vprof,coordinates
+
+
     def get_vprofile(self,field='v',lon=None,lat=None,x=None,y=None,z=None,phi=None,theta=None):
         """ Extract a vertical profile in the loaded data according to the coordinates
         of the intersection between the profile and shallowest layers (e.g the surface).
@@ -899,6 +1099,7 @@ class StagYinYangGeometry(MainStagObject):
         (theta,phi,[r is imposed to the shallowest loaded layer]) or (x,y,z).
         Note. The returned profile is not interpolated. This function will search the
         nearest point on the loaded grid for the profile.
+        For batches of profiles and interpolated profiles, see get_vprofiles().
         
         N.B. All the arguments are optional. However, is you set a longitude, a latitude
             is expected and vice versa. The same for x where y and z are expected or phi
@@ -963,7 +1164,6 @@ class StagYinYangGeometry(MainStagObject):
             TPBaseComplete = True
         else:
             TPBaseComplete = False
-        print(TPBase, TPBaseComplete)
         if lon is None and lat is None and x is None and y is None and z is None and not TPBaseComplete:
             raise StagBaseError('Uncomplete theta,phi base detected: Please, set both theta and phi (in radians)')
         if lon is None and lat is None and x is None and y is None and z is None and theta is None and phi is None:
@@ -975,10 +1175,7 @@ class StagYinYangGeometry(MainStagObject):
             self.im('      - Latitude  = '+str(lat)+' deg')
             LONg = self.phi.reshape((NxNy,Nz))*180/np.pi
             LATg = -(self.theta.reshape((NxNy,Nz))*180/np.pi-90)
-            long = LONg[:,-1]
-            latg = LATg[:,-1]
-            dist = np.sqrt((long-lon)**2+(latg-lat)**2)
-            ids = np.where(dist==np.amin(dist))[0][0]
+            ids = self._nearest_columns(lon,lat)[0]
             self.im('      - Nearest surface point index = '+str(ids))
             coordinates = np.zeros((Nz,3))
             coordinates[:,0] = LONg[ids,:]
@@ -1010,10 +1207,7 @@ class StagYinYangGeometry(MainStagObject):
             self.im('      - phi   = '+str(phi)+' rad')
             THETAg = self.theta.reshape((NxNy,Nz))
             PHIg   = self.phi.reshape((NxNy,Nz))
-            thetag = THETAg[:,-1]
-            phig   = PHIg[:,-1]
-            dist = np.sqrt((thetag-theta)**2+(phig-phi)**2)
-            ids = np.where(dist==np.amin(dist))[0][0]
+            ids = self._nearest_columns(phi*180/np.pi,90-theta*180/np.pi)[0]
             self.im('      - Nearest surface point index = '+str(ids))
             coordinates = np.zeros((Nz,3))
             coordinates[:,0] = self.r.reshape((NxNy,Nz))[ids,:]
@@ -1060,52 +1254,73 @@ class StagYinYangGeometry(MainStagObject):
         return vprof,coordinates
 
     
-    def set_pole_projection(self,rot,verbose=True):
+    def get_euler_pole(self,layer=-1,masks=None,area_weighted=True):
+        """
+        Least-squares best-fit rotation vector (Euler pole) of the velocity
+        field on a given layer (by default, the surface). With no mask, it
+        is the net rotation of the layer.
+        <i> : layer = int, index of the layer in self.slayers (default -1 = the
+                      shallowest loaded layer)
+              masks = None, np.ndarray of bool, shape (nmask,Npts_layer) or
+                      np.ndarray of int, shape (Npts_layer), with the plate
+                      index of each point of the layer (ordered as the points
+                      of the layer in self.x, i.e. Yin then Yang).
+                      See stagComputeMod.euler_pole_inversion
+              area_weighted = bool, if True, weights each point by the area
+                      of its cell in its own (Yin or Yang) grid, else uniform
+                      weights
+        <o> : w = np.ndarray, shape (3) or (nmask,3), (wx,wy,wz) in the unit of
+                  the velocities divided by the unit of the coordinates.
+                  Can directly be given to self.set_pole_projection
+        """
+        self.im('Least-squares Euler pole inversion')
+        if self.fieldType != 'Velocity':
+            raise fieldTypeError('Velocity')
+        lay = np.concatenate((self.layers,self.layers))
+        ids = np.where(lay == self.slayers[layer])[0]
+        self.im('  -> Layer '+str(int(self.slayers[layer]))+': '+str(ids.size)+' points')
+        x,y,z = [np.asarray(c,dtype=np.float64).flatten()[ids] for c in (self.x,self.y,self.z)]
+        vx,vy,vz = [np.asarray(c,dtype=np.float64).flatten()[ids] for c in (self.vx,self.vy,self.vz)]
+        weights = None
+        if area_weighted:
+            # the cell area is proportional to the cosine of the latitude in the
+            # local frame of each grid: z for Yin and y for Yang (Y = z2)
+            nyin = len(self.x1)
+            zloc = np.where(ids < nyin, z, y)
+            weights = np.sqrt(np.maximum(1-zloc**2/(x**2+y**2+z**2),0))
+        w = euler_pole_inversion(x,y,z,vx,vy,vz,weights=weights,masks=masks)
+        self.im('  -> Done')
+        return w
+    
+    
+    def set_pole_projection(self,rot=None,verbose=True):
         """
         Substract the rotation 'rot' defined by (wx,wy,wz) to the
-        entire velocity field, layer by layer.
+        entire velocity field, in a single vectorized operation on all
+        the points.
+        <i> : rot = list/tuple/np.ndarray, (wx,wy,wz) rotation vector. If None,
+                    removes the net rotation of the surface computed with
+                    self.get_euler_pole()
+              verbose = bool, kept for compatibility (the messages follow self.verbose)
         """
         self.im('Substract a rotation to the whole mantle velocity field')
         if self.fieldType != 'Velocity':
             raise fieldTypeError('Velocity')
         else:
+            if rot is None:
+                rot = self.get_euler_pole()
             wx,wy,wz = rot
-            Nz = self.nz
-            NxNy = int(self.x.shape[0]/Nz)
-            # --- input data
-            x = self.x.reshape((NxNy,Nz))
-            y = self.y.reshape((NxNy,Nz))
-            z = self.z.reshape((NxNy,Nz))
-            vx = self.vx.reshape((NxNy,Nz))
-            vy = self.vy.reshape((NxNy,Nz))
-            vz = self.vz.reshape((NxNy,Nz))
-            # --- output data
-            vxo = np.zeros(x.shape)
-            vyo = np.zeros(x.shape)
-            vzo = np.zeros(x.shape)
-            vphio   = np.zeros(x.shape)
-            vthetao = np.zeros(x.shape)
-            vro   = np.zeros(x.shape)
-            # --- iteration on all layers
-            self.im('  -> Iterative computation on the %s layers'%str(self.nz))
-            for i in range(Nz):
-                if verbose:
-                    print('Works on the layer: '+str(i+1)+'/'+str(Nz))
-                xi = x[:,i]
-                yi = y[:,i]
-                zi = z[:,i]
-                vxi = vx[:,i]
-                vyi = vy[:,i]
-                vzi = vz[:,i]
-                # 
-                vxo[:,i], vyo[:,i], vzo[:,i], vphio[:,i], vthetao[:,i], vro[:,i] = velocity_pole_projecton(xi,yi,zi,vxi,vyi,vzi,wx,wy,wz)
+            x,y,z = [np.asarray(c,dtype=np.float64).flatten() for c in (self.x,self.y,self.z)]
+            vx,vy,vz = [np.asarray(c,dtype=np.float64).flatten() for c in (self.vx,self.vy,self.vz)]
+            self.im('  -> Vectorized computation on the %s points'%str(x.size))
+            vxo,vyo,vzo,vphio,vthetao,vro = velocity_pole_projecton(x,y,z,vx,vy,vz,wx,wy,wz)
             # --- rewrite the current class instance fields
-            self.vx = vxo.reshape(NxNy*Nz)
-            self.vy = vyo.reshape(NxNy*Nz)
-            self.vz = vzo.reshape(NxNy*Nz)
-            self.vphi   = vphio.reshape(NxNy*Nz)
-            self.vtheta = vthetao.reshape(NxNy*Nz)
-            self.vr     = vro.reshape(NxNy*Nz)
+            self.vx = vxo
+            self.vy = vyo
+            self.vz = vzo
+            self.vphi   = vphio
+            self.vtheta = vthetao
+            self.vr     = vro
             self.splitFields()
             self.im('Velocity reprojection: Done')
     
@@ -1414,6 +1629,8 @@ class MainSliceData:
         self.nx  = 0        #Current number of point in the x direction (after resampling)
         self.ny  = 0        #Current number of point in the y direction (after resampling)
         self.nz  = 0        #Current number of point in the z direction (after resampling)
+        self.x_coords = []  #x coordinates of the grid of the sliced stagData (after resampling)
+        self.y_coords = []  #y coordinates of the grid of the sliced stagData (after resampling)
         # Slice parameters:
         self.axis  = None   #Axis of the slice
         self.layer = None   #Layer index of the slice
@@ -1450,7 +1667,134 @@ class MainSliceData:
         self.nx  = stagData.nx
         self.ny  = stagData.ny
         self.nz  = stagData.nz
-        
+        self.x_coords = stagData.x_coords
+        self.y_coords = stagData.y_coords
+
+
+    def planeSlicing(self,stagData,normal=[1,0,0],origin=None,resolution=None,interp_method='linear'):
+        """
+        Extracts a slice of a 3D stagData object along an arbitrary plane and
+        interpolates it on a regular grid of this plane. The extent of the slice is
+        computed analytically (intersection between the plane and the box for cart3D
+        geometries, the plane and the outer sphere for spherical geometries) and the
+        fields are interpolated with vectorized weights on the cells of the native
+        rectilinear grid (see pypStag.stagLocator), without any triangulation.
+        The base of the plane is the one used by the annulus slicing:
+            self.normalu, self.normalv in the plane and self.normalw normal to it.
+        <i> : stagData = stagData object (geometry 'cart3D' or 'spherical')
+              normal   = list/array, normal to the slicing plane (nx,ny,nz)
+              origin   = None or list/array, a point of the plane (cartesian coordinates).
+                         If None, takes the center of the box (cart3D) or of the sphere (spherical)
+              resolution = None or [nu,nv], number of points of the new grid along normalu
+                         and normalv. If None, takes [stagData.nx,stagData.ny]
+              interp_method = str, 'linear' for a trilinear interpolation or 'nearest'
+        <o> : Fills self.x and self.y (coordinates in the plane, matrices (nv,nu)), self.z (zeros)
+              and the fields (NaN outside the grid). The cartesian coordinates of the points
+              are stored in self.xp, self.yp, self.zp. The vectorial components are projected
+              on the base of the plane (vx along normalu, -vy along normalv, vz along normalw).
+        """
+        from .stagLocator import get_locator, trilinear_operator
+        if stagData.geometry not in ('cart3D','spherical'):
+            raise InputGridGeometryError(stagData.geometry)
+        if interp_method not in ('linear','nearest'):
+            raise StagComputationalError("Unknown interpolation method: '"+str(interp_method)+"', must be in ('linear','nearest')")
+        self.im('Extraction of a slice along an arbitrary plan')
+        self.im('   Normal to the slicing plan: '+str(normal[0])+','+str(normal[1])+','+str(normal[2]))
+        small = 1e-10           # to avoid to divide by 0
+        a = normal[0] + small
+        b = normal[1] + small
+        c = normal[2] + small
+        self.normalu = np.array([1,-a/b,0])
+        self.normalv = np.array([a/b,1,-(a**2+b**2)/(c*b)])
+        self.normalw = np.array([a,b,c])
+        u = self.normalu/np.linalg.norm(self.normalu)
+        v = self.normalv/np.linalg.norm(self.normalv)
+        w = self.normalw/np.linalg.norm(self.normalw)
+        locator = get_locator(stagData)
+        # --- analytic extent of the slice in the plane
+        if stagData.geometry == 'cart3D':
+            lo = np.array([locator.x_coords[0],locator.y_coords[0],locator.z_coords[0]])
+            hi = np.array([locator.x_coords[-1],locator.y_coords[-1],locator.z_coords[-1]])
+            if origin is None:
+                origin = (lo+hi)/2
+            origin  = np.asarray(origin,dtype=np.float64)
+            box = np.array([[i,j,k] for i in (0,1) for j in (0,1) for k in (0,1)])
+            box = lo+box*(hi-lo)
+            edges = [(p0,p1) for p0 in range(8) for p1 in range(p0+1,8) if np.sum(np.abs(box[p0]-box[p1]) > 0) == 1]
+            d = np.dot(box-origin,w)
+            inter = []
+            for p0,p1 in edges:
+                if d[p0]*d[p1] <= 0 and d[p0] != d[p1]:
+                    inter.append(box[p0]+d[p0]/(d[p0]-d[p1])*(box[p1]-box[p0]))
+            inter = np.array(inter).reshape(-1,3)
+            pu = np.dot(inter-origin,u)
+            pv = np.dot(inter-origin,v)
+        else:
+            if origin is None:
+                origin = np.zeros(3)
+            origin = np.asarray(origin,dtype=np.float64)
+            Rout = locator.rcmb+locator.z_coords[-1]
+            dist = np.dot(-origin,w)
+            rho2 = Rout**2-dist**2
+            center = -origin-dist*w
+            rho = np.sqrt(rho2) if rho2 > 0 else 0
+            pu = np.dot(center,u)+np.array([-rho,rho])
+            pv = np.dot(center,v)+np.array([-rho,rho])
+        if len(pu) == 0 or np.amax(pu)-np.amin(pu) <= 0 or np.amax(pv)-np.amin(pv) <= 0:
+            self.im('******************************')
+            self.im('*** WARNING ***')
+            self.im('** -> No points crossing the slicing plan:')
+            self.im('**    Maybe you have to reconsider the input normal vector')
+            self.im('******************************')
+            pu = np.zeros(2); pv = np.zeros(2)
+        if resolution is None:
+            resolution = [stagData.nx,stagData.ny]
+        # --- new grid
+        self.im('   - build a new cart2D geometry')
+        xnew = np.linspace(np.amin(pu),np.amax(pu),resolution[0])
+        ynew = np.linspace(np.amin(pv),np.amax(pv),resolution[1])
+        xnew,ynew = np.meshgrid(xnew,ynew)
+        self.xp = origin[0]+xnew*u[0]+ynew*v[0]
+        self.yp = origin[1]+xnew*u[1]+ynew*v[1]
+        self.zp = origin[2]+xnew*u[2]+ynew*v[2]
+        xp,yp,zp = self.xp.flatten(),self.yp.flatten(),self.zp.flatten()
+        # --- interpolation
+        self.im('   - interpolation on the grid ('+interp_method+')')
+        self.im('     -> Number of new points:  '+str(xp.shape[0]))
+        if interp_method == 'nearest':
+            from scipy.sparse import csr_matrix
+            gind = locator.nearest(xp,yp,zp)
+            W = csr_matrix((np.ones(gind.shape[0]),gind,np.arange(gind.shape[0]+1)),shape=(gind.shape[0],locator.nnodes))
+            valid = locator.inside(xp,yp,zp)
+        else:
+            W,valid = trilinear_operator(locator,xp,yp,zp)
+        if stagData.geometry == 'cart3D':
+            e3 = zp
+        else:
+            e3 = np.sqrt(xp**2+yp**2+zp**2)-locator.rcmb
+        valid = valid*(e3 >= locator.z_coords[0])*(e3 <= locator.z_coords[-1])
+        def gather(field):
+            out = W.dot(np.asarray(field,dtype=np.float64).flatten())
+            out[~valid] = np.nan
+            return out.reshape(xnew.shape)
+        self.v = gather(stagData.v)
+        if stagData.fieldNature == 'Vectorial':
+            vx = gather(stagData.vx)
+            vy = gather(stagData.vy)
+            vz = gather(stagData.vz)
+            self.P  = gather(stagData.P)
+            self.vx = vx*u[0]+vy*u[1]+vz*u[2]
+            self.vy = -(vx*v[0]+vy*v[1]+vz*v[2]) # minus because, plot with ax.invert_yaxis()
+            self.vz = vx*w[0]+vy*w[1]+vz*w[2]
+            if stagData.geometry == 'spherical':
+                self.vr     = gather(stagData.vr)
+                self.vtheta = gather(stagData.vtheta)
+                self.vphi   = gather(stagData.vphi)
+        self.x = xnew
+        self.y = ynew
+        self.z = xnew.copy()*0
+        self.im('   - Points outside the grid: '+str(np.count_nonzero(~valid)))
+
 
 
 
@@ -1464,6 +1808,7 @@ class YinYangSliceData(MainSliceData):
         super().__init__()  # inherit all the methods and properties from MainSliceData
         self.geometry = 'yy'
         self.normal = None
+        self.interpolator = None #stagInterpolator.Interpolator used for the annulus slicing
         # ----- Yin Yang geometry ----- #
         self.r1 = []        #Matrix of the radius of points for Yin grid
         self.r2 = []        #Matrix of the radius of points for Yang grid
@@ -1580,7 +1925,7 @@ class YinYangSliceData(MainSliceData):
         self.im('Stacking done successfully!')
 
 
-    def slicing(self,stagData,axis=0,normal=[1,0,0],layer=-1,interp_method='nearest'):
+    def slicing(self,stagData,axis=0,normal=[1,0,0],layer=-1,interp_method='nearest',cache_dir=None):
         """
         Extract an annulus-slice or a depth-slice in a stagData.StagYinYangGeometry object.
         The annulus-slice is defined according to a normal vector, perpendicular to the slicing plan.
@@ -1605,6 +1950,11 @@ class YinYangSliceData(MainSliceData):
                          This definition is consistent with the normal of the slicing plan in the Paraview software!
                          normal = (nx,ny,nz)
                          Default: normal = (1,0,0)
+              interp_method = str, (only if axis == 0), method used for the interpolation on the
+                         annulus in ('nearest','linear'). Default: interp_method = 'nearest'
+              cache_dir = None or str, (only if axis == 0), if not None, directory where the
+                         interpolation weights on the annulus are saved and searched, to reuse
+                         them between sessions (see stagInterpolator.cached_interpolator)
         """
         self.im('Begin the slice extraction')
         #check the geometry:
@@ -1704,23 +2054,22 @@ class YinYangSliceData(MainSliceData):
 
             # --- interpolation
             self.im('   - interpolation on the annulus')
-            from scipy.interpolate import griddata
+            from .stagInterpolator import Interpolator, cached_interpolator, grid_hash
             from time import time
-            points      = np.zeros((self.x.shape[0],3))
-            points[:,0] = self.x
-            points[:,1] = self.y
-            points[:,2] = self.z
+            points = np.stack((self.x,self.y,self.z),axis=1)
             self.im('     -> Number of data points: '+str(self.x.shape[0]))
             self.im('     -> Number of new points:  '+str(xan.shape[0]*xan.shape[1]))
             time0 = time()
-            self.v = griddata(points, self.v, (xan, yan, zan), method=interp_method)
+            key = 'annulus_'+grid_hash(points,xan,yan)+'_'+interp_method
+            self.interpolator = cached_interpolator(lambda: Interpolator(points,(xan,yan,zan),method=interp_method,verbose=self.verbose),\
+                                                    key,cache_dir=cache_dir,verbose=self.verbose)
             if ftype == 'Vectorial':
-                self.vx = griddata(points, self.vx, (xan, yan, zan), method=interp_method)
-                self.vy = griddata(points, self.vy, (xan, yan, zan), method=interp_method)
-                self.vz = griddata(points, self.vz, (xan, yan, zan), method=interp_method)
-                self.vtheta = griddata(points, self.vtheta, (xan, yan, zan), method=interp_method)
-                self.vphi = griddata(points, self.vphi, (xan, yan, zan), method=interp_method)
-                self.vr = griddata(points, self.vr, (xan, yan, zan), method=interp_method)
+                names  = ['v','vx','vy','vz','vtheta','vphi','vr']
+                values = self.interpolator(np.stack([getattr(self,name) for name in names],axis=1))
+                for i in range(len(names)):
+                    setattr(self,names[i],values[...,i])
+            else:
+                self.v = self.interpolator(self.v)
             time1 = time()
             self.x = xan ; self.phi   = lon - np.pi
             self.y = yan ; self.theta = lat
@@ -1851,24 +2200,23 @@ class YinYangSliceData(MainSliceData):
         # --- Description of the new grid: the two axis
         lon = np.linspace(0,2*np.pi,opti_peri)
         R   = np.array(stagData.z_coords)+stagData.rcmb
-        # --- meshed grid
-        lon,R = np.meshgrid(lon,R)
-        lat   = lon.copy()*0
-        # --- Annulus grid: conversion to x,y (z = 0 here)
-        self.im('   - Compute the annulus')
-        xan = np.multiply(np.multiply(R,np.cos(lat)),np.cos(lon))
-        yan = np.multiply(np.multiply(R,np.cos(lat)),np.sin(lon))
-        zan = np.multiply(R,np.sin(lat))
-        # --- Find the nearest point
-        dist = np.sqrt((xan.flatten()-x)**2+(yan.flatten()-y)**2+(zan.flatten()-z)**2)
-        gind = np.where(dist == np.amin(dist))[0][0]
+        # --- Find the nearest point: the annulus grid is regular in lon
+        #     and sorted in R, so that the search is analytic
+        lonp = np.arctan2(y,x)%(2*np.pi)
+        ilon = int(np.rint(lonp/(lon[1]-lon[0])))%(opti_peri-1)
+        iR   = int(np.argmin(np.abs(R-np.sqrt(x**2+y**2))))
+        lon,R = lon[ilon],R[iR]
+        lat   = 0
+        xan = R*np.cos(lat)*np.cos(lon)
+        yan = R*np.cos(lat)*np.sin(lon)
+        zan = R*np.sin(lat)
         self.im('Point found!')
-        xf   = xan.flatten()[gind]
-        yf   = yan.flatten()[gind]
-        zf   = zan.flatten()[gind]
-        lonf = lon.flatten()[gind] - np.pi
-        latf = lat.flatten()[gind]
-        rf   = R.flatten()[gind]
+        xf   = xan
+        yf   = yan
+        zf   = zan
+        lonf = lon - np.pi
+        latf = lat
+        rf   = R
         self.im('   x   = '+str(xf))
         self.im('   y   = '+str(yf))
         self.im('   z   = '+str(zf))
@@ -1920,7 +2268,8 @@ class CartesianSliceData(MainSliceData):
         <i> : stagData = stagData.StagCartesianGeometry
               axis = int, slice direction (defaut axis=1) according to:
                     axis = 0    -> slice according to a plan          --| Spherical slicing
-                                   perpendicular to the given normal
+                                   perpendicular to the given normal, through
+                                   the center of the box (see planeSlicing())
                     axis = 1 or axis = 'x'  -> slice on x     (x=layer,y=:,z=:)  --|
                     axis = 2 or axis = 'y'  -> slice on y     (x=:,y=layer,z=:)    |-  Cartesian slicing
                     axis = 3 or axis = 'z'  -> slice on z     (x=:,y=:,z=layer)  --|
@@ -1995,109 +2344,10 @@ class CartesianSliceData(MainSliceData):
                     self.P = stagData.P[:,:,layer]
             elif axis == 0:
                 self.im('Extraction of a slice along a plan defined by its normal (i.e. axis=0)')
-                self.im('   Normal to the slicing plan: '+str(normal[0])+','+str(normal[1])+','+str(normal[2]))
-                small = 1e-10           # to avoid to divide by 0
-                normal[0] += small      #
-                normal[1] += small      #
-                normal[2] += small      #
-                a = normal[0]
-                b = normal[1]
-                c = normal[2]
-                # Compute the thickness of the slice:
-                R = np.sqrt((4*np.pi*2.19**2)/(self.nx*self.ny))
-                # Plan equation:
-                self.im('   Search on the plan')
-                sdx = stagData.x.flatten()
-                sdy = stagData.y.flatten()
-                sdz = stagData.z.flatten()
-                # center the grid on 0,0,0
-                sdx = sdx - (np.amax(sdx)-np.amin(sdx))/2
-                sdy = sdy - (np.amax(sdy)-np.amin(sdy))/2
-                sdz = sdz - (np.amax(sdz)-np.amin(sdz))/2
-                #
-                gind = np.where(abs(a*sdx+b*sdy+c*sdz) <= R)[0]
-                if len(gind) == 0:
-                    self.im('******************************')
-                    self.im('*** WARNING ***')
-                    self.im('** -> No points crossing the slicing plan:')
-                    self.im('**    Maybe you have to reconsider the input normal vector')
-                    self.im('******************************')
-                # Cut YY according to plan equation
-                x,y,z = sdx[gind],sdy[gind],sdz[gind]
-                #self.xc,self.yc,self.zc = stagData.xc.flatten()[gind],stagData.yc.flatten()[gind],stagData.zc.flatten()[gind]
-                if ftype == 'Scalar':
-                    self.v = stagData.v.flatten()[gind]
-                    # empty
-                    self.vx,self.vy, self.vz = np.array([]),np.array([]),np.array([])
-                    self.P = np.array([])
-                else:
-                    self.v = stagData.v.flatten()[gind] # norm
-                    self.vx,self.vy,self.vz = stagData.vx.flatten()[gind],stagData.vy.flatten()[gind],stagData.vz.flatten()[gind]
-                    self.P    = stagData.P.flatten()[gind]
-                # Compute the normal vectors to the slicing plan:
-                self.normalu = np.array([1,-a/b,0])
-                self.normalv = np.array([a/b,1,-(a**2+b**2)/(c*b)])
-                self.normalw = np.array([a,b,c])
-                # Projection
-                self.im('   Projection on the plan')
-                self.x = np.dot(np.array([x,y,z]).T,self.normalu)/np.linalg.norm(self.normalu)
-                self.y = np.dot(np.array([x,y,z]).T,self.normalv)/np.linalg.norm(self.normalv)
-                self.z = np.dot(np.array([x,y,z]).T,self.normalw)/np.linalg.norm(self.normalw)
-                # Interpolate the slice on a new plan
-                # ----------------------------------------------
-                # --- Search the ideal number of points for the new grid
-                self.im('   - build a new cart2D geometry')
-
-                # --- Description of the new grid: the two axis
-                xnew = np.linspace(np.amin(self.x),np.amax(self.x),stagData.nx)
-                ynew = np.linspace(np.amin(self.y),np.amax(self.y),stagData.ny)
-
-                # --- meshed grid
-                xnew,ynew = np.meshgrid(xnew,ynew)
-                znew      = xnew.copy()*0
-
-                # --- interpolation
-                self.im('   - interpolation on the grid')
-                from scipy.interpolate import griddata
                 from time import time
-                points      = np.zeros((self.x.shape[0],3))
-                points[:,0] = self.x
-                points[:,1] = self.y
-                points[:,2] = self.z
-                self.im('     -> Number of data points: '+str(self.x.shape[0]))
-                self.im('     -> Number of new points:  '+str(xnew.shape[0]*xnew.shape[1]))
                 time0 = time()
-                self.v = griddata(points, self.v, (xnew, ynew, znew), method=interp_method)
-                if ftype == 'Vectorial':
-                    # projection
-                    self.vx   = np.dot(np.array([self.vx,self.vy,self.vz]).T,self.normalu)/np.linalg.norm(self.normalu)
-                    self.vy   = -np.dot(np.array([self.vx,self.vy,self.vz]).T,self.normalv)/np.linalg.norm(self.normalv) # minus because, plot with ax.invert_yaxis()
-                    self.vz   = np.dot(np.array([self.vx,self.vy,self.vz]).T,self.normalv)/np.linalg.norm(self.normalv)
-                    # interpolation
-                    self.vx = griddata(points, self.vx, (xnew, ynew, znew), method=interp_method)
-                    self.vy = griddata(points, self.vy, (xnew, ynew, znew), method=interp_method)
-                    self.vz = griddata(points, self.vz, (xnew, ynew, znew), method=interp_method)
+                self.planeSlicing(stagData,normal=normal,interp_method=interp_method)
                 time1 = time()
-                # Mask to remove the very distant points
-                self.im('   - remove ghost points')
-                distmin = np.sqrt((xnew[0][0]-xnew[1][1])**2+(ynew[0][0]-ynew[1][1])**2)
-                mask    = np.zeros(self.v.shape,dtype=bool)
-                for i in range(len(xnew)):
-                    for j in range(len(xnew[i])):
-                        dist = np.sqrt((xnew[i][j]-self.x)**2+(ynew[i][j]-self.y)**2)
-                        # dist min
-                        if np.amin(dist) >= distmin:
-                            mask[i][j] = True
-                # apply the mask:
-                self.v[mask] = np.nan
-                if ftype == 'Vectorial':
-                    self.vx[mask] = np.nan
-                    self.vy[mask] = np.nan
-                    self.vz[mask] = np.nan
-                self.x = xnew
-                self.y = ynew
-                self.z = znew
-                #exit
                 self.im('Slicing done successfully!')
                 self.im('    -> Time for the interpolation: '+str(time1-time0))
                 # ----------------------------------------------
@@ -2253,7 +2503,7 @@ class SphericalSliceData(MainSliceData):
 
 
 
-    def slicing(self,stagData,axis=1,normal=[1,0,0],layer=-1):
+    def slicing(self,stagData,axis=1,normal=[1,0,0],layer=-1,origin=None,interp_method='linear'):
         """
         Extract an annulus-slice or a depth-slice in a stagData.StagSphericalGeometry object.
         The annulus-slice is defined according to a normal vector, perpendicular to the slicing plan.
@@ -2270,14 +2520,20 @@ class SphericalSliceData(MainSliceData):
                     axis = 1 or axis = 'x'  -> slice on x     (x=layer,y=:,z=:)  --|
                     axis = 2 or axis = 'y'  -> slice on y     (x=:,y=layer,z=:)    |-  Cartesian slicing
                     axis = 3 or axis = 'z'  -> slice on z     (x=:,y=:,z=layer)  --|
+                    axis = 4 or axis = 'plane' -> slice according to an arbitrary plan perpendicular
+                                   to the given normal and containing the point 'origin',
+                                   interpolated on a regular grid (see planeSlicing())
 
-              normal   = list/array, (only if axis == 0), vector of coordinates corresponding
+              normal   = list/array, (only if axis == 0 or 4), vector of coordinates corresponding
                          to the normal to the plan containing the annlus (partial).
                          normal = (nx,ny,nz)
                          This definition is consistent with the normal of the slicing plan in the Paraview software!
                          Default: normal = [1,0,0]
-              layer    = int, (only if axis >= 1), index of the stagData layer that will be extracted in
+              layer    = int, (only if axis in [1,2,3]), index of the stagData layer that will be extracted in
                          the new SliceData object.
+              origin   = None or list/array, (only if axis == 4), point of the plan.
+                         If None, the plan contains the center of the sphere.
+              interp_method = str, (only if axis == 4), 'linear' or 'nearest'
         """
         self.im('Begin the slice extraction')
         self.axis  = axis
@@ -2422,6 +2678,14 @@ class SphericalSliceData(MainSliceData):
                 self.vtheta = stagData.vtheta[:,:,layer]
                 self.vphi   = stagData.vphi[:,:,layer]
                 self.vr     = stagData.vr[:,:,layer]
+        elif axis == 4 or axis == 'plane':
+            if self.geometry == 'annulus':
+                raise IncoherentSliceAxisError(axis)
+            self.planeSlicing(stagData,normal=normal,origin=origin,interp_method=interp_method)
+            self.xc,self.yc,self.zc = self.xp,self.yp,self.zp
+            self.r     = np.sqrt(self.xp**2+self.yp**2+self.zp**2)
+            self.theta = np.arccos(np.clip(self.zp/np.where(self.r == 0,1,self.r),-1,1))
+            self.phi   = np.arctan2(self.yp,self.xp)
         else:
             raise SliceAxisError(axis)
         # -------
@@ -2540,6 +2804,7 @@ class InterpolatedSliceData(MainSliceData):
         self.ntheta       = None          # Defined during the interpolation: number of points in the theta direction
         self.nz           = None          # Defined during the interpolation: number of points in the z (r) direction
         self.interpMethod = None          # Defined during the interpolation: method used for the interpolation
+        self.interpolator = None          # Defined during the interpolation: stagInterpolator.Interpolator object (reusable weights)
 
     
     def convert_to_stagData(self):
@@ -2580,6 +2845,190 @@ class InterpolatedSliceData(MainSliceData):
 
 
 
+class CrossSectionData(MainSliceData):
+    """
+    Defines the structure of the CrossSectionData object derived from MainSliceData type.
+    This object contains a vertical cross section of a 3D stagData object along a
+    path (great circle between two points or polyline) interpolated on a regular
+    (distance,depth) grid. The interpolation weights are computed once by the
+    function section() and can be applied to any field and any time step
+    sharing the same grid with the function interpolate().
+    """
+    def __init__(self):
+        super().__init__()  # inherit all the methods and properties from MainSliceData
+        self.pName = 'crossSectionData'
+        self.geometry = None
+        # path
+        self.path_lon = []  #Longitudes of the vertices of the path (in deg), or x for cart3D
+        self.path_lat = []  #Latitudes of the vertices of the path (in deg), or y for cart3D
+        self.lon = []       #Longitude (in deg) of the points of the path, or x for cart3D
+        self.lat = []       #Latitude (in deg) of the points of the path, or y for cart3D
+        self.distance    = [] #Distance along the path (in deg for spherical geometries)
+        self.distance_km = [] #Distance along the path (in km at the surface, for spherical geometries)
+        self.depth = []     #Depths of the section (in km, or z coordinate for cart3D)
+        # section grid (shape (ndist,ndepth))
+        self.x = []         #Matrix of X coordinates meshed
+        self.y = []         #Matrix of Y coordinates meshed
+        self.z = []         #Matrix of Z coordinates meshed
+        self.v = []         #Matrix of scalar field (or norm of velocity)
+        self.vx = []        #Matrix of x-component of the velocity field
+        self.vy = []        #Matrix of y-component of the velocity field
+        self.vz = []        #Matrix of z-component of the velocity field
+        self.vtheta = []    #Matrix of theta component of the velocity field
+        self.vphi   = []    #Matrix of phi component of the velocity field
+        self.vr     = []    #Matrix of radial component of the velocity field
+        self.P  = []        #Matrix of Pressure field
+        # interpolation
+        self.W = None       #Sparse interpolation operator (see pypStag.stagLocator.trilinear_operator)
+        self.valid = None   #Mask of the section points inside the grid
+        self.fill_value = np.nan
+
+
+    def section(self,stagData,lon,lat,depth_range=None,ndist=200,ndepth=None,fill_value=np.nan):
+        """
+        Builds the (distance,depth) grid of the cross section and the corresponding
+        interpolation weights on the grid of stagData, then interpolates its fields.
+        <i> : stagData = stagData object (geometry 'yy', 'spherical' or 'cart3D')
+              lon,lat = list/np.ndarray, longitudes and latitudes (in *DEGREES*) of the
+                        vertices of the path. With two vertices, the section follows the
+                        great circle between them. With more vertices, each segment of the
+                        polyline follows a great circle.
+                        For cart3D geometries, lon and lat are the x and y coordinates of the
+                        vertices and the segments are straight lines.
+              depth_range = None or [dmin,dmax], depth range of the section in km (in z
+                        coordinates for cart3D). If None, takes the extent of the loaded layers.
+              ndist  = int, number of points along the path (Default: 200)
+              ndepth = None or int, number of points along depth. If None, takes stagData.nz
+              fill_value = float, value given to the points outside the grid
+        """
+        from .stagLocator import get_locator, trilinear_operator, lonlat2xyz
+        self.im('Build a cross section along a path')
+        if stagData.geometry not in ('yy','spherical','cart3D'):
+            raise InputGridGeometryError(stagData.geometry)
+        self.sliceInheritance(stagData)
+        self.geometry   = stagData.geometry
+        self.fill_value = fill_value
+        plon = np.asarray(lon,dtype=np.float64).flatten()
+        plat = np.asarray(lat,dtype=np.float64).flatten()
+        if plon.shape != plat.shape or plon.shape[0] < 2:
+            raise StagBaseError('The path must be defined by at least two (lon,lat) vertices')
+        self.path_lon = plon
+        self.path_lat = plat
+        if ndepth is None:
+            ndepth = stagData.nz
+        # --- vertical axis
+        if self.geometry == 'cart3D':
+            if depth_range is None:
+                depth_range = [np.amin(stagData.z_coords),np.amax(stagData.z_coords)]
+        else:
+            if depth_range is None:
+                depth_range = [np.amin(stagData.depths),np.amax(stagData.depths)]
+        self.depth = np.linspace(depth_range[0],depth_range[1],ndepth)
+        # --- points along the path
+        if self.geometry == 'cart3D':
+            seg = np.sqrt(np.diff(plon)**2+np.diff(plat)**2)
+            cum = np.concatenate(([0],np.cumsum(seg)))
+            self.distance = np.linspace(0,cum[-1],ndist)
+            self.distance_km = []
+            iseg = np.clip(np.searchsorted(cum,self.distance,side='right')-1,0,len(seg)-1)
+            t = (self.distance-cum[iseg])/np.where(seg[iseg] == 0,1,seg[iseg])
+            self.lon = plon[iseg]+t*(plon[iseg+1]-plon[iseg])
+            self.lat = plat[iseg]+t*(plat[iseg+1]-plat[iseg])
+            self.x = np.repeat(self.lon[:,None],ndepth,axis=1)
+            self.y = np.repeat(self.lat[:,None],ndepth,axis=1)
+            self.z = np.repeat(self.depth[None,:],ndist,axis=0)
+        else:
+            vx,vy,vz = lonlat2xyz(plon,plat,np.ones(plon.shape))
+            vert = np.stack((vx,vy,vz),axis=1)
+            cosa = np.clip(np.sum(vert[:-1]*vert[1:],axis=1),-1,1)
+            seg  = np.arccos(cosa)
+            if np.any(np.abs(np.pi-seg) < 1e-8):
+                raise StagBaseError('Undefined great circle between two antipodal vertices: add an intermediate vertex')
+            cum = np.concatenate(([0],np.cumsum(seg)))
+            dist = np.linspace(0,cum[-1],ndist)
+            iseg = np.clip(np.searchsorted(cum,dist,side='right')-1,0,len(seg)-1)
+            # spherical linear interpolation on each great circle arc
+            a  = dist-cum[iseg]
+            sa = np.sin(seg[iseg])
+            sa = np.where(sa == 0,1,sa)
+            w0 = np.where(seg[iseg] == 0,1,np.sin(seg[iseg]-a)/sa)
+            w1 = np.where(seg[iseg] == 0,0,np.sin(a)/sa)
+            pts = w0[:,None]*vert[iseg]+w1[:,None]*vert[iseg+1]
+            pts = pts/np.linalg.norm(pts,axis=1)[:,None]
+            self.lon = np.arctan2(pts[:,1],pts[:,0])*180/np.pi
+            self.lat = np.arcsin(np.clip(pts[:,2],-1,1))*180/np.pi
+            self.distance    = dist*180/np.pi
+            self.distance_km = dist*(stagData.rcmb+1)*2890
+            R = stagData.rcmb+1-self.depth/2890
+            self.x = pts[:,0][:,None]*R[None,:]
+            self.y = pts[:,1][:,None]*R[None,:]
+            self.z = pts[:,2][:,None]*R[None,:]
+        self.im('  -> Section grid: '+str(ndist)+' x '+str(ndepth)+' points')
+        # --- interpolation weights
+        self.im('  -> Computation of the interpolation weights')
+        self.W,self.valid = trilinear_operator(get_locator(stagData),self.x.flatten(),self.y.flatten(),self.z.flatten())
+        self.interpolate(stagData)
+
+
+    def interpolate(self,stagData):
+        """
+        Interpolates the fields of stagData on the cross section using the
+        weights computed by the function section(). stagData can be any
+        time step of the simulation sharing the grid used to build the section.
+        <i> : stagData = stagData object
+        """
+        if self.W is None:
+            raise StagBaseError('No cross section defined: please, run first the function section()')
+        if stagData.geometry != self.geometry or len(np.asarray(stagData.x).flatten()) != self.W.shape[1]:
+            raise StagBaseError('The grid of the input stagData object differs from the one used to build the section')
+        self.im('Interpolation of the fields on the cross section')
+        self.fieldType   = stagData.fieldType
+        self.fieldNature = stagData.fieldNature
+        self.simuAge = stagData.simuAge
+        self.ti_step = stagData.ti_step
+        self.fname   = stagData.fname
+        if self.fieldNature == 'Vectorial':
+            if self.geometry == 'cart3D':
+                names = ['v','vx','vy','vz','P']
+            else:
+                names = ['v','vx','vy','vz','vtheta','vphi','vr','P']
+        else:
+            names = ['v']
+        for name in names:
+            field = self.W.dot(np.asarray(getattr(stagData,name),dtype=np.float64).flatten())
+            field[~self.valid] = self.fill_value
+            setattr(self,name,field.reshape(self.x.shape))
+
+
+
+
+
+def _cloud_map_worker(task):
+    """
+    --- Internal function ---
+    Loads and processes one snapshot of a StagCloudData in a worker process
+    of MainCouldStagData.map() and applies the user function on it.
+    <i> : task = tuple, (position,geometry,gpath,cfname,resampling,beginIndex,
+                 endIndex,coarsening,func,slicing)
+    <o> : (position,simuAge,ti_step,result)
+    """
+    (pos,geometry,gpath,cfname,resampling,beginIndex,endIndex,coarsening,func,slicing) = task
+    drop = StagData(geometry=geometry)
+    drop.verbose = False
+    drop.stagImport(gpath, cfname, resampling=resampling, beginIndex=beginIndex,\
+                    endIndex=endIndex, coarsening=coarsening)
+    drop.stagProcessing()
+    data = drop
+    if slicing is not None:
+        data = SliceData(geometry=geometry)
+        data.verbose = False
+        data.slicing(drop,**slicing)
+    return pos,drop.simuAge,drop.ti_step,func(data)
+
+
+
+
+
 class MainCouldStagData:
     """
     Main class defining the highest level of inheritance
@@ -2607,6 +3056,7 @@ class MainCouldStagData:
         self.fieldType   = 'Undefined'  #Field contained in the current object
         self.fieldNature = 'Undefined'  #Nature of the field: Scalar or Vectorial
         self.resampling = [] #Resampling Parameters
+        self.coarsening = None #Coarsening mode of the resampling
         self.simuAge = []    #Dimensionless age of the simulation
         self.ti_step = []    #Inner step of the stag simualtion state
         # ----- Data description ----- #
@@ -2656,16 +3106,17 @@ class MainCouldStagData:
     
 
     def build(self,gpath,gfname,resampling=[1,1,1],beginIndex=-1, endIndex=-1,verbose=True,\
-              indices=[],ibegin=None,iend=None,istep=1):
+              indices=[],ibegin=None,iend=None,istep=1,coarsening=None):
         """
         Build the Cloud data
-        resampling, beginIndex, endIndex and verbose input parameters correspond to the
-        same one in StagData.stagImport()
+        resampling, coarsening, beginIndex, endIndex and verbose input parameters correspond
+        to the same one in StagData.stagImport()
         """
         # -- Path and file
         self.gpath       = gpath
         self.gfname      = gfname
         self.resampling  = resampling
+        self.coarsening  = coarsening
         # -- Geometry
         self.geometry    = _temp.geometry
         # -- Layers
@@ -2703,13 +3154,89 @@ class MainCouldStagData:
         self.drop = StagData(geometry=self.geometry)
         self.drop.verbose = self.verbose
         self.drop.stagImport(self.gpath, self.cfname, resampling=self.resampling,\
-                             beginIndex=self.beginIndex, endIndex=self.endIndex)
+                             beginIndex=self.beginIndex, endIndex=self.endIndex, coarsening=self.coarsening)
         self.drop.stagProcessing()
         # --- Fill Cloud field
         self.simuAge[self.ci] = self.drop.simuAge
         self.ti_step[self.ci] = self.drop.ti_step
     
 
+    def map(self,func,reduce=None,initial=None,workers=1,ordered=True,slicing=None,maxpending=None):
+        """
+        Applies a function on the drops of all the snapshots of the cloud,
+        spread on a pool of worker processes. Each worker loads and processes
+        its snapshots with the options of the cloud (resampling, layers,
+        coarsening) and only sends back the result of the function, so the
+        results must be small (e.g. a profile, a scalar, a map).
+        e.g. mean temperature of each snapshot on 32 processes:
+        >> def mean_v(drop): return np.mean(drop.v)
+        >> means = cloud.map(mean_v,workers=32)
+        <i> : func = function, func(drop) -> result, applied on each processed drop
+                     (or on its slice, see 'slicing'). With workers > 1, func (and
+                     reduce) must be picklable, i.e. defined at the module level.
+              reduce = None or function, reduce(acc,result) -> acc, folds the results
+                       as they are collected (in the order of self.indices if ordered,
+                       else in the order of arrival). If None, returns the list of the
+                       results in the order of self.indices.
+              initial = initial value of the reduction. If None, the first result
+                        collected is used.
+              workers = int, number of worker processes. If workers == 1, the drops are
+                        computed one by one in the current process.
+              ordered = bool, if True, the results are collected in the order of the
+                        indices, else as soon as a worker ends (faster with a reduce).
+              slicing = None or dict, if not None, func is applied on the slice of the drop
+                        SliceData(geometry).slicing(drop,**slicing), e.g. {'axis':'layer','layer':-1}
+              maxpending = None or int, maximum number of snapshots sent to the pool and not
+                           yet collected, bounding the memory used by the results waiting
+                           to be collected. By default, 2*workers.
+        <o> : the list of the results (reduce == None) or the reduced value
+        Also fills self.simuAge and self.ti_step.
+        """
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        from collections import deque
+        self.im('Map a function on the '+str(self.nt)+' snapshots of the cloud ('+str(workers)+' workers)')
+        tasks = ((pos,self.geometry,self.gpath,self.gfname%self.__intstringer(ind,5),self.resampling,\
+                  self.beginIndex,self.endIndex,self.coarsening,func,slicing) for pos,ind in enumerate(self.indices))
+        results = [None]*self.nt
+        acc = {'value':initial,'empty':initial is None}
+        def collect(out):
+            pos,simuAge,ti_step,res = out
+            self.simuAge[pos] = simuAge
+            self.ti_step[pos] = ti_step
+            if reduce is None:
+                results[pos] = res
+            elif acc['empty']:
+                acc['value'],acc['empty'] = res,False
+            else:
+                acc['value'] = reduce(acc['value'],res)
+            self.im('  - snapshot '+str(self.indices[pos])+' done')
+        if workers <= 1:
+            for task in tasks:
+                collect(_cloud_map_worker(task))
+        else:
+            if maxpending is None:
+                maxpending = 2*workers
+            maxpending = max(maxpending,1)
+            pending = deque()
+            def drain(nmax):
+                """collects the results until less than nmax snapshots are pending"""
+                while len(pending) > nmax:
+                    if ordered:
+                        collect(pending.popleft().result())
+                    else:
+                        done = wait(pending,return_when=FIRST_COMPLETED)[0]
+                        for fut in done:
+                            pending.remove(fut)
+                            collect(fut.result())
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for task in tasks:
+                    pending.append(pool.submit(_cloud_map_worker,task))
+                    drain(maxpending-1)
+                drain(0)
+        self.im('Map done')
+        return results if reduce is None else acc['value']
+    
+
     def reset(self):
         """
         reset the value of self.ci
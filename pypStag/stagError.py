@@ -204,6 +204,13 @@ class StagUnknownLayerError(PypStagError):
             'is absent from the input stagData.slayers list')
 
 
+class StagCoarseningError(PypStagError):
+    """Raised when unknown coarsening mode is asked"""
+    def __init__(self,coarsening):
+        super().__init__("Error! The coarsening mode: '"+str(coarsening)+"'\n"+\
+            "is unknown. Available modes: None, 'mean', 'min', 'max'")
+
+
 class StagComputationalError(PypStagError):
     """ Generic form numerical errors """
     def __init__(self,message):
@@ -14,6 +14,7 @@ from .stagError import GridInterpolationError,StagMapUnknownFieldError,StagMapFi
 
 
 from scipy.interpolate import griddata
+from collections import OrderedDict
 from time import time
 
 
@@ -31,6 +32,546 @@ def im(textMessage,pName,verbose):
     
 
 
+class Interpolator:
+    """
+    Reusable interpolator from a set of scattered source points to a set of
+    target points. The geometric part of the interpolation (KD-tree or Delaunay
+    triangulation, location of the target points and interpolation weights) is
+    computed once when the object is built and stored as a sparse operator, so
+    that any field defined on the source points (or every snapshot of a time
+    series sharing the same grid) is then interpolated with a single sparse
+    product. The results are the same as scipy.interpolate.griddata.
+    """
+    def __init__(self,points,targets,method='nearest',verbose=True):
+        """
+        <i> : points  = np.ndarray, matrix (N,ndim) of the coordinates of the source points
+              targets = np.ndarray or tuple of np.ndarray, coordinates of the target points,
+                        either as a matrix (M,ndim) or as a tuple of ndim arrays of the same
+                        shape (like the xi argument of griddata). The output of the
+                        interpolator will have the shape of these arrays.
+              method  = str, method used for the interpolation. In ('nearest', 'linear', 'cubic').
+                        'cubic' is only available for 2D points.
+              verbose = bool, controls inhibition of the internal message
+        """
+        from scipy.sparse import csr_matrix
+        self.pName   = 'Interpolator'
+        self.verbose = verbose
+        self.method  = method
+        points = np.asarray(points,dtype=np.float64)
+        if points.ndim == 1:
+            points = points.reshape(-1,1)
+        if isinstance(targets,tuple):
+            self.shape = np.shape(targets[0])
+            targets = np.stack([np.asarray(t,dtype=np.float64).flatten() for t in targets],axis=1)
+        else:
+            targets = np.asarray(targets,dtype=np.float64)
+            if targets.ndim == 1:
+                targets = targets.reshape(-1,1)
+            self.shape = (targets.shape[0],)
+        self.npoints  = points.shape[0]
+        self.ntargets = targets.shape[0]
+        self.ndim     = points.shape[1]
+        self.tri = None
+        self.points  = points
+        self.targets = targets
+        im('Build the interpolator ('+method+'): '+str(self.npoints)+' -> '+str(self.ntargets)+' points',self.pName,self.verbose)
+        if method == 'nearest':
+            from scipy.spatial import cKDTree
+            ind = cKDTree(points).query(targets)[1]
+            self.W = csr_matrix((np.ones(self.ntargets),ind,np.arange(self.ntargets+1)),shape=(self.ntargets,self.npoints))
+            self.valid = np.ones(self.ntargets,dtype=bool)
+        elif method == 'linear' or method == 'cubic':
+            from scipy.spatial import Delaunay
+            if method == 'cubic' and self.ndim != 2:
+                raise GridInterpolationError('cubic interpolation in '+str(self.ndim)+'D')
+            self.tri = Delaunay(points)
+            simplex = self.tri.find_simplex(targets)
+            self.valid = simplex >= 0
+            simplex = np.where(self.valid,simplex,0)
+            # barycentric coordinates of the targets in their simplex
+            T = self.tri.transform[simplex]
+            b = np.einsum('ijk,ik->ij',T[:,:self.ndim,:],targets-T[:,self.ndim,:])
+            w = np.concatenate((b,1-b.sum(axis=1,keepdims=True)),axis=1)
+            w[~self.valid] = 0
+            ind = self.tri.simplices[simplex]
+            nv  = self.ndim+1
+            self.W = csr_matrix((w.flatten(),ind.flatten(),np.arange(0,nv*self.ntargets+1,nv)),shape=(self.ntargets,self.npoints))
+        else:
+            raise GridInterpolationError(method)
+
+
+    def __call__(self,values,fill_value=np.nan):
+        """
+        Interpolates a field defined on the source points.
+        <i> : values = np.ndarray, vector (N) of values on the source points, or
+                       matrix (N,k) for k fields/snapshots interpolated at once
+              fill_value = float, value for the target points outside the
+                       convex hull of the source points (methods 'linear' and 'cubic')
+        <o> : np.ndarray of the shape of the targets (+ (k,) if values is 2D)
+        """
+        values = np.asarray(values)
+        if values.shape[0] != self.npoints:
+            raise GridInterpolationError('field of size '+str(values.shape[0])+' for '+str(self.npoints)+' source points')
+        if self.method == 'cubic':
+            from scipy.interpolate import CloughTocher2DInterpolator
+            out = CloughTocher2DInterpolator(self.tri,values,fill_value=fill_value)(self.targets)
+        else:
+            out = self.W.dot(values.astype(np.float64))
+            out[~self.valid] = fill_value
+        return out.reshape(self.shape+values.shape[1:])
+
+
+    def match(self,points,targets,method):
+        """
+        Returns True if the current interpolator can be reused for the given
+        source points, target points and method.
+        """
+        if method != self.method:
+            return False
+        points = np.asarray(points,dtype=np.float64)
+        if points.ndim == 1:
+            points = points.reshape(-1,1)
+        if isinstance(targets,tuple):
+            targets = np.stack([np.asarray(t,dtype=np.float64).flatten() for t in targets],axis=1)
+        else:
+            targets = np.asarray(targets,dtype=np.float64)
+            if targets.ndim == 1:
+                targets = targets.reshape(-1,1)
+        return np.array_equal(points,self.points) and np.array_equal(targets,self.targets)
+
+
+    def save(self,fname):
+        """
+        Saves the precomputed weights of the interpolator on disk, as a
+        compressed numpy archive (.npz) or as a HDF5 file (.h5), according to
+        the extension of fname. The interpolator is then rebuilt without any
+        geometric computation with load_interpolator(fname).
+        <i> : fname = str, path to the output file (extension .npz or .h5)
+        """
+        W = self.W.tocsr()
+        data = {'W_data':W.data,'W_indices':W.indices,'W_indptr':W.indptr,'W_shape':np.array(W.shape),\
+                'valid':self.valid,'shape':np.array(self.shape),'points':self.points,'targets':self.targets}
+        for name in ('target_area','source_area'):
+            if hasattr(self,name):
+                data[name] = getattr(self,name)
+        meta = {'cls':type(self).__name__,'method':self.method}
+        import os, uuid
+        im('Save the interpolation weights in: '+fname,self.pName,self.verbose)
+        # written in a temporary file then moved: the file is never seen half-written
+        # (e.g. by other jobs sharing the same cache directory)
+        tmp = fname+'.'+uuid.uuid4().hex+'.tmp'
+        try:
+            if fname[-3:] == '.h5':
+                import h5py
+                with h5py.File(tmp,'w') as fid:
+                    for key in data.keys():
+                        fid.create_dataset(key, data = data[key])
+                    for key in meta.keys():
+                        fid.attrs[key] = meta[key]
+            else:
+                with open(tmp,'wb') as fid:
+                    np.savez_compressed(fid,**data,**{key:np.array(meta[key]) for key in meta.keys()})
+            os.replace(tmp,fname)
+        except BaseException:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+            raise
+
+
+
+def load_interpolator(fname,verbose=True):
+    """
+    Loads an interpolator (Interpolator, SphericalRegridder or ConservativeRemapper)
+    saved with the function save() of these objects.
+    <i> : fname = str, path to the file (extension .npz or .h5)
+          verbose = bool, controls inhibition of the internal message
+    <o> : the interpolator object
+    """
+    from scipy.sparse import csr_matrix
+    if fname[-3:] == '.h5':
+        import h5py
+        with h5py.File(fname,'r') as fid:
+            data = {key:fid[key][()] for key in fid.keys()}
+            for key in fid.attrs.keys():
+                data[key] = fid.attrs[key]
+    else:
+        with np.load(fname) as fid:
+            data = {key:fid[key] for key in fid.files}
+    cls = {'Interpolator':Interpolator,'SphericalRegridder':SphericalRegridder,\
+           'ConservativeRemapper':ConservativeRemapper}[str(data['cls'])]
+    obj = cls.__new__(cls)
+    obj.pName   = cls.__name__
+    obj.verbose = verbose
+    obj.method  = str(data['method'])
+    obj.W       = csr_matrix((data['W_data'],data['W_indices'],data['W_indptr']),shape=tuple(data['W_shape']))
+    obj.valid   = np.asarray(data['valid'],dtype=bool)
+    obj.shape   = tuple(int(n) for n in data['shape'])
+    obj.points  = data['points']
+    obj.targets = data['targets']
+    obj.npoints, obj.ntargets = obj.W.shape[1], obj.W.shape[0]
+    obj.ndim    = obj.points.shape[1]
+    obj.tri     = None
+    for name in ('target_area','source_area'):
+        if name in data:
+            setattr(obj,name,data[name])
+    if obj.method == 'cubic':
+        from scipy.spatial import Delaunay
+        obj.tri = Delaunay(obj.points)
+    im('Interpolation weights loaded from: '+fname,obj.pName,verbose)
+    return obj
+
+
+def grid_hash(*arrays):
+    """
+    Returns a hash (str) identifying a set of arrays (e.g. the coordinates of
+    a source grid), used as a key for the persistence of interpolation weights.
+    """
+    import hashlib
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a,dtype=np.float64)
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def cached_interpolator(builder,key,cache_dir=None,verbose=True):
+    """
+    Returns the interpolator identified by key. If cache_dir is not None and
+    contains the weights of this interpolator, loads them. Else, builds the
+    interpolator with builder() and saves it in cache_dir. The weights are
+    written atomically and an unreadable file is treated as missing, so that
+    several jobs can share the same cache_dir.
+    <i> : builder   = function without argument returning the interpolator
+          key       = str, identifier of the interpolator (source grid hash,
+                      target grid parameters and method)
+          cache_dir = None or str, directory of the saved weights
+          verbose   = bool, controls inhibition of the internal message
+    """
+    import os
+    if cache_dir is None:
+        return builder()
+    fname = os.path.join(cache_dir,'pypStag_weights_'+grid_hash(np.frombuffer(key.encode(),dtype=np.uint8))[0:20]+'.npz')
+    if os.path.isfile(fname):
+        try:
+            return load_interpolator(fname,verbose=verbose)
+        except Exception:
+            im('Unreadable cached weights, rebuilt: '+fname,'cached_interpolator',verbose)
+    interp = builder()
+    os.makedirs(cache_dir,exist_ok=True)
+    interp.save(fname)
+    return interp
+
+
+
+
+class SphericalRegridder(Interpolator):
+    """
+    Reusable interpolator between two sets of points on the sphere (e.g. the
+    points of a Yin-Yang map and a regular lon/lat grid). The points are handled
+    as 3D unit vectors so that there is no seam at the dateline and no distortion
+    near the poles. Neighbours are searched with a scipy.spatial.cKDTree.
+    Available methods:
+        'nearest' : nearest source point
+        'idw'     : inverse distance weighting on the k nearest source points
+        'linear'  : barycentric interpolation in the triangles of the spherical
+                    Delaunay triangulation of the source points (convex hull of
+                    the unit vectors)
+    As for the Interpolator, the weights are stored as a sparse operator and the
+    object is called on any field defined on the source points.
+    """
+    def __init__(self,lon,lat,lonT,latT,method='nearest',k=4,power=2,verbose=True):
+        """
+        <i> : lon,lat   = np.ndarray, longitudes and latitudes (in *RADIANS*) of the source points
+              lonT,latT = np.ndarray, longitudes and latitudes (in *RADIANS*) of the target points.
+                          The output of the regridder has the shape of these arrays.
+              method    = str, in ('nearest','idw','linear')
+              k         = int, number of neighbours for the 'idw' method
+              power     = int/float, power of the inverse distance for the 'idw' method
+              verbose   = bool, controls inhibition of the internal message
+        """
+        from scipy.sparse import csr_matrix
+        from scipy.spatial import cKDTree
+        self.pName   = 'SphericalRegridder'
+        self.verbose = verbose
+        self.method  = method
+        self.tri     = None
+        self.shape   = np.shape(lonT)
+        lon,lat   = np.asarray(lon,dtype=np.float64).flatten(),np.asarray(lat,dtype=np.float64).flatten()
+        lonT,latT = np.asarray(lonT,dtype=np.float64).flatten(),np.asarray(latT,dtype=np.float64).flatten()
+        self.points  = np.stack((np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)),axis=1)
+        self.targets = np.stack((np.cos(latT)*np.cos(lonT),np.cos(latT)*np.sin(lonT),np.sin(latT)),axis=1)
+        self.npoints  = self.points.shape[0]
+        self.ntargets = self.targets.shape[0]
+        self.ndim     = 3
+        self.valid    = np.ones(self.ntargets,dtype=bool)
+        im('Build the spherical regridder ('+method+'): '+str(self.npoints)+' -> '+str(self.ntargets)+' points',self.pName,self.verbose)
+        tree = cKDTree(self.points)
+        if method == 'nearest':
+            ind = tree.query(self.targets)[1]
+            self.W = csr_matrix((np.ones(self.ntargets),ind,np.arange(self.ntargets+1)),shape=(self.ntargets,self.npoints))
+        elif method == 'idw':
+            dist,ind = tree.query(self.targets,k=k)
+            dist = dist.reshape(self.ntargets,-1)
+            ind  = ind.reshape(self.ntargets,-1)
+            exact = dist[:,0] == 0
+            w = 1/np.where(dist == 0,1,dist)**power
+            w[exact] = 0
+            w[exact,0] = 1
+            w = w/w.sum(axis=1)[:,None]
+            nk = ind.shape[1]
+            self.W = csr_matrix((w.flatten(),ind.flatten(),np.arange(0,nk*self.ntargets+1,nk)),shape=(self.ntargets,self.npoints))
+        elif method == 'linear':
+            from scipy.spatial import ConvexHull
+            self.tri = ConvexHull(self.points).simplices
+            ntri = self.tri.shape[0]
+            # inverse of the matrices of the vertices of each triangle: the coefficients
+            # l of t = l0*a+l1*b+l2*c are the (unnormalized) barycentric coordinates of
+            # the central projection of t on the triangle, all positive inside it
+            inv = np.linalg.inv(np.transpose(self.points[self.tri],(0,2,1)))
+            # triangles around each source point
+            vt = np.argsort(self.tri.flatten(),kind='stable')
+            count = np.bincount(self.tri.flatten(),minlength=self.npoints)
+            start = np.concatenate(([0],np.cumsum(count)))
+            maxdeg = np.amax(count)
+            cand = np.full((self.npoints,maxdeg),-1,dtype=np.int64)
+            rank = np.arange(3*ntri)-np.repeat(start[:-1],count)
+            cand[np.sort(self.tri.flatten()),rank] = vt//3
+            # candidate triangles: the ones around the 3 nearest source points
+            ind = tree.query(self.targets,k=min(3,self.npoints))[1].reshape(self.ntargets,-1)
+            ctri = cand[ind].reshape(self.ntargets,-1)
+            ok = ctri >= 0
+            ctri = np.where(ok,ctri,0)
+            l = np.einsum('nmij,nj->nmi',inv[ctri],self.targets)
+            inside = np.logical_and(ok,np.all(l >= -1e-12,axis=2))
+            found = np.any(inside,axis=1)
+            best  = np.argmax(inside,axis=1)
+            tsel  = ctri[np.arange(self.ntargets),best]
+            w = l[np.arange(self.ntargets),best]
+            w = w/w.sum(axis=1)[:,None]
+            col = self.tri[tsel]
+            # targets not located (very degenerated triangulation): nearest point
+            w[~found] = [1,0,0]
+            col[~found,0] = ind[~found,0]
+            self.W = csr_matrix((w.flatten(),col.flatten(),np.arange(0,3*self.ntargets+1,3)),shape=(self.ntargets,self.npoints))
+            im('    - Targets located in a triangle: '+str(np.count_nonzero(found))+'/'+str(self.ntargets),self.pName,self.verbose)
+        else:
+            raise GridInterpolationError(method)
+
+
+class ConservativeRemapper(Interpolator):
+    """
+    Conservative (area-weighted) remapping of Yin-Yang maps on the cells of a
+    regular lon/lat grid (the cells of regularSphericalGrid(spacing), centred on
+    its points). The footprint of each Yin-Yang cell is the rectangle of the
+    logical grid (e1,e2) around its node; the overlapping zone between the Yin
+    and Yang footprints is split along the Yin-Yang partition so that the
+    footprints tile exactly the sphere. The overlap areas between the source
+    footprints and the target cells are computed once, by subdividing each
+    footprint in nsub x nsub sub-cells of exact spherical area, and stored as a
+    sparse matrix. The value of a target cell is the area-weighted mean of the
+    source cells overlapping it, so that integrals are conserved:
+        sum(self.target_area*regridded) = sum(self.source_area*field)
+    The cells of the logical grids that are not stored (overlapping points removed
+    by the redFlags) are attached to the nearest stored point. The target cells
+    smaller than the sub-cells (very close to the poles) take the value of the
+    nearest source point and have a null area.
+    """
+    def __init__(self,e1,e2,block,edges1,edges2,spacing=1,nsub=None,verbose=True):
+        """
+        <i> : e1,e2 = np.ndarray, coordinates of the source nodes on the Yin-Yang logical grid
+              block = np.ndarray, block of the source nodes (0 for Yin, 1 for Yang)
+              edges1,edges2 = np.ndarray, edges of the cells of the logical grid along e1
+                      and e2 (see yy_cell_edges), possibly non uniform (resampled grids)
+              spacing = int/float, spacing (in deg) of the regular lon/lat grid
+              nsub  = None or int, number of sub-cells per footprint in each direction
+                      If None, defined to have 4 sub-cells per target cell.
+              verbose = bool, controls inhibition of the internal message
+        """
+        from scipy.sparse import coo_matrix, csr_matrix
+        self.pName   = 'ConservativeRemapper'
+        self.verbose = verbose
+        self.method  = 'conservative'
+        self.tri     = None
+        e1 = np.asarray(e1,dtype=np.float64).flatten()
+        e2 = np.asarray(e2,dtype=np.float64).flatten()
+        block = np.asarray(block,dtype=np.int64).flatten()
+        self.npoints = e1.shape[0]
+        self.ndim    = 2
+        edges1 = np.asarray(edges1,dtype=np.float64)
+        edges2 = np.asarray(edges2,dtype=np.float64)
+        w1,w2  = np.diff(edges1),np.diff(edges2)
+        if nsub is None:
+            nsub = int(np.ceil(4*max(np.max(w1),np.max(w2))*180/np.pi/spacing))
+        nsub = max(nsub,1)
+        # --- target cells
+        ((x,y,z),(r,lonRG,latRG)) = regularSphericalGrid(radius=1,spacing=spacing)
+        self.shape = lonRG.shape
+        self.ntargets = lonRG.size
+        self.points  = np.stack((e1,e2,block),axis=1)
+        self.targets = np.stack((lonRG.flatten(),latRG.flatten()),axis=1)
+        nlon,nlat = lonRG.shape
+        lonT = lonRG[:,0]
+        dlon = lonT[1]-lonT[0]
+        latT = latRG[0,:]
+        latEdges = np.concatenate(([-np.pi/2],(latT[1:]+latT[:-1])/2,[np.pi/2]))
+        im('Build the conservative remapper: '+str(self.npoints)+' -> '+str(self.ntargets)+' cells ('+\
+           str(nsub)+'x'+str(nsub)+' sub-cells per footprint)',self.pName,self.verbose)
+        # --- cells of the logical grids and their source point (-1 if not stored)
+        from scipy.spatial import cKDTree
+        from .stagLocator import yy_redflags
+        nx,ny = w1.shape[0],w2.shape[0]
+        ci = np.clip(np.searchsorted(edges1,e1,side='right')-1,0,nx-1)
+        cj = np.clip(np.searchsorted(edges2,e2,side='right')-1,0,ny-1)
+        cellsrc = np.full((2,nx,ny),-1,dtype=np.int64)
+        cellsrc[block,ci,cj] = np.arange(self.npoints)
+        # --- sub-cells of all the cells (Yin parametrization of their block)
+        t = (np.arange(nsub)+0.5)/nsub
+        se1 = (edges1[:-1,None]+t[None,:]*w1[:,None]).flatten()
+        se2 = (edges2[:-1,None]+t[None,:]*w2[:,None]).flatten()
+        h1,h2 = np.repeat(w1/nsub,nsub),np.repeat(w2/nsub,nsub)
+        sub_i,sub_j = np.meshgrid(np.repeat(np.arange(nx),nsub),np.repeat(np.arange(ny),nsub),indexing='ij')
+        se1,se2 = np.meshgrid(se1,se2,indexing='ij')
+        h1,h2   = np.meshgrid(h1,h2,indexing='ij')
+        lat1 = np.pi/4-se1
+        area = (np.sin(lat1+h1/2)-np.sin(lat1-h1/2))*h2
+        lon1 = se2-3*np.pi/4
+        x1,y1,z1 = np.cos(lat1)*np.cos(lon1),np.cos(lat1)*np.sin(lon1),np.sin(lat1)
+        X,Y,Z,src,keepA = [],[],[],[],[]
+        for b in (0,1):
+            Xb = x1 if b == 0 else -x1
+            Yb = y1 if b == 0 else z1
+            Zb = z1 if b == 0 else y1
+            # Yin-Yang partition of the sphere: each sub-cell is kept in one block only
+            own = np.where(np.logical_or(yy_redflags(Yb,np.arctan2(Yb,Xb),np.ones(Xb.shape)),np.abs(Zb) > np.sqrt(2)/2),1,0)
+            keep = own == b
+            X.append(Xb[keep]); Y.append(Yb[keep]); Z.append(Zb[keep])
+            src.append(cellsrc[b,sub_i[keep],sub_j[keep]])
+            keepA.append(area[keep])
+        X,Y,Z = np.concatenate(X),np.concatenate(Y),np.concatenate(Z)
+        src,area = np.concatenate(src),np.concatenate(keepA)
+        # sub-cells of cells not stored (removed overlapping points) go to the nearest source point
+        sx,sy,sz = np.cos(np.pi/4-e1)*np.cos(e2-3*np.pi/4),np.cos(np.pi/4-e1)*np.sin(e2-3*np.pi/4),np.sin(np.pi/4-e1)
+        sxyz = np.stack((np.where(block == 0,sx,-sx),np.where(block == 0,sy,sz),np.where(block == 0,sz,sy)),axis=1)
+        tree = cKDTree(sxyz)
+        orphan = src < 0
+        if np.any(orphan):
+            src[orphan] = tree.query(np.stack((X[orphan],Y[orphan],Z[orphan]),axis=1))[1]
+        # --- target cells of the sub-cells
+        lon = np.arctan2(Y,X)
+        lat = np.arcsin(np.clip(Z,-1,1))
+        ti = np.mod(np.rint((lon-lonT[0])/dlon).astype(np.int64),nlon)
+        tj = np.clip(np.searchsorted(latEdges,lat,side='right')-1,0,nlat-1)
+        tgt = ti*nlat+tj
+        A = coo_matrix((area,(tgt,src)),shape=(self.ntargets,self.npoints)).tocsr()
+        A.sum_duplicates()
+        self.A = A
+        self.target_area = np.asarray(A.sum(axis=1)).flatten()
+        self.source_area = np.asarray(A.sum(axis=0)).flatten()
+        norm = np.where(self.target_area > 0,self.target_area,1)
+        W = csr_matrix((A.data/np.repeat(norm,np.diff(A.indptr)),A.indices,A.indptr),shape=A.shape)
+        # target cells smaller than the sub-cells (near the poles): value of the nearest
+        # source point, without weight in the integrals (target_area = 0)
+        empty = self.target_area == 0
+        if np.any(empty):
+            lonE,latE = lonRG.flatten()[empty],latRG.flatten()[empty]
+            near = tree.query(np.stack((np.cos(latE)*np.cos(lonE),np.cos(latE)*np.sin(lonE),np.sin(latE)),axis=1))[1]
+            W = W+csr_matrix((np.ones(near.shape[0]),(np.where(empty)[0],near)),shape=A.shape)
+        self.W = W.tocsr()
+        self.valid = np.ones(self.ntargets,dtype=bool)
+        im('    - Total area of the footprints: '+str(np.sum(self.source_area)/np.pi)[0:8]+' pi',self.pName,self.verbose)
+
+
+    def match(self,points,targets,method):
+        """
+        Returns True if the current remapper can be reused (see Interpolator.match).
+        """
+        return method == self.method and np.array_equal(np.asarray(points),self.points) and \
+               np.array_equal(np.asarray(targets),self.targets)
+
+
+
+def yy_logical_coordinates(x,y,z,nyin):
+    """
+    Returns the coordinates on the Yin-Yang logical grid of a set of points of
+    a Yin-Yang map stacked as [Yin points, Yang points].
+    <i> : x,y,z = np.ndarray, cartesian coordinates of the points
+          nyin  = int, number of Yin points (the first nyin points)
+    <o> : (e1,e2,block)
+    """
+    x = np.asarray(x,dtype=np.float64).flatten()
+    y = np.asarray(y,dtype=np.float64).flatten()
+    z = np.asarray(z,dtype=np.float64).flatten()
+    block = (np.arange(x.shape[0]) >= nyin).astype(np.int64)
+    r  = np.sqrt(x**2+y**2+z**2)
+    x1 = np.where(block == 0,x,-x)
+    y1 = np.where(block == 0,y,z)
+    z1 = np.where(block == 0,z,y)
+    e1 = np.pi/4-np.arcsin(np.clip(z1/r,-1,1))
+    e2 = np.arctan2(y1,x1)+3*np.pi/4
+    return e1,e2,block
+
+
+def yy_cell_edges(x_coords,y_coords):
+    """
+    Returns the edges of the cells of the Yin-Yang logical grid around the nodes
+    x_coords (e1) and y_coords (e2) of a stagData (after resampling or coarsening):
+    the edges are the mid-points between the nodes, bounded by the extent of the
+    blocks (e1 in [0,pi/2] and e2 in [0,3pi/2]).
+    <i> : x_coords,y_coords = np.ndarray, coordinates of the nodes on the logical grid
+    <o> : (edges1,edges2)
+    """
+    edges = []
+    for c,cmax in ((x_coords,np.pi/2),(y_coords,3*np.pi/2)):
+        c = np.asarray(c,dtype=np.float64).flatten()
+        edges.append(np.concatenate(([0],(c[1:]+c[:-1])/2,[cmax])))
+    return edges[0],edges[1]
+
+
+_regridder_cache = OrderedDict() # least recently used regridders, at most _regridder_cache_size
+_regridder_cache_size = 8
+
+def get_spherical_regridder(lon,lat,spacing=1,method='nearest',k=4,power=2,cells=None,cache_dir=None,verbose=True):
+    """
+    Returns a SphericalRegridder (or a ConservativeRemapper if method == 'conservative')
+    from the points (lon,lat) to the regular grid of regularSphericalGrid(spacing).
+    The regridders are cached according to the source grid, the spacing and the
+    method, so that the weights are computed only once for all the maps (fields,
+    snapshots) on the same grid. The last _regridder_cache_size regridders used
+    are kept in memory.
+    <i> : lon,lat = np.ndarray, longitudes and latitudes (in *RADIANS*) of the source points
+          spacing = int/float, spacing (in deg) of the regular grid
+          method,k,power = see SphericalRegridder
+          cells   = None or tuple (e1,e2,block,edges1,edges2) describing the Yin-Yang cells
+                    of the source points, only for method == 'conservative'
+                    (see ConservativeRemapper and yy_logical_coordinates)
+          cache_dir = None or str, if not None, directory where the weights are saved and
+                    searched (see cached_interpolator), e.g. to share them between sessions
+          verbose = bool, controls inhibition of the internal message
+    <o> : (regridder,lonRG,latRG) with lonRG,latRG the regular grid (in *RADIANS*)
+    """
+    key = (grid_hash(lon,lat),float(spacing),method,k,power)
+    ((x,y,z),(r,lonRG,latRG)) = regularSphericalGrid(radius=1,spacing=spacing)
+    if key not in _regridder_cache:
+        if method == 'conservative':
+            if cells is None:
+                raise GridInterpolationError('conservative (without the Yin-Yang cells)')
+            e1,e2,block,edges1,edges2 = cells
+            builder = lambda: ConservativeRemapper(e1,e2,block,edges1,edges2,spacing=spacing,verbose=verbose)
+        else:
+            builder = lambda: SphericalRegridder(lon,lat,lonRG,latRG,method=method,k=k,power=power,verbose=verbose)
+        _regridder_cache[key] = cached_interpolator(builder,'regridder_'+'_'.join([str(p) for p in key]),\
+                                                    cache_dir=cache_dir,verbose=verbose)
+        while len(_regridder_cache) > _regridder_cache_size:
+            _regridder_cache.popitem(last=False)
+    else:
+        im('Reuse of a cached spherical regridder',SphericalRegridder.__name__,verbose)
+        _regridder_cache.move_to_end(key)
+    return _regridder_cache[key],lonRG,latRG
+
+
+
+
 def regularSphericalGrid(radius,spacing=1):
     """Return a regular spherical grid for a single depth. The regularity is 
     guaranted on longitude and latitude. e.g: For a spacing parameter in
@@ -51,7 +592,7 @@ def regularSphericalGrid(radius,spacing=1):
     r   = [radius]*nbinR
     #2. Mesh grid
     (Lon,Lat) = np.meshgrid(lon,lat,indexing='ij')
-    R = np.zeros(Lon.shape)
+    R = np.ones(Lon.shape)*radius
     #3. Projection on cartesian coordinates
     x = R*np.cos(Lat)*np.cos(Lon)
     y = R*np.cos(Lat)*np.sin(Lon)
@@ -83,7 +624,7 @@ def regularAnnulusGrid(innerradius=1.2,outerradius=2.2,ntheta=128,nz=64):
 
 def sliceInterpolator(sliceData,interpGeom='rgS',\
     spacing=1,innerradius=1.19,outerradius=2.19,ntheta=128,nz=64,\
-    interpMethod='nearest',deg=False,verbose=True):
+    interpMethod='nearest',deg=False,verbose=True,interpolator=None,cache_dir=None):
     """
     Interpolates a stagData.YinYangSliceData object in an other grid.
     <i> : sliceData  = stagData.YinYangSliceDat object
@@ -92,10 +633,20 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
           spacing    = int, parameter of the interpGeom
           interpMethod = str, method used for the interpolation. In ('nearest' 
                          'linear', 'cubic'). Default = 'nearest'
+                         For interpGeom == 'rgS' on a depth slice (single shell),
+                         'linear' is computed on the sphere (see SphericalRegridder)
           deg = bool, for interpGeom == 'rgS' only ! if deg is True, then the
                 x,y,z on output will be lon,lat,r repsectivelly
           verbose = bool, controls inhibition of the internal message
+          interpolator = None or Interpolator object, e.g. the attribute 'interpolator'
+                       of the output of a previous call on a slice with the same grid
+                       (e.g. an other snapshot). If it matches the slice, the new grid
+                       and the method, the interpolation weights are reused.
+          cache_dir = None or str, if not None, directory where the interpolation weights
+                       are saved and searched (keyed by the slice grid, the new grid and
+                       the method), to reuse them between sessions or batch jobs.
     <o> : Return a stagData.InterpolatedSliceData objet
+          (the Interpolator used is stored in its attribute 'interpolator')
     """
     time0 = time() #Init time for log message
     if verbose:
@@ -134,7 +685,31 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
         im('    - Slice layer index            : '+str(sliceData.layer),pName,verbose)
         im('    - Corresponding depth          : '+str(sliceData.depth),pName,verbose)
         im('    - Number of Points in the slice: '+str(len(X)),pName,verbose)
-        points = np.array([(X[i],Y[i],Z[i]) for i in range(len(X))])
+        points = np.stack((X,Y,Z),axis=1)
+        rs = np.sqrt(np.sum(np.asarray(points,dtype=np.float64)**2,axis=1))
+        if interpMethod == 'linear' and np.amax(rs)-np.amin(rs) <= 1e-5*np.amax(rs):
+            # single shell (depth slice): a 3D Delaunay triangulation of the shell does
+            # not contain the targets (on the shell), the linear weights are built on
+            # the sphere (triangulation of the unit vectors)
+            lonS = np.arctan2(points[:,1],points[:,0])
+            latS = np.arcsin(np.clip(points[:,2]/rs,-1,1))
+            lonT,latT = lon.flatten(),lat.flatten()
+            unitS = np.stack((np.cos(latS)*np.cos(lonS),np.cos(latS)*np.sin(lonS),np.sin(latS)),axis=1)
+            unitT = np.stack((np.cos(latT)*np.cos(lonT),np.cos(latT)*np.sin(lonT),np.sin(latT)),axis=1)
+            if interpolator is None or not interpolator.match(unitS,unitT,interpMethod):
+                key = 'rgS_'+grid_hash(points)+'_'+str(spacing)+'_spherical_'+interpMethod
+                interpolator = cached_interpolator(lambda: SphericalRegridder(lonS,latS,lonT,latT,method=interpMethod,verbose=verbose),\
+                                                   key,cache_dir=cache_dir,verbose=verbose)
+            else:
+                im('    - Reuse of the input interpolator',pName,verbose)
+        elif interpolator is None or not interpolator.match(points,(Xrg,Yrg,Zrg),interpMethod):
+            key = 'rgS_'+grid_hash(points)+'_'+str(spacing)+'_'+interpMethod
+            interpolator = cached_interpolator(lambda: Interpolator(points,(Xrg,Yrg,Zrg),method=interpMethod,verbose=verbose),\
+                                               key,cache_dir=cache_dir,verbose=verbose)
+        else:
+            im('    - Reuse of the input interpolator',pName,verbose)
+        if not np.any(interpolator.valid):
+            raise GridInterpolationError(interpGeom+"' with the method '"+interpMethod+"' (no target point inside the slice)")
         # Stores all in an stagData.InterpolatedSliceData object
         isd = InterpolatedSliceData()
         isd.sliceInheritance(sliceData)
@@ -151,8 +726,7 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
         # Scalar or Vectorial
         if sliceData.fieldNature == 'Scalar':
             im('    - Interpolation of a Sclar field',pName,verbose)
-            values = np.array(sliceData.v)
-            isd.v = griddata(points, values, (Xrg, Yrg, Zrg), method=interpMethod)
+            isd.v = interpolator(np.array(sliceData.v))
             im('Interpolation done for the slice !',pName,verbose)
             im('    - Duration of interpolation: '+str(time()-time0)[0:5]+' s',pName,verbose)
             if deg:
@@ -164,22 +738,10 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
                 Zrg = z.reshape(z.shape[0]*z.shape[1]*z.shape[2])
         else: #Vectorial field
             im('    - Interpolation of a Vectorial field: can take time',pName,verbose)
-            values_vx = np.array(sliceData.vx)
-            values_vy = np.array(sliceData.vy)
-            values_vz = np.array(sliceData.vz)
-            values_P = np.array(sliceData.P)
-            values_vtheta = np.array(sliceData.vtheta)
-            values_vphi = np.array(sliceData.vphi)
-            values_vr = np.array(sliceData.vr)
-            values_v  = np.array(sliceData.v)
-            isd.vx = griddata(points, values_vx, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.vy = griddata(points, values_vy, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.vz = griddata(points, values_vz, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.P = griddata(points, values_P, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.vtheta = griddata(points, values_vtheta, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.vphi = griddata(points, values_vphi, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.vr = griddata(points, values_vr, (Xrg, Yrg, Zrg), method=interpMethod)
-            isd.v = griddata(points, values_v, (Xrg, Yrg, Zrg), method=interpMethod)
+            names  = ['vx','vy','vz','P','vtheta','vphi','vr','v']
+            values = interpolator(np.stack([np.array(getattr(sliceData,name)) for name in names],axis=1))
+            for i in range(len(names)):
+                setattr(isd,names[i],values[:,i])
             im('Interpolation done for the slice !',pName,verbose)
             im('    - Duration of interpolation: '+str(time()-time0)[0:5]+' s',pName,verbose)
             if deg:
@@ -204,7 +766,13 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
         Y = sliceData.y
         im('    - Normal vector                : '+str(sliceData.normal),pName,verbose)
         im('    - Number of Points in the slice: '+str(len(X)),pName,verbose)
-        points = np.array([(X[i],Y[i]) for i in range(len(X))])
+        points = np.stack((X,Y),axis=1)
+        if interpolator is None or not interpolator.match(points,(Xrg,Yrg),interpMethod):
+            key = 'rgA_'+grid_hash(points)+'_'+'_'.join([str(p) for p in (innerradius,outerradius,ntheta,nz)])+'_'+interpMethod
+            interpolator = cached_interpolator(lambda: Interpolator(points,(Xrg,Yrg),method=interpMethod,verbose=verbose),\
+                                               key,cache_dir=cache_dir,verbose=verbose)
+        else:
+            im('    - Reuse of the input interpolator',pName,verbose)
         # Stores all in an stagData.InterpolatedSliceData object
         isd = InterpolatedSliceData()
         isd.sliceInheritance(sliceData)
@@ -220,28 +788,15 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
         # Scalar or Vectorial
         if sliceData.fieldNature == 'Scalar':
             im('    - Interpolation of a Sclar field',pName,verbose)
-            values = np.array(sliceData.v)
-            isd.v = griddata(points, values, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
+            isd.v = interpolator(np.array(sliceData.v)).reshape(npx,npy)
             im('Interpolation done for the slice !',pName,verbose)
             im('    - Duration of interpolation: '+str(time()-time0)[0:5]+' s',pName,verbose)
         else: #Vectorial field
             im('    - Interpolation of a Vectorial field: can take time',pName,verbose)
-            values_vx = np.array(sliceData.vx)
-            values_vy = np.array(sliceData.vy)
-            values_vz = np.array(sliceData.vz)
-            values_P = np.array(sliceData.P)
-            values_vtheta = np.array(sliceData.vtheta)
-            values_vphi = np.array(sliceData.vphi)
-            values_vr = np.array(sliceData.vr)
-            values_v  = np.array(sliceData.v)
-            isd.vx = griddata(points, values_vx, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.vy = griddata(points, values_vy, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.vz = griddata(points, values_vz, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.P = griddata(points, values_P, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.vtheta = griddata(points, values_vtheta, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.vphi = griddata(points, values_vphi, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.vr = griddata(points, values_vr, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
-            isd.v = griddata(points, values_v, (Xrg, Yrg), method=interpMethod).reshape(npx,npy)
+            names  = ['vx','vy','vz','P','vtheta','vphi','vr','v']
+            values = interpolator(np.stack([np.array(getattr(sliceData,name)) for name in names],axis=1))
+            for i in range(len(names)):
+                setattr(isd,names[i],values[:,i].reshape(npx,npy))
             im('Interpolation done for the slice !',pName,verbose)
             im('    - Duration of interpolation: '+str(time()-time0)[0:5]+' s',pName,verbose)
         # Add coordinates:
@@ -251,6 +806,7 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
         isd.r = rg.reshape(npx,npy)
         isd.theta = thetag.reshape(npx,npy)
         isd.phi = np.zeros((npx,npy))
+    isd.interpolator = interpolator
     return isd
 
 
@@ -260,34 +816,43 @@ def sliceInterpolator(sliceData,interpGeom='rgS',\
 
 
 def sliceYYInterpolator_mapping(sliceData,field,spacing=1,\
-    interpMethod='nearest',verbose=True,log10=False,deg=True):
+    interpMethod='nearest',verbose=True,log10=False,deg=True,cache_dir=None):
     """
     Interpolates a stagData.YinYangSliceData object in an other grid.
     Function dedicated to be call in pypStag.stagViewer
+    The interpolation is computed on the sphere (see SphericalRegridder) and
+    the weights are cached for the next calls on the same grid.
     <i> : sliceData  = stagData.YinYangSliceDat object
           spacing    = int, parameter of the interpGeom
-          interpMethod = str, method used for the interpolation. In ('nearest' 
-                         'linear', 'cubic'). Default = 'nearest'
+          interpMethod = str, method used for the interpolation. In ('nearest',
+                         'idw', 'linear', 'conservative'). 'cubic' falls back on 'linear'.
+                         Default = 'nearest'
           verbose = bool, controls inhibition of the internal message
+          cache_dir = None or str, if not None, directory where the interpolation weights
+                         are saved and searched (see get_spherical_regridder)
     <o> : Return the regular lon/lat grid in deg and the interpolated field
     """
     time0 = time() #Init time for log message
     pName = 'sliceYYInterpolator_mapping'
     #1. Creation of the new grid
     im('Creation of interpGeom Grid',pName,verbose)
-    ((x,y,z),(r,lon,lat)) = regularSphericalGrid(radius=sliceData.r[0],spacing=spacing)
+    sldLon = sliceData.phi# + np.pi
+    sldLat = -(sliceData.theta - np.pi/2)
+    if interpMethod == 'cubic':
+        interpMethod = 'linear'
+    cells = None
+    if interpMethod == 'conservative':
+        e1,e2,block = yy_logical_coordinates(sliceData.x,sliceData.y,sliceData.z,len(sliceData.x1))
+        cells = (e1,e2,block)+yy_cell_edges(sliceData.x_coords,sliceData.y_coords)
+    regridder,lon,lat = get_spherical_regridder(sldLon,sldLat,spacing=spacing,method=interpMethod,\
+                                                cells=cells,cache_dir=cache_dir,verbose=verbose)
     im('    - Spacing for grid : '+str(spacing),pName,verbose)
     im('    - Number of Points : '+str(lon.shape[0]*lon.shape[1]),pName,verbose)
 
     im('Interpolation of the slice:',pName,verbose)
-    sldLon = sliceData.phi# + np.pi
-    sldLat = -(sliceData.theta - np.pi/2)
     im('    - Slice layer index            : '+str(sliceData.layer),pName,verbose)
     im('    - Corresponding depth          : '+str(sliceData.depth),pName,verbose)
     im('    - Number of Points in the slice: '+str(len(sldLon)),pName,verbose)
-    points = np.zeros((sliceData.phi.shape[0],2))
-    points[:,0] = sldLon
-    points[:,1] = sldLat
     
     # --- Test the field
     if field == 'scalar' or field == 'v':
@@ -334,7 +899,7 @@ def sliceYYInterpolator_mapping(sliceData,field,spacing=1,\
         stagfield = np.log10(stagfield)
         
     # Scalar or Vectorial
-    v = griddata(points, stagfield, (lon, lat), method=interpMethod)
+    v = regridder(np.asarray(stagfield).flatten())
     im('Interpolation done for the slice !',pName,verbose)
     im('    - Duration of interpolation: '+str(time()-time0)[0:5]+' s',pName,verbose)
     
@@ -344,4 +909,355 @@ def sliceYYInterpolator_mapping(sliceData,field,spacing=1,\
         lat = lat * 180/np.pi
     
     return lon,lat,v
-    
\ No newline at end of file
+    
+
+
+
+
+
+
+
+def yyVolumeInterpolator(stagData,fname,path='./',spacing=1,radii=None,interpMethod='linear',\
+    compression=None,cache_dir=None,verbose=True):
+    """
+    Interpolates all the layers of a stagData.StagYinYangGeometry object (scalar or
+    vectorial fields) on a regular lon x lat x r grid and writes the result in a HDF5 file.
+    The horizontal Yin-Yang mesh being identical for all the layers, the horizontal
+    interpolation weights are computed once (see SphericalRegridder, cached) and applied
+    layer by layer; the radial interpolation is linear between the two bracketing layers.
+    The output file is filled while streaming on the layers, so that the whole
+    interpolated volume is never held in memory.
+    HDF5 layout:
+        /Grid/lon, /Grid/lat = vectors of the longitudes and latitudes in deg (nlon, nlat)
+        /Grid/r, /Grid/depth = vectors of the radii and of the corresponding depths in km (nr)
+        /Fields/<name>       = matrix (nr,nlon,nlat) of each field, chunked by layer
+                               (NaN outside the radial extent of the loaded layers)
+    <i> : stagData = stagData.StagYinYangGeometry object
+          fname    = str, name of the output file (with or without the .h5 extension)
+          path     = str, path to the output directory
+          spacing  = int/float, spacing (in deg) of the regular lon/lat grid
+          radii    = None or list/np.ndarray, radii of the new grid (same unit as stagData.r).
+                     If None, takes the radii of the loaded layers.
+          interpMethod = str, horizontal interpolation method in ('nearest','idw','linear','conservative')
+          compression  = None or str, compression filter of the HDF5 datasets (e.g. 'gzip')
+          cache_dir = None or str, if not None, directory where the horizontal interpolation
+                     weights are saved and searched (see get_spherical_regridder)
+          verbose = bool, controls inhibition of the internal message
+    <o> : str, path to the output file
+    """
+    import h5py
+    time0 = time() #Init time for log message
+    pName = 'yyVolumeInterpolator'
+    if not isinstance(stagData,StagYinYangGeometry):
+        raise GridInterpolationError(stagData.geometry)
+    if fname[-3:] != '.h5':
+        fname = fname+'.h5'
+    Nz   = stagData.slayers.shape[0]
+    NxNy = int(stagData.x.shape[0]/Nz)
+    # --- horizontal weights
+    im('Computation of the horizontal interpolation weights',pName,verbose)
+    lon0 = stagData.phi.reshape((NxNy,Nz))[:,-1]
+    lat0 = np.pi/2-stagData.theta.reshape((NxNy,Nz))[:,-1]
+    cells = None
+    if interpMethod == 'conservative':
+        xs,ys,zs = [np.asarray(c).reshape((NxNy,Nz))[:,-1] for c in (stagData.x,stagData.y,stagData.z)]
+        e1,e2,block = yy_logical_coordinates(xs,ys,zs,NxNy//2)
+        cells = (e1,e2,block)+yy_cell_edges(stagData.x_coords,stagData.y_coords)
+    regridder,lonRG,latRG = get_spherical_regridder(lon0,lat0,spacing=spacing,method=interpMethod,\
+                                                    cells=cells,cache_dir=cache_dir,verbose=verbose)
+    nlon,nlat = lonRG.shape
+    # --- radial weights
+    rs = stagData.rcmb+np.asarray(stagData.z_coords,dtype=np.float64)
+    if radii is None:
+        radii = rs.copy()
+    radii = np.sort(np.asarray(radii,dtype=np.float64).flatten())
+    nr = radii.shape[0]
+    k  = np.clip(np.searchsorted(rs,radii,side='right')-1,0,max(Nz-2,0))
+    k1 = np.minimum(k+1,Nz-1)
+    fk = np.where(k1 > k,(radii-rs[k])/np.where(k1 > k,rs[k1]-rs[k],1),0)
+    inrange = np.logical_and(radii >= rs[0]-1e-6,radii <= rs[-1]+1e-6)
+    fk = np.clip(fk,0,1)
+    # --- fields
+    if stagData.fieldNature == 'Vectorial':
+        names = ['v','vx','vy','vz','vr','vtheta','vphi','P']
+    else:
+        names = ['v']
+    data = [np.asarray(getattr(stagData,name)).reshape((NxNy,Nz)) for name in names]
+    im('    - Regular grid     : '+str(nlon)+' x '+str(nlat)+' x '+str(nr)+' points',pName,verbose)
+    im('    - Fields           : '+', '.join(names),pName,verbose)
+    # --- streaming
+    im('Streaming interpolation of the layers in: '+path+fname,pName,verbose)
+    with h5py.File(path+fname,'w') as fid:
+        fid.attrs['fname']   = stagData.fname
+        fid.attrs['simuAge'] = stagData.simuAge
+        fid.attrs['ti_step'] = stagData.ti_step
+        fid.attrs['spacing'] = spacing
+        fid.attrs['interpMethod'] = interpMethod
+        fid.create_dataset('/Grid/lon', data = lonRG[:,0]*180/np.pi)
+        fid.create_dataset('/Grid/lat', data = latRG[0,:]*180/np.pi)
+        fid.create_dataset('/Grid/r', data = radii)
+        fid.create_dataset('/Grid/depth', data = (stagData.rcmb+1-radii)*2890)
+        dsets = [fid.create_dataset('/Fields/'+name,shape=(nr,nlon,nlat),dtype=np.float32,\
+                                    chunks=(1,nlon,nlat),compression=compression) for name in names]
+        layers = {}  # horizontally interpolated layers still needed
+        for ir in range(nr):
+            for kk in (k[ir],k1[ir]):
+                if kk not in layers:
+                    layers[kk] = regridder(np.stack([d[:,kk] for d in data],axis=1))
+            values = (1-fk[ir])*layers[k[ir]]+fk[ir]*layers[k1[ir]]
+            if not inrange[ir]:
+                values[:] = np.nan
+            for i in range(len(names)):
+                dsets[i][ir,:,:] = values[...,i]
+            for kk in list(layers.keys()):
+                if kk < k[ir]:
+                    del layers[kk]
+            im('    - Layer '+str(ir+1)+'/'+str(nr)+' done',pName,verbose)
+    im('Interpolation done !',pName,verbose)
+    im('    - Duration of interpolation: '+str(time()-time0)[0:5]+' s',pName,verbose)
+    return path+fname
+
+
+
+
+
+
+
+def block_average(values,lat,factor=2):
+    """
+    Coarsens a regular lon/lat map by averaging blocks of factor x factor points.
+    The mean is weighted by the cosine of the latitude (area of the points on the
+    sphere) and ignores the NaN. If the dimensions of the map are not multiples of
+    factor, the last block in each direction gathers the remaining points.
+    <i> : values = np.ndarray, shape (nlon,nlat) or (nlon,nlat,k), map(s) to coarsen
+          lat    = np.ndarray, shape (nlat), latitudes of the map in deg
+          factor = int, number of points averaged in each direction
+    <o> : (values,lon_index,lat) where values is the coarsened map(s), shape
+          (ceil(nlon/factor),ceil(nlat/factor)[,k]), lon_index the starting index of the
+          blocks in longitude and lat the weighted mean latitude of the new rows (deg).
+    """
+    values = np.asarray(values,dtype=np.float64)
+    nlon,nlat = values.shape[0],values.shape[1]
+    ilon = np.arange(0,nlon,factor)
+    ilat = np.arange(0,nlat,factor)
+    w = np.maximum(np.cos(np.asarray(lat,dtype=np.float64)*np.pi/180),1e-6)
+    w = w.reshape((1,nlat)+(1,)*(values.ndim-2))
+    mask = np.isfinite(values)
+    wv = np.where(mask,values*w,0)
+    wm = np.where(mask,w,0)
+    sv = np.add.reduceat(np.add.reduceat(wv,ilon,axis=0),ilat,axis=1)
+    sw = np.add.reduceat(np.add.reduceat(wm,ilon,axis=0),ilat,axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        coarse = np.where(sw > 0,sv/np.where(sw > 0,sw,1),np.nan)
+    w = w.flatten()
+    latc = np.add.reduceat(w*lat,ilat)/np.add.reduceat(w,ilat)
+    return coarse,ilon,latc
+
+
+
+def buildMapPyramid(sliceData,fname,path='./',fields=None,spacing=1,nlevels=None,minsize=8,\
+    interpMethod='linear',log10=False,compression=None,cache_dir=None,verbose=True):
+    """
+    Builds a multi-resolution pyramid of regular lon/lat maps from a depth slice and
+    stores it in a single HDF5 file. The level 0 is the map at the input spacing,
+    interpolated once (stagData.YinYangSliceData) or taken as it is
+    (stagData.InterpolatedSliceData on a 'rgS' grid). Each next level is computed from
+    the previous one by block averaging (2x2, area-weighted, see block_average), so that
+    the resolution is halved at each level. Read the output with MapPyramid.
+    HDF5 layout:
+        /Level_<i>/lon, /Level_<i>/lat = vectors of the longitudes and latitudes in deg
+        /Level_<i>/<field>             = matrix (nlon,nlat) of each field
+        each level has the attributes 'spacing' (in deg) and 'shape'.
+    <i> : sliceData = stagData.YinYangSliceData object (depth slice) or
+                      stagData.InterpolatedSliceData object (interpGeom == 'rgS')
+          fname    = str, name of the output file (with or without the .h5 extension)
+          path     = str, path to the output directory
+          fields   = None or list of str, fields to store. If None, 'v' for scalar fields
+                     and all the components for vectorial fields.
+          spacing  = int/float, spacing (in deg) of the level 0 for YinYangSliceData objects
+                     (ignored for InterpolatedSliceData objects, the grid being already defined)
+          nlevels  = None or int, number of levels. If None, levels are added until one
+                     dimension of the map is smaller than minsize.
+          minsize  = int, minimum number of points in each direction of the coarsest level
+          interpMethod = str, interpolation method for the level 0 of YinYangSliceData objects
+                     (see sliceYYInterpolator_mapping)
+          log10    = bool, if True, the log10 of the fields is averaged
+          compression = None or str, compression filter of the HDF5 datasets (e.g. 'gzip')
+          cache_dir = None or str, see sliceYYInterpolator_mapping
+          verbose  = bool, controls inhibition of the internal message
+    <o> : str, path to the output file
+    """
+    import h5py
+    time0 = time() #Init time for log message
+    pName = 'buildMapPyramid'
+    if fname[-3:] != '.h5':
+        fname = fname+'.h5'
+    if fields is None:
+        if sliceData.fieldNature == 'Vectorial':
+            fields = ['v','vx','vy','vz','vtheta','vphi','vr','P']
+        else:
+            fields = ['v']
+    elif isinstance(fields,str):
+        fields = [fields]
+    # --- level 0
+    im('Computation of the level 0',pName,verbose)
+    if isinstance(sliceData,YinYangSliceData):
+        data = []
+        for field in fields:
+            lon,lat,v = sliceYYInterpolator_mapping(sliceData,field,spacing=spacing,interpMethod=interpMethod,\
+                                                    log10=log10,deg=True,cache_dir=cache_dir,verbose=False)
+            data.append(v)
+        data = np.stack(data,axis=-1)
+    elif isinstance(sliceData,InterpolatedSliceData):
+        if sliceData.interpGeom != 'rgS':
+            raise GridInterpolationError(str(sliceData.interpGeom))
+        lon = np.asarray(sliceData.lon)
+        lat = np.asarray(sliceData.lat)
+        spacing = sliceData.spacing
+        data = []
+        for field in fields:
+            if field == 'p':
+                field = 'P'
+            if field not in ['v','vx','vy','vz','vtheta','vphi','vr','P']:
+                raise StagMapUnknownFieldError(field)
+            if field != 'v' and sliceData.fieldNature != 'Vectorial':
+                raise StagMapFieldError(field,sliceData.geometry,sliceData.fieldNature)
+            v = np.asarray(getattr(sliceData,field),dtype=np.float64).reshape(lon.shape)
+            if log10:
+                v = np.log10(v)
+            data.append(v)
+        data = np.stack(data,axis=-1)
+    else:
+        raise GridInterpolationError(sliceData.geometry)
+    lonv = np.asarray(lon)[:,0]
+    latv = np.asarray(lat)[0,:]
+    # --- levels
+    if nlevels is None:
+        nlevels = 1
+        n = min(lonv.shape[0],latv.shape[0])
+        while int(np.ceil(n/2)) >= minsize:
+            n = int(np.ceil(n/2))
+            nlevels += 1
+    im('Writing of '+str(nlevels)+' levels in: '+path+fname,pName,verbose)
+    with h5py.File(path+fname,'w') as fid:
+        fid.attrs['fname']   = sliceData.fname
+        fid.attrs['simuAge'] = sliceData.simuAge
+        fid.attrs['ti_step'] = sliceData.ti_step
+        fid.attrs['depth']   = np.nan if sliceData.depth is None else sliceData.depth
+        fid.attrs['nlevels'] = nlevels
+        fid.attrs['fields']  = ','.join(fields)
+        fid.attrs['log10']   = log10
+        for il in range(nlevels):
+            if il > 0:
+                data,ilon,latc = block_average(data,latv,factor=2)
+                lonv = np.add.reduceat(lonv,ilon)/np.add.reduceat(np.ones(lonv.shape[0]),ilon)
+                latv = latc
+            grp = fid.create_group('Level_'+str(il))
+            grp.attrs['spacing'] = spacing*2**il
+            grp.attrs['shape']   = data.shape[0:2]
+            grp.create_dataset('lon', data = lonv)
+            grp.create_dataset('lat', data = latv)
+            for i in range(len(fields)):
+                grp.create_dataset(fields[i], data = data[...,i].astype(np.float32), compression=compression)
+            im('    - Level '+str(il)+': '+str(data.shape[0])+' x '+str(data.shape[1])+' points',pName,verbose)
+    im('Pyramid done !',pName,verbose)
+    im('    - Duration of the computation: '+str(time()-time0)[0:5]+' s',pName,verbose)
+    return path+fname
+
+
+
+class MapPyramid:
+    """
+    Lazy reader of a multi-resolution map pyramid written by buildMapPyramid.
+    The HDF5 file is kept open and only the requested level (and fields)
+    is read from the disk.
+    """
+    def __init__(self,fname,verbose=True):
+        """
+        <i> : fname = str, path to the pyramid file
+              verbose = bool, controls inhibition of the internal message
+        """
+        import h5py
+        self.pName   = 'MapPyramid'
+        self.verbose = verbose
+        self.fname   = fname
+        self.fid     = h5py.File(fname,'r')
+        self.nlevels = int(self.fid.attrs['nlevels'])
+        self.fields  = str(self.fid.attrs['fields']).split(',')
+        self.spacing = [float(self.fid['Level_'+str(i)].attrs['spacing']) for i in range(self.nlevels)]
+        self.shape   = [tuple(self.fid['Level_'+str(i)].attrs['shape']) for i in range(self.nlevels)]
+        self.depth   = self.fid.attrs['depth']
+        self.simuAge = self.fid.attrs['simuAge']
+        self.ti_step = self.fid.attrs['ti_step']
+    
+    
+    def __len__(self):
+        return self.nlevels
+    
+    
+    def __getitem__(self,level):
+        return self.level(level)
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self,*args):
+        self.close()
+    
+    
+    def close(self):
+        """Closes the pyramid file"""
+        self.fid.close()
+    
+    
+    def select(self,spacing):
+        """
+        Returns the index of the coarsest level having a spacing lower or equal
+        to the input spacing (or the finest level if none).
+        <i> : spacing = int/float, requested spacing in deg
+        """
+        ok = [i for i in range(self.nlevels) if self.spacing[i] <= spacing+1e-9]
+        if len(ok) == 0:
+            return 0
+        return ok[-1]
+    
+    
+    def level(self,level,field=None,extent=None):
+        """
+        Reads a level of the pyramid.
+        <i> : level = int, index of the level (0 = finest resolution, negative indices allowed)
+              field = None, str or list of str. If None, all the fields stored.
+              extent = None or [lon_min,lon_max,lat_min,lat_max] in deg, if not None, reads
+                       only the points of the level in this window.
+        <o> : (lon,lat,v) where lon and lat are the matrices (nlon,nlat) of the longitudes
+              and latitudes in deg and v the matrix (nlon,nlat) of the field if field is a str,
+              else a dict of matrices for each field.
+        """
+        if level < 0:
+            level = self.nlevels+level
+        grp = self.fid['Level_'+str(level)]
+        lon = grp['lon'][()]
+        lat = grp['lat'][()]
+        slon = slice(None)
+        slat = slice(None)
+        if extent is not None:
+            ilon = np.where(np.logical_and(lon >= extent[0],lon <= extent[1]))[0]
+            ilat = np.where(np.logical_and(lat >= extent[2],lat <= extent[3]))[0]
+            slon = slice(ilon[0],ilon[-1]+1) if len(ilon) > 0 else slice(0,0)
+            slat = slice(ilat[0],ilat[-1]+1) if len(ilat) > 0 else slice(0,0)
+        lon,lat = np.meshgrid(lon[slon],lat[slat],indexing='ij')
+        im('Reading of the level '+str(level)+' ('+str(lon.shape[0])+' x '+str(lon.shape[1])+' points)',self.pName,self.verbose)
+        if isinstance(field,str):
+            if field not in self.fields:
+                raise StagMapUnknownFieldError(field)
+            return lon,lat,grp[field][slon,slat]
+        if field is None:
+            field = self.fields
+        out = {}
+        for name in field:
+            if name not in self.fields:
+                raise StagMapUnknownFieldError(name)
+            out[name] = grp[name][slon,slat]
+        return lon,lat,out
@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:30:00 2026
+
+@author: Alexandre Janin
+@Aim: Point location on the native logical grids of StagData objects
+"""
+
+
+"""
+This script contains the point location service of pypStag: for any batch of
+points, it returns the block, the (i,j,k) indices of the lower corner of the
+containing cell of the logical grid and the fractional offsets of the points
+in this cell. For the Yin-Yang grid, the location inverts directly the analytic
+mapping used in stagData (rectangular2YY):
+        lat = pi/4 - e1 ,  lon = e2 - 3*pi/4   (Yin)
+        (x2,y2,z2) = (-x1,z1,y1)               (Yang)
+so that the cost per point does not depend on the size of the grid.
+"""
+
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from .stagError import InputGridGeometryError, StagBaseError
+
+
+
+def im(textMessage,pName,verbose):
+    """Print verbose internal message. This function depends on the
+    argument of self.verbose. If self.verbose == True then the message
+    will be displayed on the terminal.
+    <i> : textMessage = str, message to display
+          pName = str, name of the subprogram
+          verbose = bool, condition for the verbose output
+    """
+    if verbose == True:
+        print('>> '+pName+'| '+textMessage)
+
+
+
+def lonlat2xyz(lon,lat,r):
+    """
+    Transforms geographical lon,lat (in *DEGREES*) and r coordinates
+    into x,y,z cartesian coordinates.
+    """
+    lon = np.asarray(lon,dtype=np.float64)*np.pi/180
+    lat = np.asarray(lat,dtype=np.float64)*np.pi/180
+    x = r*np.cos(lat)*np.cos(lon)
+    y = r*np.cos(lat)*np.sin(lon)
+    z = r*np.sin(lat)
+    return x,y,z
+
+
+
+def yy_redflags(y1,lon1,r1):
+    """
+    Returns a boolean mask, True where the points given in the Yin
+    parametrization are removed from the Yin grid (redFlags of
+    stagData.StagYinYangGeometry.stagProcessing).
+    <i> : y1   = np.ndarray, y coordinate in the Yin parametrization
+          lon1 = np.ndarray, longitude (in *RADIANS*) in the Yin parametrization
+          r1   = np.ndarray, radius of the points
+    """
+    theta12 = np.arccos(np.clip(y1/r1,-1,1))
+    return np.logical_or(np.logical_and((theta12>np.pi/4),(lon1>np.pi/2)),\
+                         np.logical_and((theta12<3*np.pi/4),(lon1<-np.pi/2)))
+
+
+
+def _cell_search(coords,values):
+    """
+    Search for each value the index of the lower node of the cell
+    containing it along a 1D axis defined by the sorted array 'coords'
+    and compute the fractional offset in this cell. Points outside the
+    axis are clamped on the first/last cell (offset clipped in [0,1]).
+    <o> : (ind,frac) = np.ndarray(int), np.ndarray(float)
+    """
+    n = len(coords)
+    if n == 1:
+        return np.zeros(values.shape,dtype=np.int64), np.zeros(values.shape)
+    ind  = np.clip(np.searchsorted(coords,values,side='right')-1,0,n-2)
+    frac = (values-coords[ind])/(coords[ind+1]-coords[ind])
+    frac = np.clip(frac,0,1)
+    return ind, frac
+
+
+
+class MainLocator:
+    """
+    Main class defining the highest level of inheritance
+    for the point locators.
+    """
+    def __init__(self,stagData):
+        """
+        Parent builder
+        <i> : stagData = pypStag.stagData.StagData object
+        """
+        self.pName    = 'stagLocator'
+        self.verbose  = stagData.verbose
+        self.geometry = stagData.geometry
+        self.nb = 1           #Number of blocks of the logical grid
+        self.nx = stagData.nx #Number of points on the e1 axis of the logical grid
+        self.ny = stagData.ny #Number of points on the e2 axis of the logical grid
+        self.nz = stagData.nz #Number of points on the e3 axis of the logical grid
+        self.x_coords = np.asarray(stagData.x_coords,dtype=np.float64) #e1 coordinates (after resampling)
+        self.y_coords = np.asarray(stagData.y_coords,dtype=np.float64) #e2 coordinates (after resampling)
+        self.z_coords = np.asarray(stagData.z_coords,dtype=np.float64) #e3 coordinates (selected layers)
+        self.rcmb = stagData.rcmb
+        self.colpos = np.arange(self.nx*self.ny).reshape(self.nx,self.ny) #position of each column in the flat fields
+        self.ncol   = self.nx*self.ny                                      #number of columns per block
+        self.nnodes = self.ncol*self.nz                                    #number of nodes in the flat fields
+
+
+    def im(self,textMessage):
+        """Print verbose internal message. This function depends on the
+        argument of self.verbose. If self.verbose == True then the message
+        will be displayed on the terminal.
+        <i> : textMessage = str, message to display
+        """
+        if self.verbose == True:
+            print('>> '+self.pName+'| '+textMessage)
+
+
+    def index(self,block,i,j,k):
+        """
+        Returns the position of the nodes (block,i,j,k) of the logical grid
+        in the flattened fields of the StagData object (e.g. stagData.v.flatten()).
+        Nodes that are not stored in the StagData object (e.g. Yin-Yang
+        overlapping points) get the index -1.
+        """
+        cp = self.colpos[i,j]
+        return np.where(cp >= 0, (block*self.ncol+cp)*self.nz+k, -1)
+
+
+    def locate_lonlat(self,lon,lat,r=None,depth=None):
+        """
+        Same as self.locate() but for points given in geographical coordinates.
+        <i> : lon,lat = np.ndarray, longitude and latitude in *DEGREES*
+              r       = np.ndarray, radius of the points (same unit as stagData.r).
+              depth   = np.ndarray, depth (in km, same definition as stagData.depths).
+                        If r and depth are None, the points are taken on the
+                        shallowest loaded layer.
+        """
+        lon = np.asarray(lon,dtype=np.float64)
+        if r is None and depth is None:
+            r = self.rcmb+self.z_coords[-1]
+        elif r is None:
+            r = self.rcmb+1-np.asarray(depth,dtype=np.float64)/2890
+        x,y,z = lonlat2xyz(lon,lat,r*np.ones(lon.shape))
+        return self.locate(x,y,z)
+
+
+    def nearest(self,x,y,z):
+        """
+        Returns the position in the flattened fields of the StagData object
+        of the nearest stored grid node of each input point (cartesian coordinates).
+        The search is restricted to the corners of the cells containing the points.
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        gind,nx,ny,nz = self.corners(x,y,z)
+        dist = (nx-x[:,None])**2+(ny-y[:,None])**2+(nz-z[:,None])**2
+        dist[gind < 0] = np.inf
+        best = np.argmin(dist,axis=1)
+        return gind[np.arange(len(x)),best]
+
+
+    def node_xyz(self,block,i,j,k):
+        """
+        Returns the cartesian coordinates of the nodes (block,i,j,k)
+        of the logical grid (overlapping nodes included). For the spherical
+        geometries, (e1,e2) are the Yin parametrization of the block:
+            lat = pi/4 - e1 ,  lon = e2 - 3*pi/4   (Yin)
+            (X,Y,Z) = (-x1,z1,y1)                  (Yang, block 1)
+        """
+        if self.geometry == 'cart3D':
+            return self.x_coords[i], self.y_coords[j], self.z_coords[k]
+        R   = self.rcmb + self.z_coords[k]
+        lat = np.pi/4 - self.x_coords[i]
+        lon = self.y_coords[j] - 3*np.pi/4
+        x1 = R*np.cos(lat)*np.cos(lon)
+        y1 = R*np.cos(lat)*np.sin(lon)
+        z1 = R*np.sin(lat)
+        yin = np.asarray(block) == 0
+        return np.where(yin,x1,-x1), np.where(yin,y1,z1), np.where(yin,z1,y1)
+
+
+    def owner(self,x,y,z):
+        """
+        Returns the block owning each input point (always 0 for single
+        block grids).
+        """
+        return np.zeros(np.shape(x),dtype=np.int64)
+
+
+    def inside(self,x,y,z):
+        """
+        Returns a boolean mask, True for the points located horizontally
+        inside the domain covered by the grid nodes. The radial (e3)
+        direction is never masked: points beyond the first/last layer are
+        attached to this layer.
+        """
+        return np.ones(np.shape(x),dtype=bool)
+
+
+    def inside_block(self,x,y,z,block):
+        """
+        Same as self.inside() but for the logical extent of a given block.
+        """
+        return self.inside(x,y,z)
+
+
+    def corners(self,x,y,z):
+        """
+        Returns the flat indices and the coordinates of the 8 corners of the
+        cells containing the input points, for all the blocks of the grid
+        (arrays of shape (N,8*nb)). Corners absent from the StagData object
+        have the index -1.
+        """
+        gind,cx,cy,cz = [],[],[],[]
+        for b in range(self.nb):
+            block,i,j,k,fi,fj,fk = self.locate(x,y,z,block=b)
+            for di in (0,1):
+                for dj in (0,1):
+                    for dk in (0,1):
+                        ii = np.minimum(i+di,self.nx-1)
+                        jj = np.minimum(j+dj,self.ny-1)
+                        kk = np.minimum(k+dk,self.nz-1)
+                        gind.append(self.index(block,ii,jj,kk))
+                        xn,yn,zn = self.node_xyz(block,ii,jj,kk)
+                        cx.append(xn); cy.append(yn); cz.append(zn)
+        return np.stack(gind,axis=1),np.stack(cx,axis=1),np.stack(cy,axis=1),np.stack(cz,axis=1)
+
+
+
+class YinYangLocator(MainLocator):
+    """
+    Point locator on the Yin-Yang grid of a stagData.StagYinYangGeometry object.
+    The location is analytic: each point is mapped in the Yin parametrization
+    (directly for Yin, with (x1,y1,z1) = (-x,z,y) for Yang), the block is
+    given by the Yin-Yang partition of stagData (redFlags) and indices are
+    then found by a binary search on the 1D coordinates of the logical grid.
+    """
+    def __init__(self,stagData):
+        super().__init__(stagData)
+        if stagData.geometry != 'yy':
+            raise InputGridGeometryError(stagData.geometry)
+        self.pName = 'YinYangLocator'
+        self.nb = 2
+        # --- Columns of the logical grid kept in the non-overlapping grids
+        lat = np.pi/4 - self.x_coords
+        lon = self.y_coords - 3*np.pi/4
+        lat,lon = np.meshgrid(lat,lon,indexing='ij')
+        redf = yy_redflags(np.cos(lat)*np.sin(lon),lon,np.ones(lat.shape))
+        self.colpos = np.cumsum(~redf).reshape(self.nx,self.ny)-1
+        self.colpos[redf] = -1
+        self.ncol = int(np.count_nonzero(~redf))
+        self.nnodes = 2*self.ncol*self.nz
+        if self.nnodes != len(stagData.x):
+            raise StagBaseError('Incoherent Yin-Yang grid: the StagData object has been modified after its processing')
+
+
+    def to_block(self,x,y,z):
+        """
+        Returns the block (0 for Yin, 1 for Yang) owning each input point
+        and the coordinates (x1,y1,z1) of the points in the Yin parametrization
+        of this block.
+        """
+        r   = np.sqrt(x**2+y**2+z**2)
+        r   = np.where(r == 0, 1e-30, r)
+        yin = ~np.logical_or(yy_redflags(y,np.arctan2(y,x),r),np.abs(z/r) > np.sqrt(2)/2)
+        block = np.where(yin,0,1)
+        x1 = np.where(yin,x,-x)
+        y1 = np.where(yin,y,z)
+        z1 = np.where(yin,z,y)
+        return block,x1,y1,z1,r
+
+
+    def owner(self,x,y,z):
+        """
+        Returns the block owning each input point (0 for Yin, 1 for Yang).
+        """
+        return self.to_block(x,y,z)[0]
+
+
+    def locate(self,x,y,z,block=None):
+        """
+        Locates a batch of points on the Yin-Yang logical grid.
+        <i> : x,y,z = np.ndarray, cartesian coordinates of the points
+              block = None or int/np.ndarray, if None the block owning each
+                      point is used. Else, force the location on the given block
+                      (0 for Yin, 1 for Yang), e.g. to work in the overlapping zone.
+        <o> : (block,i,j,k,fi,fj,fk)
+              block = np.ndarray(int), 0 for Yin, 1 for Yang
+              i,j,k = np.ndarray(int), indices of the lower corner of the cell on
+                      the e1, e2 and e3 axis respectively
+              fi,fj,fk = np.ndarray(float), fractional offsets in the cell (in [0,1])
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        if block is None:
+            block,x1,y1,z1,r = self.to_block(x,y,z)
+        else:
+            block = np.broadcast_to(np.asarray(block,dtype=np.int64),x.shape)
+            r  = np.sqrt(x**2+y**2+z**2)
+            x1 = np.where(block == 0,x,-x)
+            y1 = np.where(block == 0,y,z)
+            z1 = np.where(block == 0,z,y)
+        # --- inversion of rectangular2YY
+        e1 = np.pi/4 - np.arcsin(np.clip(z1/np.where(r == 0,1e-30,r),-1,1))
+        e2 = np.arctan2(y1,x1) + 3*np.pi/4
+        e3 = r - self.rcmb
+        i,fi = _cell_search(self.x_coords,e1)
+        j,fj = _cell_search(self.y_coords,e2)
+        k,fk = _cell_search(self.z_coords,e3)
+        return block,i,j,k,fi,fj,fk
+
+
+    def inside_block(self,x,y,z,block):
+        """
+        Returns a boolean mask, True for the points inside the angular
+        extent of the logical grid of the given block (0 for Yin, 1 for Yang),
+        overlapping zone included.
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        r  = np.sqrt(x**2+y**2+z**2)
+        x1 = np.where(block == 0,x,-x)
+        y1 = np.where(block == 0,y,z)
+        z1 = np.where(block == 0,z,y)
+        e1 = np.pi/4 - np.arcsin(np.clip(z1/np.where(r == 0,1e-30,r),-1,1))
+        e2 = np.arctan2(y1,x1) + 3*np.pi/4
+        tol = 1e-6 #tolerance for nodes stored in simple precision
+        return (e1 >= self.x_coords[0]-tol)*(e1 <= self.x_coords[-1]+tol)*\
+               (e2 >= self.y_coords[0]-tol)*(e2 <= self.y_coords[-1]+tol)
+
+
+
+
+class SphericalLocator(MainLocator):
+    """
+    Point locator on the grid of a 3D stagData.StagSphericalGeometry object.
+    The spherical grid is a single block bent like the Yin grid, so that the
+    location uses the same analytic inversion as the YinYangLocator.
+    """
+    def __init__(self,stagData):
+        super().__init__(stagData)
+        if stagData.geometry != 'spherical':
+            raise InputGridGeometryError(stagData.geometry)
+        self.pName = 'SphericalLocator'
+
+
+    def locate(self,x,y,z,block=None):
+        """
+        Locates a batch of points on the spherical logical grid.
+        <i> : x,y,z = np.ndarray, cartesian coordinates of the points
+              block = ignored, only here for compatibility with the YinYangLocator
+        <o> : (block,i,j,k,fi,fj,fk) as in YinYangLocator.locate()
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        r  = np.sqrt(x**2+y**2+z**2)
+        e1 = np.pi/4 - np.arcsin(np.clip(z/np.where(r == 0,1e-30,r),-1,1))
+        e2 = np.arctan2(y,x) + 3*np.pi/4
+        e3 = r - self.rcmb
+        i,fi = _cell_search(self.x_coords,e1)
+        j,fj = _cell_search(self.y_coords,e2)
+        k,fk = _cell_search(self.z_coords,e3)
+        return np.zeros(x.shape,dtype=np.int64),i,j,k,fi,fj,fk
+
+
+    def inside(self,x,y,z):
+        """
+        Returns a boolean mask, True for the points inside the angular
+        extent of the grid nodes.
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        r  = np.sqrt(x**2+y**2+z**2)
+        e1 = np.pi/4 - np.arcsin(np.clip(z/np.where(r == 0,1e-30,r),-1,1))
+        e2 = np.arctan2(y,x) + 3*np.pi/4
+        tol = 1e-6 #tolerance for nodes stored in simple precision
+        return (e1 >= self.x_coords[0]-tol)*(e1 <= self.x_coords[-1]+tol)*\
+               (e2 >= self.y_coords[0]-tol)*(e2 <= self.y_coords[-1]+tol)
+
+
+
+class CartesianLocator(MainLocator):
+    """
+    Point locator on the grid of a 3D stagData.StagCartesianGeometry object.
+    """
+    def __init__(self,stagData):
+        super().__init__(stagData)
+        if stagData.geometry != 'cart3D':
+            raise InputGridGeometryError(stagData.geometry)
+        self.pName = 'CartesianLocator'
+
+
+    def locate(self,x,y,z,block=None):
+        """
+        Locates a batch of points on the cartesian grid.
+        <i> : x,y,z = np.ndarray, cartesian coordinates of the points
+              block = ignored, only here for compatibility with the YinYangLocator
+        <o> : (block,i,j,k,fi,fj,fk) as in YinYangLocator.locate()
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        z = np.atleast_1d(np.asarray(z,dtype=np.float64))
+        i,fi = _cell_search(self.x_coords,x)
+        j,fj = _cell_search(self.y_coords,y)
+        k,fk = _cell_search(self.z_coords,z)
+        return np.zeros(x.shape,dtype=np.int64),i,j,k,fi,fj,fk
+
+
+    def inside(self,x,y,z):
+        """
+        Returns a boolean mask, True for the points inside the horizontal
+        extent of the grid nodes.
+        """
+        x = np.atleast_1d(np.asarray(x,dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y,dtype=np.float64))
+        return (x >= self.x_coords[0])*(x <= self.x_coords[-1])*\
+               (y >= self.y_coords[0])*(y <= self.y_coords[-1])
+
+
+
+def get_locator(stagData):
+    """
+    Returns the point locator adapted to the geometry of the input
+    stagData object.
+    <i> : stagData = pypStag.stagData.StagData object
+    """
+    if stagData.geometry == 'yy':
+        return YinYangLocator(stagData)
+    elif stagData.geometry == 'spherical':
+        return SphericalLocator(stagData)
+    elif stagData.geometry == 'cart3D':
+        return CartesianLocator(stagData)
+    else:
+        raise InputGridGeometryError(stagData.geometry)
+
+
+
+def trilinear_operator(locator,x,y,z):
+    """
+    Builds the sparse interpolation operator W mapping the flattened fields
+    of a StagData object on a batch of points, using trilinear weights on
+    the cells of the native logical grid. The interpolated values are then
+    obtained for any field (and any time step on the same grid) with
+    a single sparse product:   values = W.dot(field.flatten())
+    On Yin-Yang grids, the cell of the block owning the point is used. When
+    some of its corners are not stored (overlapping zone), the other block
+    is used if it covers the point better, and the weights are normalized
+    on the available corners.
+    <i> : locator = a locator returned by get_locator()
+          x,y,z   = np.ndarray, cartesian coordinates of the points
+    <o> : (W,valid)
+          W     = scipy.sparse.csr_matrix of shape (npoints,locator.nnodes)
+          valid = np.ndarray(bool), False for points outside the grid
+                  (the corresponding rows of W are empty)
+    """
+    x = np.atleast_1d(np.asarray(x,dtype=np.float64)).flatten()
+    y = np.atleast_1d(np.asarray(y,dtype=np.float64)).flatten()
+    z = np.atleast_1d(np.asarray(z,dtype=np.float64)).flatten()
+    npts = len(x)
+    own  = locator.owner(x,y,z)
+    gind  = np.zeros((npts,8),dtype=np.int64)
+    w     = np.zeros((npts,8))
+    score = np.zeros(npts)
+    rank  = np.full(npts,-1.0)
+    for b in range(locator.nb):
+        block,i,j,k,fi,fj,fk = locator.locate(x,y,z,block=b)
+        gb = np.empty((npts,8),dtype=np.int64)
+        wb = np.empty((npts,8))
+        n = 0
+        for di,wi in ((0,1-fi),(1,fi)):
+            for dj,wj in ((0,1-fj),(1,fj)):
+                for dk,wk in ((0,1-fk),(1,fk)):
+                    ii = np.minimum(i+di,locator.nx-1)
+                    jj = np.minimum(j+dj,locator.ny-1)
+                    kk = np.minimum(k+dk,locator.nz-1)
+                    gb[:,n] = locator.index(block,ii,jj,kk)
+                    wb[:,n] = wi*wj*wk
+                    n += 1
+        wb[gb < 0] = 0
+        gb[gb < 0] = 0
+        sb = wb.sum(axis=1)
+        # blocks whose logical extent contains the point come first (the
+        # indices are clipped, i.e. the field extrapolated, outside of it)
+        rb = sb + 2*np.logical_and(locator.inside_block(x,y,z,b),sb > 0)
+        # keep the owner block except if the other one covers better the point
+        better = np.logical_or(rb > rank+1e-9, np.logical_and(own == b, rb >= rank-1e-9))
+        gind[better]  = gb[better]
+        w[better]     = wb[better]
+        score[better] = sb[better]
+        rank[better]  = rb[better]
+    valid = np.logical_and(locator.inside(x,y,z),score > 0)
+    w[valid] = w[valid]/score[valid][:,None]
+    w[~valid] = 0
+    W = csr_matrix((w.flatten(),gind.flatten(),np.arange(0,8*npts+1,8)),shape=(npts,locator.nnodes))
+    return W,valid
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:00:00 2026
+
+@author: Alexandre Janin
+@Aim: Differential operators on the Yin-Yang and spherical grids of StagData objects
+"""
+
+
+"""
+This script contains the differential operators of pypStag for the 3D spherical
+grids (Yin-Yang and spherical). The operators are compiled once per grid into
+sparse matrices acting on the flattened fields of the StagData object, so that
+applying them on a new field (or a new time step on the same grid) is a single
+sparse product:   result = D.dot(field.flatten())
+The derivatives are computed with 3 points finite differences on the logical grid
+of the block containing each node, in its local spherical coordinates
+        theta = pi/4 + e1 (colatitude), phi = e2 - 3*pi/4, r = rcmb + e3
+The neighbours that are not stored in the StagData object (Yin-Yang overlapping
+zone, edges of the blocks) are interpolated (trilinear) on a complete cell of the
+other block. The stencils using only stored nodes are preferred (shifted on one
+side if needed) since the interpolation error is amplified by the differences.
+Vector fields are taken and returned in cartesian
+components (stagData.vx, vy, vz), the metric terms being carried by the local
+spherical basis of each node.
+"""
+
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, identity
+from time import time
+from .stagError import InputGridGeometryError
+
+
+
+def im(textMessage,pName,verbose):
+    """Print verbose internal message. This function depends on the
+    argument of self.verbose. If self.verbose == True then the message
+    will be displayed on the terminal.
+    <i> : textMessage = str, message to display
+          pName = str, name of the subprogram
+          verbose = bool, condition for the verbose output
+    """
+    if verbose == True:
+        print('>> '+pName+'| '+textMessage)
+
+
+
+def _lagrange_weights(xs,x0,order):
+    """
+    Returns the weights of the derivative of order 1 or 2 at x0 of the
+    Lagrange polynomial through the nodes xs.
+    <i> : xs = list of np.ndarray, coordinates of the nodes (vectorized on the points)
+          x0 = np.ndarray, coordinates where the derivative is evaluated
+          order = int, 1 or 2
+    <o> : list of np.ndarray, weights of each node
+    """
+    n = len(xs)
+    weights = []
+    for a in range(n):
+        den = np.ones(x0.shape)
+        for l in range(n):
+            if l != a:
+                den = den*(xs[a]-xs[l])
+        num = np.zeros(x0.shape)
+        for m in range(n):
+            if m == a:
+                continue
+            if order == 1:
+                prod = np.ones(x0.shape)
+                for l in range(n):
+                    if l not in (a,m):
+                        prod = prod*(x0-xs[l])
+                num = num+prod
+            else:
+                for q in range(n):
+                    if q in (a,m):
+                        continue
+                    prod = np.ones(x0.shape)
+                    for l in range(n):
+                        if l not in (a,m,q):
+                            prod = prod*(x0-xs[l])
+                    num = num+prod
+        weights.append(num/den)
+    return weights
+
+
+
+class SphericalOperators:
+    """
+    Differential operators on the grid of a stagData.StagYinYangGeometry or of a
+    3D stagData.StagSphericalGeometry object, compiled into sparse matrices.
+    Available operators (inputs and outputs are flattened fields, in the order of
+    the fields of the StagData object):
+        gradient(f)                -> (gx,gy,gz)
+        divergence(vx,vy,vz)       -> div
+        curl(vx,vy,vz)             -> (wx,wy,wz)
+        hdivergence(vx,vy,vz)      -> horizontal divergence (of the tangential velocity)
+        radial_vorticity(vx,vy,vz) -> radial component of the curl
+        laplacian(f)               -> laplacian
+    Each operator is compiled on its first call and then reused.
+    """
+    def __init__(self,stagData,verbose=True):
+        """
+        <i> : stagData = pypStag.stagData.StagYinYangGeometry or StagSphericalGeometry
+                         object (stagProcessing done)
+              verbose = bool, controls inhibition of the internal message
+        """
+        from .stagLocator import get_locator
+        if stagData.geometry not in ('yy','spherical'):
+            raise InputGridGeometryError(stagData.geometry)
+        time0 = time()
+        self.pName    = 'SphericalOperators'
+        self.verbose  = verbose
+        self.geometry = stagData.geometry
+        self.locator  = get_locator(stagData)
+        self.locator.verbose = False
+        loc = self.locator
+        self.nnodes = loc.nnodes
+        self.im('Compilation of the derivatives on '+str(self.nnodes)+' nodes')
+        # --- logical position of the stored nodes
+        ci,cj = np.meshgrid(np.arange(loc.nx),np.arange(loc.ny),indexing='ij')
+        cp = loc.colpos.flatten()
+        order = np.argsort(np.where(cp >= 0,cp,loc.ncol+1),kind='stable')[0:loc.ncol]
+        ci,cj = ci.flatten()[order],cj.flatten()[order]
+        self.block = np.repeat(np.arange(loc.nb),loc.ncol*loc.nz)
+        self.i = np.tile(np.repeat(ci,loc.nz),loc.nb)
+        self.j = np.tile(np.repeat(cj,loc.nz),loc.nb)
+        self.k = np.tile(np.arange(loc.nz),loc.nb*loc.ncol)
+        # --- local spherical coordinates and basis (cartesian components)
+        self.theta = np.pi/4+loc.x_coords[self.i]
+        self.phi   = loc.y_coords[self.j]-3*np.pi/4
+        self.r     = loc.rcmb+loc.z_coords[self.k]
+        st,ct = np.sin(self.theta),np.cos(self.theta)
+        sp,cp = np.sin(self.phi),np.cos(self.phi)
+        self.er = self.__to_global(np.array([st*cp,st*sp,ct]))
+        self.et = self.__to_global(np.array([ct*cp,ct*sp,-st]))
+        self.ep = self.__to_global(np.array([-sp,cp,np.zeros(len(sp))]))
+        # --- first and second derivatives along each local axis
+        self.D1 = {}
+        self.D2 = {}
+        for axis in ('r','theta','phi'):
+            self.D1[axis],self.D2[axis] = self.__derivatives(axis)
+        self.ops = {}
+        self.im('Compilation done in '+str(time()-time0)[0:5]+' s')
+
+
+    def im(self,textMessage):
+        """Print verbose internal message. This function depends on the
+        argument of self.verbose. If self.verbose == True then the message
+        will be displayed on the terminal.
+        <i> : textMessage = str, message to display
+        """
+        if self.verbose == True:
+            print('>> '+self.pName+'| '+textMessage)
+
+
+    def __to_global(self,vec):
+        """
+        Returns the cartesian components (3,N) of vectors given in the
+        Yin parametrization of the block of each node.
+        """
+        yang = self.block == 1
+        return np.array([np.where(yang,-vec[0],vec[0]),\
+                         np.where(yang,vec[2],vec[1]),\
+                         np.where(yang,vec[1],vec[2])])
+
+
+    def __coordinate(self,axis,shift):
+        """
+        Returns the (extrapolated if out of the grid) local coordinate of
+        the neighbours of all the nodes shifted of 'shift' along 'axis'.
+        """
+        loc = self.locator
+        if axis == 'theta':
+            c,ind,off = loc.x_coords,self.i,np.pi/4
+        elif axis == 'phi':
+            c,ind,off = loc.y_coords,self.j,-3*np.pi/4
+        else:
+            c,ind,off = loc.z_coords,self.k,loc.rcmb
+        n = len(c)
+        h0 = c[1]-c[0] if n > 1 else 1.
+        h1 = c[-1]-c[-2] if n > 1 else 1.
+        s = ind+shift
+        out = np.where(s < 0,c[0]+s*h0,np.where(s > n-1,c[-1]+(s-n+1)*h1,c[np.clip(s,0,n-1)]))
+        return out+off
+
+
+    def __shift(self,axis,shift):
+        """
+        Returns the sparse operator S giving the field on the neighbours of all the
+        nodes shifted of 'shift' along 'axis' (identity rows for the stored
+        neighbours, interpolation rows for the others), and the mask of the
+        nodes for which this neighbour is available.
+        """
+        loc = self.locator
+        i,j,k = self.i.copy(),self.j.copy(),self.k.copy()
+        if axis == 'theta':
+            i += shift; n = loc.nx; s = i
+        elif axis == 'phi':
+            j += shift; n = loc.ny; s = j
+        else:
+            k += shift; n = loc.nz; s = k
+        inrange = np.logical_and(s >= 0,s <= n-1)
+        gind = np.full(self.nnodes,-1,dtype=np.int64)
+        gind[inrange] = loc.index(self.block[inrange],i[inrange],j[inrange],k[inrange])
+        stored = gind >= 0
+        rows = [np.where(stored)[0]]
+        cols = [gind[stored]]
+        vals = [np.ones(np.count_nonzero(stored))]
+        ok = stored.copy()
+        # neighbours to interpolate (not for the radial axis: same column)
+        missing = np.where(~stored)[0]
+        if axis != 'r' and len(missing) > 0:
+            theta = self.__coordinate('theta',shift if axis == 'theta' else 0)[missing]
+            phi   = self.__coordinate('phi',shift if axis == 'phi' else 0)[missing]
+            r     = self.r[missing]
+            vec = np.zeros((3,self.nnodes))
+            vec[:,missing] = np.array([r*np.sin(theta)*np.cos(phi),r*np.sin(theta)*np.sin(phi),r*np.cos(theta)])
+            x,y,z = self.__to_global(vec)[:,missing]
+            # trilinear interpolation on a cell of the other block (then of the same
+            # block) having its 8 corners stored. Else, the neighbour is not available
+            # and the stencil is shifted.
+            todo = np.ones(len(missing),dtype=bool)
+            for rel in (1,0):
+                if loc.nb == 1 and rel == 1:
+                    continue
+                b = (self.block[missing]+rel)%loc.nb
+                blk,ii,jj,kk,fi,fj,fk = loc.locate(x,y,z,block=b)
+                inside = loc.inside_block(x,y,z,b)
+                gi = np.zeros((len(missing),8),dtype=np.int64)
+                wi = np.zeros((len(missing),8))
+                n = 0
+                for di,wx in ((0,1-fi),(1,fi)):
+                    for dj,wy in ((0,1-fj),(1,fj)):
+                        for dk,wz in ((0,1-fk),(1,fk)):
+                            gi[:,n] = loc.index(b,np.minimum(ii+di,loc.nx-1),np.minimum(jj+dj,loc.ny-1),np.minimum(kk+dk,loc.nz-1))
+                            wi[:,n] = wx*wy*wz
+                            n += 1
+                full = np.logical_and(todo,np.logical_and(inside,np.all(gi >= 0,axis=1)))
+                rows.append(np.repeat(missing[full],8))
+                cols.append(gi[full].flatten())
+                vals.append(wi[full].flatten())
+                ok[missing[full]] = True
+                todo[full] = False
+        S = csr_matrix((np.concatenate(vals),(np.concatenate(rows),np.concatenate(cols))),shape=(self.nnodes,self.nnodes))
+        return S,stored,ok
+
+
+    def __derivatives(self,axis):
+        """
+        Builds the sparse operators of the first and second derivatives along
+        'axis': 3 points centered stencils where the two neighbours are available,
+        else shifted on one side (3 points for the first derivative, 4 points for
+        the second one, both of second order).
+        """
+        S = {}
+        stored = {}
+        ok = {}
+        x = {}
+        for shift in (-3,-2,-1,1,2,3):
+            S[shift],stored[shift],ok[shift] = self.__shift(axis,shift)
+            x[shift] = self.__coordinate(axis,shift)
+        S[0] = identity(self.nnodes,format='csr')
+        x[0] = self.__coordinate(axis,0)
+        out = []
+        for order,stencils in ((1,((-1,0,1),(0,1,2),(-2,-1,0))),(2,((-1,0,1),(0,1,2,3),(-3,-2,-1,0)))):
+            # choice of the stencil of each node: the stencils on stored nodes only
+            # first (the interpolation error of a neighbour is amplified by the
+            # finite differences), then the ones using interpolated neighbours.
+            D = csr_matrix((self.nnodes,self.nnodes))
+            done = np.zeros(self.nnodes,dtype=bool)
+            for avail in (stored,ok):
+                for shifts in stencils:
+                    mask = ~done
+                    for sh in shifts:
+                        if sh != 0:
+                            mask = np.logical_and(mask,avail[sh])
+                    if not np.any(mask):
+                        continue
+                    done = np.logical_or(done,mask)
+                    xs = [np.where(mask,x[sh],n) for n,sh in enumerate(shifts)]
+                    weights = _lagrange_weights(xs,np.where(mask,x[0],0),order)
+                    m = mask.astype(np.float64)
+                    for sh,w in zip(shifts,weights):
+                        D = D+diags(m*w).dot(S[sh])
+            D.eliminate_zeros()
+            out.append(D.tocsr())
+        return out[0],out[1]
+
+
+    def __compile(self,name):
+        """
+        Compiles (once) the sparse operator(s) named 'name' in
+        ('grad','gradh','hdiv','vor_r','lap').
+        """
+        if name in self.ops:
+            return self.ops[name]
+        self.im('Compilation of the operator: '+name)
+        Dr,Dt,Dp = self.D1['r'],self.D1['theta'],self.D1['phi']
+        r  = self.r
+        st = np.sin(self.theta)
+        if name == 'gradh':
+            # horizontal part of the gradient (cartesian components)
+            self.ops[name] = [(diags(self.et[c]/r).dot(Dt)+diags(self.ep[c]/(r*st)).dot(Dp)).tocsr() for c in range(3)]
+        elif name == 'grad':
+            Gh = self.__compile('gradh')
+            self.ops[name] = [(diags(self.er[c]).dot(Dr)+Gh[c]).tocsr() for c in range(3)]
+        elif name == 'hdiv':
+            Gh = self.__compile('gradh')
+            self.ops[name] = [(Gh[c]-diags(2*self.er[c]/r)).tocsr() for c in range(3)]
+        elif name == 'vor_r':
+            Gh = self.__compile('gradh')
+            er = self.er
+            self.ops[name] = [(diags(er[1]).dot(Gh[2])-diags(er[2]).dot(Gh[1])).tocsr(),\
+                              (diags(er[2]).dot(Gh[0])-diags(er[0]).dot(Gh[2])).tocsr(),\
+                              (diags(er[0]).dot(Gh[1])-diags(er[1]).dot(Gh[0])).tocsr()]
+        elif name == 'lap':
+            L = self.D2['r']+diags(2/r).dot(Dr)+\
+                diags(1/r**2).dot(self.D2['theta']+diags(np.cos(self.theta)/st).dot(Dt))+\
+                diags(1/(r*st)**2).dot(self.D2['phi'])
+            self.ops[name] = L.tocsr()
+        return self.ops[name]
+
+
+    def gradient(self,f):
+        """
+        Returns the cartesian components of the gradient of a scalar field.
+        <i> : f = np.ndarray, scalar field (e.g. stagData.v)
+        <o> : (gx,gy,gz) = np.ndarray
+        """
+        f = np.asarray(f,dtype=np.float64).flatten()
+        return tuple(G.dot(f) for G in self.__compile('grad'))
+
+
+    def divergence(self,vx,vy,vz):
+        """
+        Returns the divergence of a vector field given in cartesian components.
+        <i> : vx,vy,vz = np.ndarray (e.g. stagData.vx, stagData.vy, stagData.vz)
+        """
+        G = self.__compile('grad')
+        return sum(G[c].dot(np.asarray(v,dtype=np.float64).flatten()) for c,v in enumerate((vx,vy,vz)))
+
+
+    def curl(self,vx,vy,vz):
+        """
+        Returns the cartesian components of the curl of a vector field given
+        in cartesian components.
+        <i> : vx,vy,vz = np.ndarray (e.g. stagData.vx, stagData.vy, stagData.vz)
+        <o> : (wx,wy,wz) = np.ndarray
+        """
+        Gx,Gy,Gz = self.__compile('grad')
+        vx,vy,vz = [np.asarray(v,dtype=np.float64).flatten() for v in (vx,vy,vz)]
+        return Gy.dot(vz)-Gz.dot(vy), Gz.dot(vx)-Gx.dot(vz), Gx.dot(vy)-Gy.dot(vx)
+
+
+    def hdivergence(self,vx,vy,vz):
+        """
+        Returns the horizontal divergence (divergence of the tangential part
+        on the spheres) of a vector field given in cartesian components:
+            1/(r sin(theta)) * ( d(sin(theta) vtheta)/dtheta + dvphi/dphi )
+        <i> : vx,vy,vz = np.ndarray (e.g. stagData.vx, stagData.vy, stagData.vz)
+        """
+        H = self.__compile('hdiv')
+        return sum(H[c].dot(np.asarray(v,dtype=np.float64).flatten()) for c,v in enumerate((vx,vy,vz)))
+
+
+    def radial_vorticity(self,vx,vy,vz):
+        """
+        Returns the radial component of the curl of a vector field given in
+        cartesian components:
+            1/(r sin(theta)) * ( d(sin(theta) vphi)/dtheta - dvtheta/dphi )
+        <i> : vx,vy,vz = np.ndarray (e.g. stagData.vx, stagData.vy, stagData.vz)
+        """
+        W = self.__compile('vor_r')
+        return sum(W[c].dot(np.asarray(v,dtype=np.float64).flatten()) for c,v in enumerate((vx,vy,vz)))
+
+
+    def laplacian(self,f):
+        """
+        Returns the laplacian of a scalar field.
+        <i> : f = np.ndarray, scalar field (e.g. stagData.v)
+        """
+        return self.__compile('lap').dot(np.asarray(f,dtype=np.float64).flatten())
+
+
+
+_operators_cache = {} # operators of the last grid, see get_operators
+
+
+def get_operators(stagData,verbose=True):
+    """
+    Returns the SphericalOperators object of the grid of the input stagData object.
+    The operators of the last grid are kept in memory, so that the successive
+    calls on the same grid (e.g. on all the snapshots of a simulation) only
+    apply the already compiled sparse matrices.
+    <i> : stagData = pypStag.stagData.StagYinYangGeometry or StagSphericalGeometry object
+          verbose  = bool, controls inhibition of the internal message
+    """
+    from .stagInterpolator import grid_hash
+    key = (stagData.geometry,grid_hash(np.asarray(stagData.x_coords),np.asarray(stagData.y_coords),\
+                                       np.asarray(stagData.z_coords)),stagData.rcmb,len(stagData.x))
+    if key not in _operators_cache:
+        _operators_cache.clear()
+        _operators_cache[key] = SphericalOperators(stagData,verbose=verbose)
+    else:
+        im('Reuse of the operators of the grid',pName='get_operators',verbose=verbose)
+    ops = _operators_cache[key]
+    ops.verbose = verbose
+    return ops